@@ -0,0 +1,409 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from Libs.DataLib.db_helpers import *
+except ImportError:
+    from DataLib.db_helpers import *
+
+
+DEF_ASYNC_READER_COUNT = 4
+
+# MOST QUEUED WRITE REQUESTS THE WRITER THREAD RUNS IN ONE TRANSACTION
+DEF_ASYNC_WRITE_BATCH_SIZE = 256
+
+# MOST FETCHED BATCHES AN ASYNC ITERATOR BUFFERS BEFORE ITS READER THREAD WAITS FOR THE CONSUMER
+DEF_ASYNC_ITER_QUEUE_SIZE = 4
+# HOW OFTEN A READER THREAD WAITING ON A FULL ITERATOR QUEUE CHECKS WHETHER THE CONSUMER WENT AWAY
+DEF_ASYNC_ITER_PUT_TIMEOUT_SEC = 0.1
+
+
+class AsyncDBTableInterface:
+    """
+    Asyncio front-end mirroring DBTableInterface. Writes are queued to one dedicated writer thread, which runs every
+    request waiting in its queue in a single transaction (one commit for the whole group). Reads run on a small pool
+    of reader threads with their own connections, in WAL mode they never wait on the writer.
+    Every method returns an awaitable giving the same (data, error) the sync method returns, the streaming selects
+    give (async_row_iter, error).
+        table = AsyncDBTableInterface(db_path, TestTableInfo.table_info_dict())
+        await table.db_table_init()
+        data, error = await table.db_insert_into_table(val_tuple)
+        row_iter, error = await table.db_iter_all_from_table()
+        async for row in row_iter:
+            ...
+        await table.close()
+    """
+    def __init__(self, db_path, table_info_dict, reader_count=DEF_ASYNC_READER_COUNT, row_format=RowFormats.DICT,
+                 profile=None, write_batch_size=DEF_ASYNC_WRITE_BATCH_SIZE, cache_size=None, cache_ttl_sec=None):
+        self.db_path = db_path
+        self.profile = profile
+        self.write_batch_size = write_batch_size
+
+        # READERS, POOL OF ONE CONNECTION PER READER THREAD
+        self.__read_manager = DBConnectionManager(db_path, pool_size=reader_count, profile=profile)
+        # THE READERS' ROW CACHE SEES THE WRITER'S COMMITS THROUGH PRAGMA data_version
+        self.__read_table = DBTableInterface(self.__read_manager, table_info_dict, row_format, cache_size, cache_ttl_sec)
+        self.__reader_pool = ThreadPoolExecutor(reader_count, thread_name_prefix='db_reader')
+
+        # WRITER, ITS CONNECTION IS OPENED INSIDE THE WRITER THREAD
+        self.__table_info_dict = table_info_dict
+        self.__row_format = row_format
+        self.__write_queue = queue.Queue()
+        self.__write_lock = threading.Lock()
+        self.__writer_error = None
+        self.__iter_stop_events = set()
+        self.__writer_thread = threading.Thread(target=self.__writer_loop, name='db_writer', daemon=True)
+        self.__writer_thread.start()
+
+    @property
+    def table_info_dict(self):
+        return self.__read_table.table_info_dict
+
+    async def close(self):
+        """
+        Finish every queued write, then stop the writer and reader threads and close their connections.
+        :return: None
+        """
+        self.__write_queue.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self.__writer_thread.join)
+        # ASYNC ITERATORS NEVER ITERATED TO THE END (OR AT ALL) STILL HOLD A READER THREAD, STOP THEM
+        for stop_event in list(self.__iter_stop_events):
+            stop_event.set()
+        self.__reader_pool.shutdown(wait=True)
+        self.__read_manager.close_all()
+
+    ###########################################################
+    # GENERIC
+    ###########################################################
+
+    async def run_write(self, table_func):
+        """
+        Run any DBTableInterface method on the writer thread, e.g. await table.run_write(lambda t: t.db_drop_table())
+        :param table_func: function called with the writer's DBTableInterface
+        :return: whatever table_func returns
+        """
+        future = Future()
+        # THE LOCK KEEPS A REQUEST FROM SLIPPING INTO THE QUEUE WHILE A FAILED WRITER DRAINS IT
+        with self.__write_lock:
+            if self.__writer_error is not None:
+                raise self.__writer_error
+            self.__write_queue.put((table_func, future))
+        return await asyncio.wrap_future(future)
+
+    async def run_read(self, table_func):
+        """
+        Run any DBTableInterface method on a reader thread, e.g. await table.run_read(lambda t: t.db_check_table_exists())
+        :param table_func: function called with the readers' DBTableInterface
+        :return: whatever table_func returns
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__reader_pool, table_func, self.__read_table)
+
+    ###########################################################
+    # WRITE OPERATIONS
+    ###########################################################
+
+    async def db_table_init(self):
+        return await self.run_write(lambda table: table.db_table_init())
+
+    async def db_create_table(self):
+        return await self.run_write(lambda table: table.db_create_table())
+
+    async def db_alter_table(self, old_table_col_dict=None):
+        return await self.run_write(lambda table: table.db_alter_table(old_table_col_dict))
+
+    async def db_drop_table(self):
+        return await self.run_write(lambda table: table.db_drop_table())
+
+    async def db_insert_into_table(self, val_tuple):
+        return await self.run_write(lambda table: table.db_insert_into_table(val_tuple))
+
+    async def db_insert_many(self, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        return await self.run_write(lambda table: table.db_insert_many(val_tuples, chunk_size))
+
+    async def db_upsert(self, val_tuple, update_column_names=None, conflict_column_names=None):
+        result = await self.run_write(lambda table: table.db_upsert(val_tuple, update_column_names, conflict_column_names))
+        compiled_table = self.__read_table.compiled_table
+        row_cache = self.__read_table.row_cache
+        if row_cache is not None and \
+                compiled_table.get_conflict_column_names(conflict_column_names) != (compiled_table.first_column_name,):
+            # A CONFLICT ON ANY OTHER COLUMNS CAN UPDATE THE ROW OF A DIFFERENT FIRST COLUMN KEY, DROP THE READERS'
+            # CACHE NOW INSTEAD OF WAITING FOR THEIR NEXT data_version CHECK
+            row_cache.clear()
+        return result
+
+    async def db_upsert_many(self, val_tuples, update_column_names=None, conflict_column_names=None,
+                             chunk_size=DEF_BULK_CHUNK_SIZE):
+        return await self.run_write(
+            lambda table: table.db_upsert_many(val_tuples, update_column_names, conflict_column_names, chunk_size))
+
+    async def db_replace_into_table(self, val_tuple):
+        return await self.run_write(lambda table: table.db_replace_into_table(val_tuple))
+
+    async def db_replace_many(self, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        return await self.run_write(lambda table: table.db_replace_many(val_tuples, chunk_size))
+
+    async def db_update_where_first_column_equals(self, val_tuple, first_column_val):
+        return await self.run_write(lambda table: table.db_update_where_first_column_equals(val_tuple, first_column_val))
+
+    async def db_update_many(self, update_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        return await self.run_write(lambda table: table.db_update_many(update_tuples, chunk_size))
+
+    async def db_delete_where_first_column_equals(self, first_column_val):
+        return await self.run_write(lambda table: table.db_delete_where_first_column_equals(first_column_val))
+
+    async def db_delete_many_by_first_column(self, first_column_vals, chunk_size=DEF_BULK_CHUNK_SIZE):
+        return await self.run_write(lambda table: table.db_delete_many_by_first_column(first_column_vals, chunk_size))
+
+    async def db_delete_where_first_column_in(self, first_column_vals, chunk_size=DEF_IN_CHUNK_SIZE):
+        return await self.run_write(lambda table: table.db_delete_where_first_column_in(first_column_vals, chunk_size))
+
+    async def db_write_blob_from_file(self, first_column_val, column_name, file_obj, size=None,
+                                      buffer_size=DEF_BLOB_BUFFER_SIZE):
+        return await self.run_write(
+            lambda table: table.db_write_blob_from_file(first_column_val, column_name, file_obj, size, buffer_size))
+
+    async def db_delete_all_from_table(self):
+        return await self.run_write(lambda table: table.db_delete_all_from_table())
+
+    ###########################################################
+    # READ OPERATIONS
+    ###########################################################
+
+    async def db_select_all_from_table(self, row_format=None):
+        return await self.run_read(lambda table: table.db_select_all_from_table(row_format))
+
+    async def db_select_all_where_first_column_equals(self, first_column_val, row_format=None):
+        return await self.run_read(lambda table: table.db_select_all_where_first_column_equals(first_column_val, row_format))
+
+    async def db_iter_all_from_table(self, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+        return await self.__iter_rows(lambda table: table.db_iter_all_from_table(batch_size, row_format), batch_size)
+
+    async def db_iter_where_first_column_equals(self, first_column_val, batch_size=DEF_FETCH_BATCH_SIZE,
+                                                row_format=RowFormats.TUPLE):
+        return await self.__iter_rows(
+            lambda table: table.db_iter_where_first_column_equals(first_column_val, batch_size, row_format), batch_size)
+
+    async def db_select_where_first_column_in(self, first_column_vals, row_format=None, chunk_size=DEF_IN_CHUNK_SIZE):
+        return await self.run_read(lambda table: table.db_select_where_first_column_in(first_column_vals, row_format, chunk_size))
+
+    async def db_iter_where_first_column_in(self, first_column_vals, batch_size=DEF_FETCH_BATCH_SIZE,
+                                            row_format=RowFormats.TUPLE, chunk_size=DEF_IN_CHUNK_SIZE):
+        return await self.__iter_rows(
+            lambda table: table.db_iter_where_first_column_in(first_column_vals, batch_size, row_format, chunk_size),
+            batch_size)
+
+    async def db_copy_blob_to_file(self, first_column_val, column_name, file_obj, buffer_size=DEF_BLOB_BUFFER_SIZE):
+        return await self.run_read(
+            lambda table: table.db_copy_blob_to_file(first_column_val, column_name, file_obj, buffer_size))
+
+    async def db_select_columns_as_arrays(self, column_names=None, where_query=None, use_numpy=None):
+        return await self.run_read(lambda table: table.db_select_columns_as_arrays(column_names, where_query, use_numpy))
+
+    async def db_create_change_feed(self):
+        return await self.run_write(lambda table: table.db_create_change_feed())
+
+    async def db_drop_change_feed(self):
+        return await self.run_write(lambda table: table.db_drop_change_feed())
+
+    async def db_get_last_change_seq(self):
+        return await self.run_read(lambda table: table.db_get_last_change_seq())
+
+    async def db_get_changes_since(self, since_seq=0, limit=DEF_CHANGE_BATCH_SIZE, row_format=None):
+        return await self.run_read(lambda table: table.db_get_changes_since(since_seq, limit, row_format))
+
+    async def db_compact_changes(self, up_to_seq=None, keep_last=None):
+        return await self.run_write(lambda table: table.db_compact_changes(up_to_seq, keep_last))
+
+    async def db_search(self, query, limit=DEF_SEARCH_LIMIT, row_format=None):
+        return await self.run_read(lambda table: table.db_search(query, limit, row_format))
+
+    async def db_rebuild_search_index(self, optimize=False):
+        return await self.run_write(lambda table: table.db_rebuild_search_index(optimize))
+
+    def query(self):
+        return self.__read_table.query()
+
+    async def db_select_query(self, query, row_format=None):
+        return await self.run_read(lambda table: table.db_select_query(query, row_format))
+
+    async def db_iter_query(self, query, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+        return await self.__iter_rows(lambda table: table.db_iter_query(query, batch_size, row_format), batch_size)
+
+    async def db_count(self, where_query=None):
+        return await self.run_read(lambda table: table.db_count(where_query))
+
+    async def db_exists(self, first_column_val):
+        return await self.run_read(lambda table: table.db_exists(first_column_val))
+
+    async def db_sum(self, column_name, where_query=None):
+        return await self.run_read(lambda table: table.db_sum(column_name, where_query))
+
+    async def db_min(self, column_name, where_query=None):
+        return await self.run_read(lambda table: table.db_min(column_name, where_query))
+
+    async def db_max(self, column_name, where_query=None):
+        return await self.run_read(lambda table: table.db_max(column_name, where_query))
+
+    async def db_avg(self, column_name, where_query=None):
+        return await self.run_read(lambda table: table.db_avg(column_name, where_query))
+
+    async def db_group_by(self, group_column_names, aggregates, where_query=None, row_format=None):
+        return await self.run_read(lambda table: table.db_group_by(group_column_names, aggregates, where_query, row_format))
+
+    async def db_check_table_exists(self):
+        return await self.run_read(lambda table: table.db_check_table_exists())
+
+    async def db_get_table_column_info_dict(self):
+        return await self.run_read(lambda table: table.db_get_table_column_info_dict())
+
+    ###########################################################
+    # THREADS
+    ###########################################################
+
+    def __writer_loop(self):
+        conn = None
+        try:
+            conn, error = db_connect(self.db_path, self.profile if self.profile is not None else DBProfiles.DURABLE)
+            if error is not None:
+                logging.error(error)
+            write_table = DBTableInterface(conn, self.__table_info_dict, self.__row_format)
+            self.__run_write_requests(conn, write_table)
+        except BaseException as e:
+            # WITHOUT A WRITER EVERY QUEUED AND LATER WRITE WOULD WAIT FOREVER, FAIL THEM ALL WITH THE CAUSE INSTEAD
+            logging.error("db writer thread failed: {}".format(e))
+            with self.__write_lock:
+                self.__writer_error = e
+                requests = []
+                while True:
+                    try:
+                        requests.append(self.__write_queue.get_nowait())
+                    except queue.Empty:
+                        break
+            for request in requests:
+                if request is not None:
+                    request[1].set_exception(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def __run_write_requests(self, conn, write_table):
+        running = True
+        while running:
+            # WAIT FOR ONE REQUEST, THEN PIPELINE EVERYTHING ELSE ALREADY QUEUED INTO THE SAME TRANSACTION
+            requests = [self.__write_queue.get()]
+            while len(requests) < self.write_batch_size:
+                try:
+                    requests.append(self.__write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in requests:
+                running = False
+                requests = [request for request in requests if request is not None]
+            if not requests:
+                continue
+
+            results = []
+            try:
+                with db_batch(conn):
+                    for table_func, future in requests:
+                        try:
+                            # OWN SAVEPOINT PER REQUEST, ONE THAT RAISES ROLLS BACK ONLY ITS OWN WRITES
+                            with db_batch(conn):
+                                result = table_func(write_table)
+                            results.append((future, result, None))
+                        except Exception as e:
+                            results.append((future, None, e))
+            except Exception as e:
+                # THE COMMIT ITSELF FAILED, NONE OF THE GROUP'S WRITES ARE DURABLE
+                results = [(future, None, e) for table_func, future in requests]
+
+            # ONLY RESOLVE ONCE THE GROUP IS COMMITTED
+            for future, result, exception in results:
+                if exception is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(exception)
+
+    async def __iter_rows(self, get_row_iter, batch_size):
+        loop = asyncio.get_running_loop()
+        # THREAD SAFE QUEUE SO THE READER THREAD CAN WAIT ON IT WITH A TIMEOUT, batch_event WAKES THE CONSUMER
+        batch_queue = queue.Queue(DEF_ASYNC_ITER_QUEUE_SIZE)
+        batch_event = asyncio.Event()
+        error_future = loop.create_future()
+        stop_event = threading.Event()
+        self.__iter_stop_events.add(stop_event)
+
+        def put(item):
+            # GIVES UP ONCE THE CONSUMER STOPPED OR close() WAS CALLED, SO THE READER THREAD AND ITS CONNECTION ARE FREED
+            while not stop_event.is_set():
+                try:
+                    batch_queue.put(item, timeout=DEF_ASYNC_ITER_PUT_TIMEOUT_SEC)
+                except queue.Full:
+                    continue
+                try:
+                    loop.call_soon_threadsafe(batch_event.set)
+                except RuntimeError:
+                    # EVENT LOOP ALREADY CLOSED, NOBODY IS LEFT TO CONSUME
+                    stop_event.set()
+                return
+
+        def produce(table):
+            # RUNS ON ONE READER THREAD FOR THE WHOLE ITERATION, THE CURSOR NEVER CHANGES THREADS
+            row_iter = None
+            try:
+                try:
+                    row_iter, error = get_row_iter(table)
+                except Exception as e:
+                    loop.call_soon_threadsafe(error_future.set_exception, e)
+                    raise
+                loop.call_soon_threadsafe(error_future.set_result, error)
+                if error is not None:
+                    return
+                try:
+                    batch = list(itertools.islice(row_iter, batch_size))
+                    while batch and not stop_event.is_set():
+                        put(batch)
+                        batch = list(itertools.islice(row_iter, batch_size))
+                except Exception as e:
+                    # HANDED TO THE CONSUMER, WHICH RAISES IT INSTEAD OF ENDING THE ITERATION EARLY
+                    put(e)
+                    return
+                put(None)
+            finally:
+                if hasattr(row_iter, 'close'):
+                    row_iter.close()
+                self.__iter_stop_events.discard(stop_event)
+
+        produce_future = asyncio.ensure_future(self.run_read(produce))
+        error = await error_future
+        return self.__async_rows(batch_queue, batch_event, stop_event, produce_future), error
+
+    @staticmethod
+    async def __async_rows(batch_queue, batch_event, stop_event, produce_future):
+        try:
+            while True:
+                try:
+                    batch = batch_queue.get_nowait()
+                except queue.Empty:
+                    batch_event.clear()
+                    # CHECK AGAIN AFTER CLEARING, A BATCH PUT IN BETWEEN WOULD OTHERWISE NEVER WAKE US
+                    if batch_queue.empty():
+                        await batch_event.wait()
+                    continue
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for row in batch:
+                    yield row
+        finally:
+            # RUNS ON BREAK, aclose() AND GARBAGE COLLECTION, LET A READER THREAD WAITING ON A FULL QUEUE GO
+            stop_event.set()
+            while not batch_queue.empty():
+                batch_queue.get_nowait()
+            await produce_future
@@ -0,0 +1,384 @@
+"""
+Runnable benchmark suite for DataLib.db_helpers, stdlib only.
+
+    python -m DataLib.db_benchmarks --rows 10000 100000 --output baseline.json
+    python -m DataLib.db_benchmarks --rows 10000 100000 --compare baseline.json
+
+Every benchmark runs against a fresh sqlite file in a temp directory, the table is filled before the clock starts.
+Results are written as JSON, compare mode exits with status 1 when any benchmark is slower than the baseline by more
+than the threshold.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    from Libs.DataLib.db_helpers import *
+except ImportError:
+    from DataLib.db_helpers import *
+
+DEF_BENCH_ROW_COUNTS = (10000, 100000, 1000000)
+DEF_BENCH_REPEAT = 3
+DEF_REGRESSION_THRESHOLD = 0.2
+# NUMBER OF SINGLE STATEMENT OPERATIONS TIMED PER RUN, EACH ONE COMMITS SO THE FULL ROW COUNT WOULD TAKE HOURS AT 1M
+DEF_SINGLE_OP_COUNT = 1000
+
+BENCH_SEED = 1234
+
+RESULTS_KEY = 'results'
+META_KEY = 'meta'
+SEC_PER_OP_KEY = 'sec_per_op'
+TOTAL_SEC_KEY = 'total_sec'
+OP_COUNT_KEY = 'ops'
+
+
+class BenchTableInfo(AbstractDBTable):
+    table_name = "BENCH_TABLE"
+    table_primary_key = 'first_column'
+    table_columns_dict = {
+        0: AbstractTableColumn('first_column', ColumnTypes.TEXT, 20),
+        1: AbstractTableColumn('second_column', ColumnTypes.INTEGER, 20),
+        2: AbstractTableColumn('third_column', ColumnTypes.TEXT, 20),
+    }
+
+    @staticmethod
+    def get_insert_tuple(first_column, second_column, third_column):
+        return first_column, second_column, third_column
+
+
+class BenchAddColumnTableInfo(BenchTableInfo):
+    # NEW COLUMN AFTER THE OLD ONES, MIGRATED WITH ALTER TABLE ADD COLUMN
+    table_columns_dict = dict(BenchTableInfo.table_columns_dict)
+    table_columns_dict[3] = AbstractTableColumn('fourth_column', ColumnTypes.REAL, 20)
+
+
+class BenchRebuildTableInfo(BenchTableInfo):
+    # NEW COLUMN BETWEEN THE OLD ONES, MIGRATED BY COPYING INTO A NEW TABLE
+    table_columns_dict = {
+        0: AbstractTableColumn('first_column', ColumnTypes.TEXT, 20),
+        1: AbstractTableColumn('new_column', ColumnTypes.TEXT, 20),
+        2: AbstractTableColumn('second_column', ColumnTypes.INTEGER, 20),
+        3: AbstractTableColumn('third_column', ColumnTypes.TEXT, 20),
+    }
+
+
+class BenchSearchTableInfo(BenchTableInfo):
+    table_name = "BENCH_SEARCH_TABLE"
+    table_searchable_columns = ['third_column']
+
+
+# WORDS OF THE SEARCH CORPUS, EVERY ROW GETS THREE OF THEM PLUS A WORD ONLY IT HAS
+SEARCH_WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo',
+                'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform',
+                'victor', 'whiskey', 'xray', 'yankee', 'zulu')
+SEARCH_QUERIES = ('alpha', 'kilo AND zulu', 'tango OR whiskey', 'del*', '"mike november"', 'row7*')
+
+
+def get_bench_rows(row_count):
+    for x in range(row_count):
+        yield BenchTableInfo.get_insert_tuple('key_{}'.format(x), x, 'val_{}'.format(x))
+
+
+def get_search_bench_rows(row_count):
+    word_count = len(SEARCH_WORDS)
+    for x in range(row_count):
+        words = (SEARCH_WORDS[x % word_count], SEARCH_WORDS[x * 7 % word_count], SEARCH_WORDS[x * 13 % 23])
+        yield BenchTableInfo.get_insert_tuple('key_{}'.format(x), x, "{} row{}".format(" ".join(words), x))
+
+
+def get_sample_keys(row_count, sample_count=DEF_SINGLE_OP_COUNT):
+    rand = random.Random(BENCH_SEED)
+    return ['key_{}'.format(x) for x in rand.sample(range(row_count), min(sample_count, row_count))]
+
+
+def __open_bench_table(db_path, table_info=BenchTableInfo, row_count=0, get_rows=get_bench_rows):
+    conn = sqlite3.connect(db_path)
+    table_interface = DBTableInterface(conn, table_info.table_info_dict(), RowFormats.TUPLE)
+    table_interface.db_create_table()
+    if row_count:
+        stats, error = table_interface.db_insert_many(get_rows(row_count))
+        if error is not None:
+            raise sqlite3.Error(error)
+    return conn, table_interface
+
+
+def __check_error(error):
+    if error is not None:
+        raise sqlite3.Error(error)
+
+
+# BENCHMARKS, EACH TAKES THE DB PATH AND ROW COUNT AND RETURNS (total_sec, op_count) OF THE TIMED PART ONLY
+def bench_insert_single(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    op_count = min(DEF_SINGLE_OP_COUNT, row_count)
+    start_time = time.perf_counter()
+    for x in range(row_count, row_count + op_count):
+        data, error = table_interface.db_insert_into_table(('key_{}'.format(x), x, 'val_{}'.format(x)))
+        __check_error(error)
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, op_count
+
+
+def bench_insert_bulk(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path)
+    start_time = time.perf_counter()
+    stats, error = table_interface.db_insert_many(get_bench_rows(row_count))
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+def bench_select_all(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    start_time = time.perf_counter()
+    rows, error = table_interface.db_select_all_from_table()
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+def bench_select_keyed(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    sample_keys = get_sample_keys(row_count)
+    start_time = time.perf_counter()
+    for key in sample_keys:
+        rows, error = table_interface.db_select_all_where_first_column_equals(key)
+        __check_error(error)
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, len(sample_keys)
+
+
+def bench_update_single(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    sample_keys = get_sample_keys(row_count)
+    start_time = time.perf_counter()
+    for key in sample_keys:
+        data, error = table_interface.db_update_where_first_column_equals((key, -1, 'updated'), key)
+        __check_error(error)
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, len(sample_keys)
+
+
+def bench_update_bulk(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    update_tuples = (((key, x, 'updated'), key) for key, x, val in get_bench_rows(row_count))
+    start_time = time.perf_counter()
+    stats, error = table_interface.db_update_many(update_tuples)
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+def bench_delete_single(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    sample_keys = get_sample_keys(row_count)
+    start_time = time.perf_counter()
+    for key in sample_keys:
+        data, error = table_interface.db_delete_where_first_column_equals(key)
+        __check_error(error)
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, len(sample_keys)
+
+
+def bench_delete_bulk(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    keys = ['key_{}'.format(x) for x in range(row_count)]
+    start_time = time.perf_counter()
+    stats, error = table_interface.db_delete_many_by_first_column(keys)
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+def __bench_alter_table(db_path, row_count, new_table_info):
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    new_table_interface = DBTableInterface(conn, new_table_info.table_info_dict(), RowFormats.TUPLE)
+    start_time = time.perf_counter()
+    data, error = new_table_interface.db_alter_table()
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+def bench_alter_table_add_column(db_path, row_count):
+    return __bench_alter_table(db_path, row_count, BenchAddColumnTableInfo)
+
+
+def bench_alter_table_rebuild(db_path, row_count):
+    return __bench_alter_table(db_path, row_count, BenchRebuildTableInfo)
+
+
+def bench_table_init(db_path, row_count):
+    # STARTUP PATH OF AN EXISTING UP TO DATE TABLE, TIMED ON A FRESH CONNECTION
+    conn, table_interface = __open_bench_table(db_path, row_count=row_count)
+    conn.close()
+    conn = sqlite3.connect(db_path)
+    start_time = time.perf_counter()
+    DBTableInterface(conn, BenchTableInfo.table_info_dict()).db_table_init()
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, 1
+
+
+def bench_search(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, BenchSearchTableInfo, row_count, get_search_bench_rows)
+    op_count = 0
+    start_time = time.perf_counter()
+    for _ in range(DEF_SINGLE_OP_COUNT // len(SEARCH_QUERIES)):
+        for query in SEARCH_QUERIES:
+            rows, error = table_interface.db_search(query, limit=20)
+            __check_error(error)
+            op_count += 1
+    total_sec = time.perf_counter() - start_time
+    conn.close()
+    return total_sec, op_count
+
+
+def bench_search_rebuild(db_path, row_count):
+    conn, table_interface = __open_bench_table(db_path, BenchSearchTableInfo, row_count, get_search_bench_rows)
+    start_time = time.perf_counter()
+    data, error = table_interface.db_rebuild_search_index()
+    total_sec = time.perf_counter() - start_time
+    __check_error(error)
+    conn.close()
+    return total_sec, row_count
+
+
+BENCHMARKS = OrderedDict([
+    ('insert_single', bench_insert_single),
+    ('insert_bulk', bench_insert_bulk),
+    ('select_all', bench_select_all),
+    ('select_keyed', bench_select_keyed),
+    ('update_single', bench_update_single),
+    ('update_bulk', bench_update_bulk),
+    ('delete_single', bench_delete_single),
+    ('delete_bulk', bench_delete_bulk),
+    ('alter_table_add_column', bench_alter_table_add_column),
+    ('alter_table_rebuild', bench_alter_table_rebuild),
+    ('table_init', bench_table_init),
+    ('search', bench_search),
+    ('search_rebuild', bench_search_rebuild),
+])
+
+
+def run_benchmark(bench_func, row_count, repeat=DEF_BENCH_REPEAT):
+    """
+    Runs a benchmark repeat times, each on a new db file, and keeps the fastest run
+    :param bench_func: benchmark function from BENCHMARKS
+    :param row_count: number of rows in the table
+    :param repeat: number of runs
+    :return: dict with SEC_PER_OP_KEY, TOTAL_SEC_KEY and OP_COUNT_KEY of the fastest run
+    """
+    best_total_sec, best_op_count = None, 0
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            total_sec, op_count = bench_func(os.path.join(temp_dir, 'bench.db'), row_count)
+        if best_total_sec is None or total_sec < best_total_sec:
+            best_total_sec, best_op_count = total_sec, op_count
+    return {
+        SEC_PER_OP_KEY: best_total_sec / max(best_op_count, 1),
+        TOTAL_SEC_KEY: best_total_sec,
+        OP_COUNT_KEY: best_op_count,
+    }
+
+
+def run_benchmarks(row_counts=DEF_BENCH_ROW_COUNTS, names=None, repeat=DEF_BENCH_REPEAT, verbose=False):
+    """
+    Runs the benchmarks at each row count
+    :param row_counts: iterable of table row counts
+    :param names: names of the BENCHMARKS to run, all if None
+    :param repeat: number of runs of each benchmark, the fastest is kept
+    :param verbose: print each result as it finishes
+    :return: results dict of META_KEY and RESULTS_KEY, results are {name: {str(row_count): result dict}}
+    """
+    results = OrderedDict()
+    for name in names or BENCHMARKS:
+        results[name] = OrderedDict()
+        for row_count in row_counts:
+            result = run_benchmark(BENCHMARKS[name], row_count, repeat)
+            # JSON OBJECT KEYS ARE STRINGS, SO THE ROW COUNTS ARE STORED AS STRINGS ON BOTH SIDES OF A COMPARE
+            results[name][str(row_count)] = result
+            if verbose:
+                print("{:<24} {:>9} rows {:>14.3f} us/op".format(name, row_count, result[SEC_PER_OP_KEY] * 1000000))
+    return {
+        META_KEY: {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        RESULTS_KEY: results,
+    }
+
+
+def compare_results(baseline, current, threshold=DEF_REGRESSION_THRESHOLD):
+    """
+    Compares two run_benchmarks outputs, benchmarks missing from either side are skipped
+    :param baseline: stored results dict
+    :param current: new results dict
+    :param threshold: allowed slowdown as a fraction, 0.2 flags anything more than 20% slower
+    :return: list of (name, row_count, baseline_sec_per_op, current_sec_per_op, ratio) of the regressions
+    """
+    regressions = []
+    for name, row_count_dict in current[RESULTS_KEY].items():
+        baseline_row_count_dict = baseline[RESULTS_KEY].get(name, {})
+        for row_count, result in row_count_dict.items():
+            if row_count not in baseline_row_count_dict:
+                continue
+            baseline_sec = baseline_row_count_dict[row_count][SEC_PER_OP_KEY]
+            current_sec = result[SEC_PER_OP_KEY]
+            ratio = current_sec / baseline_sec if baseline_sec else float('inf')
+            if ratio > 1 + threshold:
+                regressions.append((name, row_count, baseline_sec, current_sec, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataLib.db_helpers benchmark suite")
+    parser.add_argument('--rows', type=int, nargs='+', default=list(DEF_BENCH_ROW_COUNTS), help="table row counts")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help="benchmarks to run, all by default")
+    parser.add_argument('--repeat', type=int, default=DEF_BENCH_REPEAT, help="runs per benchmark, the fastest is kept")
+    parser.add_argument('--output', help="write the JSON results to this file, stdout if not given")
+    parser.add_argument('--compare', help="baseline JSON file to flag regressions against")
+    parser.add_argument('--threshold', type=float, default=DEF_REGRESSION_THRESHOLD, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.rows, args.only, args.repeat, verbose=True)
+    if args.output:
+        with open(args.output, 'w') as write_file:
+            json.dump(current, write_file, indent=4)
+    else:
+        print(json.dumps(current, indent=4))
+
+    if args.compare:
+        with open(args.compare) as read_file:
+            baseline = json.load(read_file)
+        regressions = compare_results(baseline, current, args.threshold)
+        for name, row_count, baseline_sec, current_sec, ratio in regressions:
+            print("REGRESSION {:<24} {:>9} rows {:>12.3f} -> {:>12.3f} us/op ({:.2f}x)".format(
+                name, row_count, baseline_sec * 1000000, current_sec * 1000000, ratio))
+        if regressions:
+            return 1
+        print("no regressions over {:.0%}".format(args.threshold))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
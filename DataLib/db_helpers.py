@@ -1,6 +1,21 @@
+import array
+import hashlib
+import itertools
+import json
 import logging
+import operator
+import queue
 import sqlite3
+import threading
+import time
 from abc import abstractmethod
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class ColumnTypes:
@@ -16,6 +31,12 @@ DEF_REAL_VAL = 0
 DEF_TEXT_VAL = ""
 DEF_BLOB_VAL = ""
 
+# array.array TYPECODES OF THE NUMERIC COLUMN TYPES, THE OTHER TYPES ARE EXPORTED AS LISTS
+COLUMN_ARRAY_TYPECODES = {
+    ColumnTypes.INTEGER: 'q',
+    ColumnTypes.REAL: 'd',
+}
+
 DEF_VAL_MAP = {
     ColumnTypes.NULL: 0,
     ColumnTypes.INTEGER: DEF_INTEGER_VAL,
@@ -24,20 +45,166 @@ DEF_VAL_MAP = {
     ColumnTypes.BLOB: DEF_BLOB_VAL,
 }
 
+class RowFormats:
+    DICT = "dict"        # {row_index: {col_index: val}}, THE ORIGINAL FORMAT
+    TUPLE = "tuple"      # [row_tuple, ...]
+    ROW = "row"          # [sqlite3.Row, ...]
+    RECORD = "record"    # [record, ...], RECORD CLASS GENERATED PER TABLE WITH __slots__
+    COLUMNS = "columns"  # {col_index: [val, ...]}
+
+
+ROW_FORMATS = (RowFormats.DICT, RowFormats.TUPLE, RowFormats.ROW, RowFormats.RECORD, RowFormats.COLUMNS)
+
+
+class QueryOperators:
+    EQ = "="
+    NE = "!="
+    LT = "<"
+    LE = "<="
+    GT = ">"
+    GE = ">="
+    LIKE = "LIKE"
+    IN = "IN"
+    NOT_IN = "NOT IN"
+
+
+QUERY_OPERATORS = (QueryOperators.EQ, QueryOperators.NE, QueryOperators.LT, QueryOperators.LE, QueryOperators.GT,
+                   QueryOperators.GE, QueryOperators.LIKE, QueryOperators.IN, QueryOperators.NOT_IN)
+QUERY_LIST_OPERATORS = (QueryOperators.IN, QueryOperators.NOT_IN)
+
+
+class AggregateFunctions:
+    COUNT = "COUNT"
+    SUM = "SUM"
+    MIN = "MIN"
+    MAX = "MAX"
+    AVG = "AVG"
+
+
+AGGREGATE_FUNCTIONS = (AggregateFunctions.COUNT, AggregateFunctions.SUM, AggregateFunctions.MIN,
+                       AggregateFunctions.MAX, AggregateFunctions.AVG)
+
+# MOST COMPILED QUERY SHAPES KEPT BEFORE THE CACHE IS CLEARED
+MAX_COMPILED_QUERY_CACHE_SIZE = 512
+
 DB_LIST_SEPARATOR = '**'
 DB_LIST_BLANK_ENTRY = ''
 
 
+class ListFormats:
+    SEPARATOR = "separator"      # 'a**b**c', DB_LIST_SEPARATOR JOINED str() VALUES, THE ORIGINAL FORMAT
+    JSON = "json"                # '["a","b","c"]', KEEPS VALUE TYPES, QUERYABLE WITH SQLITE'S json_each()
+    CHILD_TABLE = "child_table"  # ONE ROW PER ENTRY IN A <table>__<column> TABLE, SEE DBListChildTable
+
+# NUMBER OF ROWS PULLED PER FETCHMANY CALL BY THE STREAMING SELECTS
+DEF_FETCH_BATCH_SIZE = 1000
+
+# NUMBER OF ROWS HANDED TO EACH EXECUTEMANY CALL DURING BULK WRITES
+DEF_BULK_CHUNK_SIZE = 10000
+
+# BYTES MOVED PER CHUNK BY THE BLOB STREAMING HELPERS
+DEF_BLOB_BUFFER_SIZE = 1024 * 1024
+
+# KEYS BOUND TO EACH first_column IN (?,...) STATEMENT, THE SQLITE_MAX_VARIABLE_NUMBER OF SQLITE BEFORE 3.32
+DEF_IN_CHUNK_SIZE = 999
+# KEY COUNT ABOVE WHICH THE KEYS ARE LOADED INTO A TEMP TABLE INSTEAD, ONE STATEMENT INSTEAD OF MANY CHUNKS
+DEF_IN_KEY_TABLE_MIN_KEYS = 50000
+
+
+class ChangeOps:
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+
+# MOST ROWS RETURNED BY db_search
+DEF_SEARCH_LIMIT = 100
+
+# CHANGELOG ENTRIES READ PER db_get_changes_since CALL
+DEF_CHANGE_BATCH_SIZE = 1000
+
+# KEYS OF THE DICT RETURNED BY db_get_changes_since
+CHANGES_KEY = 'changes'
+LAST_SEQ_KEY = 'last_seq'
+
+# KEYS OF THE STATS DICT RETURNED BY BULK WRITE OPERATIONS
+ROW_COUNT_KEY = 'row_count'
+ELAPSED_SEC_KEY = 'elapsed_sec'
+ROWS_PER_SEC_KEY = 'rows_per_sec'
+
+# KEYS OF THE PER STATEMENT DICTS IN THE SNAPSHOT RETURNED BY db_get_statement_stats
+STATEMENT_COUNT_KEY = 'count'
+STATEMENT_TOTAL_SEC_KEY = 'total_sec'
+STATEMENT_P50_SEC_KEY = 'p50_sec'
+STATEMENT_P99_SEC_KEY = 'p99_sec'
+STATEMENT_MAX_SEC_KEY = 'max_sec'
+STATEMENT_ROW_COUNT_KEY = 'rows'
+STATEMENT_ERROR_COUNT_KEY = 'errors'
+
+# LATENCIES KEPT PER STATEMENT FOR THE P50 / P99, THE MOST RECENT ONES WIN
+DEF_LATENCY_SAMPLE_SIZE = 1000
+
+# KEYS OF THE STATS DICT RETURNED BY DBRowCache.get_stats
+CACHE_HITS_KEY = 'hits'
+CACHE_MISSES_KEY = 'misses'
+CACHE_EVICTIONS_KEY = 'evictions'
+CACHE_EXPIRATIONS_KEY = 'expirations'
+CACHE_INVALIDATIONS_KEY = 'invalidations'
+CACHE_SIZE_KEY = 'size'
+
+
+class DBProfiles:
+    DURABLE = "durable"
+    BULK_LOAD = "bulk_load"
+    READ_MOSTLY = "read_mostly"
+
+
+# PRAGMA SETTINGS OF EACH PROFILE, APPLIED IN ORDER BY db_apply_profile
+DB_PROFILE_PRAGMAS = {
+    DBProfiles.DURABLE: {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    DBProfiles.BULK_LOAD: {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -262144,  # NEGATIVE IS KiB, 256 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+    DBProfiles.READ_MOSTLY: {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -65536,  # 64 MB
+        'mmap_size': 268435456,  # 256 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    },
+}
+
 TABLE_NAME_KEY = 'table_name'
 COLUMN_MAP_KEY = 'column_map'
+PRIMARY_KEY_KEY = 'primary_key'
+UNIQUE_CONSTRAINTS_KEY = 'unique_constraints'
+INDEXES_KEY = 'indexes'
+SEARCHABLE_COLUMNS_KEY = 'searchable_columns'
 COLUMN_NAME_INDEX = 0
 COLUMN_TYPE_INDEX = 1
+# COLUMN COMPARE LIST ENTRY OF A COLUMN WITHOUT A MATCH IN THE OTHER TABLE
+COLUMN_MISMATCH_INDEX = -1
 
 # table_info_dict = {
 #     TABLE_NAME_KEY: "",
 #     COLUMN_MAP_KEY: {
 #         index: (column_name, column_type),
 #     },
+#     # OPTIONAL, A COLUMN NAME OR A TUPLE OF COLUMN NAMES FOR COMPOSITE KEYS
+#     PRIMARY_KEY_KEY: (column_name, ...),
+#     UNIQUE_CONSTRAINTS_KEY: [(column_name, ...), ...],
+#     INDEXES_KEY: [(column_name, ...), ...],
+#     # OPTIONAL, TEXT COLUMNS INDEXED IN THE <table>__search FTS5 TABLE, SEE db_search
+#     SEARCHABLE_COLUMNS_KEY: (column_name, ...),
 # }
 
 
@@ -55,14 +222,452 @@ def db_row_dict_to_tuple(dict_to_convert):
 
 
 def db_list_to_string(row_list):
-    list_string = ""
-    list_len = len(row_list)
-    for index in range(list_len):
-        list_string += str(row_list[index])
-        if index < list_len-1:
-            list_string += DB_LIST_SEPARATOR
-    print(list_string)
-    return list_string
+    return DB_LIST_SEPARATOR.join(map(str, row_list))
+
+
+def db_string_to_list(list_string):
+    """
+    Decode a db_list_to_string value, entries come back as strings.
+    :param list_string: DB_LIST_SEPARATOR joined string
+    :return: list of strings, empty for DB_LIST_BLANK_ENTRY
+    """
+    if list_string == DB_LIST_BLANK_ENTRY:
+        return []
+    return list_string.split(DB_LIST_SEPARATOR)
+
+
+class DBListCodec:
+    """
+    Encodes list column values to what is stored in the column and back. encode_many and decode_many work on a whole
+    column of values at once, None stays None in both directions.
+    """
+    @abstractmethod
+    def encode(self, row_list):
+        pass
+
+    @abstractmethod
+    def decode(self, list_value):
+        pass
+
+    def encode_many(self, row_lists):
+        encode = self.encode
+        return [None if row_list is None else encode(row_list) for row_list in row_lists]
+
+    def decode_many(self, list_values):
+        decode = self.decode
+        return [None if list_value is None else decode(list_value) for list_value in list_values]
+
+
+class DBSeparatorListCodec(DBListCodec):
+    """
+    ListFormats.SEPARATOR, see db_list_to_string. Entries must not contain the separator and come back as strings.
+    """
+    def __init__(self, separator=DB_LIST_SEPARATOR):
+        self.separator = separator
+
+    def encode(self, row_list):
+        return self.separator.join(map(str, row_list))
+
+    def decode(self, list_value):
+        return list_value.split(self.separator) if list_value != DB_LIST_BLANK_ENTRY else []
+
+
+class DBJsonListCodec(DBListCodec):
+    """
+    ListFormats.JSON, entries keep their json types and may contain any character. Stored values can be queried
+    inside sqlite, e.g. SELECT * FROM t WHERE EXISTS (SELECT 1 FROM json_each(t.col) WHERE value = ?)
+    """
+    def __init__(self):
+        self.__encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def encode(self, row_list):
+        return self.__encoder.encode(row_list)
+
+    def decode(self, list_value):
+        # BLANK VALUES ARE WHAT db_alter_table FILLS NEW TEXT COLUMNS WITH
+        return json.loads(list_value) if list_value != DB_LIST_BLANK_ENTRY else []
+
+    def decode_many(self, list_values):
+        # ONE json.loads OVER THE WHOLE COLUMN INSTEAD OF ONE CALL PER VALUE, ONLY IF EVERY VALUE LOOKS LIKE A LIST
+        if all(list_value is None or (list_value[:1] == '[' and list_value[-1:] == ']') for list_value in list_values):
+            try:
+                decoded = json.loads("[{}]".format(",".join('null' if list_value is None else list_value
+                                                            for list_value in list_values)))
+            except ValueError:
+                decoded = None
+            if decoded is not None and len(decoded) == len(list_values):
+                return decoded
+        # BLANK OR MALFORMED VALUES, DECODE ONE AT A TIME SO EVERY RESULT STAYS WITH ITS ROW
+        return super().decode_many(list_values)
+
+
+LIST_CODECS = {
+    ListFormats.SEPARATOR: DBSeparatorListCodec(),
+    ListFormats.JSON: DBJsonListCodec(),
+}
+
+
+def db_encode_list_columns(val_tuples, col_indexes, list_format=ListFormats.SEPARATOR):
+    """
+    Encode the list columns of rows about to be written, e.g. db_insert_many(conn, table, db_encode_list_columns(rows, [2]))
+    :param val_tuples: iterable of value tuples, generators are streamed
+    :param col_indexes: indexes of the list columns
+    :param list_format: ListFormats.SEPARATOR or JSON
+    :return: generator of value tuples
+    """
+    encode = LIST_CODECS[list_format].encode
+    for val_tuple in val_tuples:
+        val_list = list(val_tuple)
+        for col_index in col_indexes:
+            if val_list[col_index] is not None:
+                val_list[col_index] = encode(val_list[col_index])
+        yield tuple(val_list)
+
+
+def db_decode_list_columns(rows, col_indexes, list_format=ListFormats.SEPARATOR):
+    """
+    Decode the list columns of a whole result set at once.
+    :param rows: rows in RowFormats.TUPLE, ROW or RECORD, or a RowFormats.DICT or COLUMNS dict
+    :param col_indexes: indexes of the list columns
+    :param list_format: ListFormats.SEPARATOR or JSON
+    :return: list of row tuples, or a new dict in the format of a DICT or COLUMNS dict
+    """
+    codec = LIST_CODECS[list_format]
+    if not rows:
+        return {} if isinstance(rows, dict) else []
+    if isinstance(rows, dict):
+        # DICT ROWS ARE {row_index: {col_index: val}}, COLUMNS ARE {col_index: [val, ...]}
+        if any(isinstance(row_dict, dict) for row_dict in rows.values()):
+            decoded_rows = {row_index: dict(row_dict) for row_index, row_dict in rows.items()}
+            for col_index in col_indexes:
+                col_values = codec.decode_many([row_dict[col_index] for row_dict in decoded_rows.values()])
+                for row_dict, col_value in zip(decoded_rows.values(), col_values):
+                    row_dict[col_index] = col_value
+            return decoded_rows
+        columns = dict(rows)
+        for col_index in col_indexes:
+            columns[col_index] = codec.decode_many(columns[col_index])
+        return columns
+
+    # DECODE COLUMN BY COLUMN SO THE JSON CODEC PARSES EACH COLUMN IN ONE CALL
+    columns = [list(col_values) for col_values in zip(*rows)]
+    for col_index in col_indexes:
+        columns[col_index] = codec.decode_many(columns[col_index])
+    return list(zip(*columns))
+
+
+###########################################################
+# CONNECTION SETUP
+###########################################################
+
+
+def db_connect(db_path, profile=DBProfiles.DURABLE, **connect_kwargs):
+    """
+    Open a sqlite3 connection and apply a PRAGMA profile to it.
+    :param db_path: path of the database file
+    :param profile: one of DBProfiles, a dict of pragma settings or None to leave the defaults
+    :param connect_kwargs: passed on to sqlite3.connect
+    :return: conn: sqlite3 connection OR error: error received while applying the profile
+    """
+    conn = sqlite3.connect(db_path, **connect_kwargs)
+    error = None
+    if profile is not None:
+        previous_pragmas, error = db_apply_profile(conn, profile)
+    return conn, error
+
+
+def db_apply_profile(conn, profile):
+    """
+    Switch a connection to a PRAGMA profile.
+    :param conn: sqlite3 connection
+    :param profile: one of DBProfiles or a dict of pragma settings
+    :return: previous_pragmas: the values the changed pragmas had before, to restore them later OR error
+    """
+    pragma_dict = DB_PROFILE_PRAGMAS.get(profile) if isinstance(profile, str) else profile
+    if pragma_dict is None:
+        return {}, "Unknown db profile: '{}'".format(profile)
+
+    previous_pragmas, error = db_get_pragmas(conn, pragma_dict.keys())
+    for pragma_name, pragma_val in pragma_dict.items():
+        if error is not None:
+            break
+        data, error = __db_execute_and_get_output(conn, """ PRAGMA {} = {} """.format(pragma_name, pragma_val))
+    return previous_pragmas, error
+
+
+def db_get_pragmas(conn, pragma_names):
+    """
+    Read the current values of pragmas.
+    :param conn: sqlite3 connection
+    :param pragma_names: iterable of pragma names
+    :return: pragma_dict: {pragma_name: value} OR error: error received from sql execute
+    """
+    pragma_dict = {}
+    error = None
+    for pragma_name in pragma_names:
+        data, error = __db_execute_and_get_output(conn, """ PRAGMA {} """.format(pragma_name))
+        if error is not None:
+            break
+        if data:
+            pragma_dict[pragma_name] = data[0][0]
+    return pragma_dict, error
+
+
+@contextmanager
+def db_profile(conn, profile):
+    """
+    Context manager switching a connection to a profile for the duration of the block and restoring the previous
+    pragma values afterwards, e.g. relaxing synchronous during a bulk load:
+        with db_profile(conn, DBProfiles.BULK_LOAD):
+            db_insert_many(conn, table_info_dict, rows)
+    """
+    previous_pragmas, error = db_apply_profile(conn, profile)
+    if error is not None:
+        logging.error(error)
+    try:
+        yield conn
+    finally:
+        # JOURNAL_MODE CAN NOT CHANGE INSIDE A TRANSACTION, FINISH ANY THE BLOCK LEFT OPEN FIRST
+        if conn.in_transaction:
+            conn.commit()
+        previous_pragmas, error = db_apply_profile(conn, previous_pragmas)
+        if error is not None:
+            logging.error(error)
+
+
+###########################################################
+# INSTRUMENTATION
+###########################################################
+
+
+class DBStatementStats:
+    """
+    Per statement counters collected by the execute helpers while instrumentation is on, see
+    db_enable_instrumentation. Values are always bound as parameters, so every statement text is one statement shape.
+    Streaming selects are timed up to their first row and do not count rows.
+    """
+    def __init__(self, slow_query_sec=None, explain_slow_queries=False, sample_size=DEF_LATENCY_SAMPLE_SIZE):
+        self.slow_query_sec = slow_query_sec
+        self.explain_slow_queries = explain_slow_queries
+        self.sample_size = sample_size
+
+        self.__lock = threading.Lock()
+        # {sql: [count, total_sec, max_sec, row_count, error_count, latency_samples]}
+        self.__statement_dict = {}
+
+    def record(self, conn, sql, tuple_values, elapsed_sec, row_count=None, error=None):
+        """
+        Record one execution, logging it when it was slower than slow_query_sec.
+        :return: None
+        """
+        with self.__lock:
+            entry = self.__statement_dict.get(sql)
+            if entry is None:
+                entry = [0, 0.0, 0.0, 0, 0, deque(maxlen=self.sample_size)]
+                self.__statement_dict[sql] = entry
+            entry[0] += 1
+            entry[1] += elapsed_sec
+            entry[2] = max(entry[2], elapsed_sec)
+            entry[3] += row_count or 0
+            entry[4] += error is not None
+            entry[5].append(elapsed_sec)
+
+        if self.slow_query_sec is not None and elapsed_sec >= self.slow_query_sec:
+            self.__log_slow_query(conn, sql, tuple_values, elapsed_sec)
+
+    def get_snapshot(self):
+        """
+        :return: {sql: {STATEMENT_COUNT_KEY: ..., STATEMENT_P99_SEC_KEY: ..., ...}}
+        """
+        with self.__lock:
+            entries = [(sql, list(entry[:5]), sorted(entry[5])) for sql, entry in self.__statement_dict.items()]
+
+        snapshot = {}
+        for sql, (count, total_sec, max_sec, row_count, error_count), samples in entries:
+            snapshot[" ".join(sql.split())] = {
+                STATEMENT_COUNT_KEY: count,
+                STATEMENT_TOTAL_SEC_KEY: total_sec,
+                STATEMENT_P50_SEC_KEY: samples[len(samples) // 2],
+                STATEMENT_P99_SEC_KEY: samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+                STATEMENT_MAX_SEC_KEY: max_sec,
+                STATEMENT_ROW_COUNT_KEY: row_count,
+                STATEMENT_ERROR_COUNT_KEY: error_count,
+            }
+        return snapshot
+
+    def __log_slow_query(self, conn, sql, tuple_values, elapsed_sec):
+        message = "slow query ({:.3f}s): {}".format(elapsed_sec, " ".join(sql.split()))
+        if self.explain_slow_queries:
+            try:
+                # RUN DIRECTLY ON THE CONNECTION SO THE EXPLAIN ITSELF IS NOT RECORDED
+                plan_rows = conn.execute("EXPLAIN QUERY PLAN {}".format(sql), tuple_values or ()).fetchall()
+                message += "\n    " + "\n    ".join(plan_row[-1] for plan_row in plan_rows)
+            except sqlite3.Error as e:
+                message += "\n    no query plan ({})".format(e)
+        logging.warning(message)
+
+
+# None WHILE INSTRUMENTATION IS OFF, THE EXECUTE HELPERS ONLY CHECK THIS BEFORE SKIPPING ALL TIMING
+__statement_stats = None
+
+
+def db_enable_instrumentation(slow_query_sec=None, explain_slow_queries=False, sample_size=DEF_LATENCY_SAMPLE_SIZE):
+    """
+    Start recording per statement counts, latencies, rows and errors for every connection, dropping earlier stats.
+    :param slow_query_sec: log statements taking at least this long at warning level, None to log nothing
+    :param explain_slow_queries: add the EXPLAIN QUERY PLAN of each logged statement
+    :param sample_size: latencies kept per statement for the p50 / p99
+    :return: statement_stats: DBStatementStats
+    """
+    global __statement_stats
+    __statement_stats = DBStatementStats(slow_query_sec, explain_slow_queries, sample_size)
+    return __statement_stats
+
+
+def db_disable_instrumentation():
+    """
+    Stop recording, the execute helpers go back to doing no timing at all.
+    :return: None
+    """
+    global __statement_stats
+    __statement_stats = None
+
+
+def db_get_statement_stats():
+    """
+    Snapshot of the stats recorded since db_enable_instrumentation.
+    :return: {sql: {STATEMENT_COUNT_KEY: ..., STATEMENT_TOTAL_SEC_KEY: ..., STATEMENT_P50_SEC_KEY: ...,
+             STATEMENT_P99_SEC_KEY: ..., STATEMENT_MAX_SEC_KEY: ..., STATEMENT_ROW_COUNT_KEY: ...,
+             STATEMENT_ERROR_COUNT_KEY: ...}}, empty while instrumentation is off
+    """
+    statement_stats = __statement_stats
+    return statement_stats.get_snapshot() if statement_stats is not None else {}
+
+
+###########################################################
+# TRANSACTIONS
+###########################################################
+
+
+# INNERMOST ACTIVE DBBatch OF EACH CONNECTION, KEYED BY id(conn)
+__active_batch_dict = {}
+
+
+class DBBatch:
+    """
+    Unit of work yielded by db_batch. The outermost batch of a connection owns the transaction, nested batches are
+    savepoints inside it. Write functions called while a batch is active record their writes here instead of
+    committing themselves.
+    """
+    def __init__(self, conn, commit_every=None, parent=None):
+        self.conn = conn
+        self.commit_every = commit_every
+        self.parent = parent
+        self.root = self if parent is None else parent.root
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.savepoint_name = None if parent is None else "db_batch_{}".format(self.depth)
+        self.write_count = 0
+        self.commit_count = 0
+        self.__pending_write_count = 0
+
+    def begin(self):
+        if self.parent is not None:
+            self.conn.execute("SAVEPOINT {}".format(self.savepoint_name))
+        elif not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def record_write(self, write_count=1):
+        """
+        Count finished writes, the root batch commits once commit_every writes are pending.
+        :param write_count: number of writes to record
+        :return: None
+        """
+        self.write_count += write_count
+        if self.parent is not None:
+            self.parent.record_write(write_count)
+            return
+        self.__pending_write_count += write_count
+        if self.commit_every and self.__pending_write_count >= self.commit_every and self.__active_depth() == 0:
+            self.commit()
+
+    def commit(self):
+        """
+        Commit everything written so far and keep the batch open. Only the root batch can commit, and only while no
+        nested batch is active, as committing ends every open savepoint.
+        :return: None
+        """
+        if self.parent is not None or self.__active_depth() != 0:
+            return
+        self.conn.commit()
+        self.commit_count += 1
+        self.__pending_write_count = 0
+        self.conn.execute("BEGIN")
+
+    def finish(self):
+        if self.parent is not None:
+            self.conn.execute("RELEASE {}".format(self.savepoint_name))
+        else:
+            self.conn.commit()
+            self.commit_count += 1
+            self.__pending_write_count = 0
+
+    def rollback(self):
+        if self.parent is not None:
+            self.conn.execute("ROLLBACK TO {}".format(self.savepoint_name))
+            self.conn.execute("RELEASE {}".format(self.savepoint_name))
+        elif self.conn.in_transaction:
+            self.conn.rollback()
+
+    def __active_depth(self):
+        active_batch = db_get_active_batch(self.conn)
+        return 0 if active_batch is None else active_batch.depth
+
+
+def db_get_active_batch(conn):
+    """
+    Get the innermost db_batch active on a connection.
+    :param conn: sqlite3 connection
+    :return: batch: DBBatch or None
+    """
+    return __active_batch_dict.get(id(conn))
+
+
+@contextmanager
+def db_batch(conn, commit_every=None):
+    """
+    Group many writes into one transaction:
+        with db_batch(conn, commit_every=1000) as batch:
+            for val_tuple in val_tuples:
+                db_insert_into_table(conn, table_info_dict, val_tuple)
+    Commits when the block ends, plus every commit_every writes if set. Rolls back and re-raises if the block raises.
+    Nested db_batch blocks on the same connection become savepoints, rolling back only their own writes.
+    :param conn: sqlite3 connection
+    :param commit_every: commit after this many writes, None to commit once at the end
+    :return: batch: DBBatch
+    """
+    parent = __active_batch_dict.get(id(conn))
+    batch = DBBatch(conn, commit_every, parent)
+    batch.begin()
+    __active_batch_dict[id(conn)] = batch
+    try:
+        yield batch
+    except BaseException:
+        __db_restore_active_batch(conn, parent)
+        batch.rollback()
+        raise
+    else:
+        __db_restore_active_batch(conn, parent)
+        batch.finish()
+        # A FINISHED NESTED BATCH MAY HAVE HELD BACK A COMMIT_EVERY COMMIT OF THE ROOT
+        if parent is not None:
+            parent.root.record_write(0)
+
+
+def __db_restore_active_batch(conn, parent):
+    if parent is None:
+        __active_batch_dict.pop(id(conn), None)
+    else:
+        __active_batch_dict[id(conn)] = parent
 
 
 ###########################################################
@@ -71,9 +676,9 @@ def db_list_to_string(row_list):
 
 
 def db_check_table_exists(conn, table_name):
-    sql = """ SELECT name FROM sqlite_master WHERE type='table' AND name='{}'; """.format(table_name)
+    sql = """ SELECT name FROM sqlite_master WHERE type='table' AND name=?; """
 
-    data, error = __db_execute_and_get_output(conn, sql)
+    data, error = __db_execute_and_get_output(conn, sql, (table_name,))
     table_exists = False
     try:
         if data[0][0] == table_name:
@@ -85,6 +690,35 @@ def db_check_table_exists(conn, table_name):
     return table_exists, error
 
 
+def db_get_table_unique_column_sets(conn, table_name):
+    """
+    Get the column sets the existing table already enforces uniqueness on, from its primary key and unique indexes.
+    :param conn: sqlite3 connection
+    :param table_name: name of the table
+    :return: unique_column_sets: set of frozensets of column names OR error: error received from sql execute
+    """
+    unique_column_sets = set()
+
+    # PRIMARY KEY COLUMNS, AN INTEGER PRIMARY KEY HAS NO INDEX OF ITS OWN SO IT ONLY SHOWS UP HERE
+    sql = """ SELECT name FROM pragma_table_info(?) WHERE pk > 0 """
+    data, error = __db_execute_and_get_output(conn, sql, (table_name,))
+    if error is None and data:
+        unique_column_sets.add(frozenset(col_name for col_name, in data))
+
+    # UNIQUE INDEXES, INCLUDING THE AUTOINDEXES OF PRIMARY KEY AND UNIQUE CONSTRAINTS
+    if error is None:
+        sql = """ SELECT il.name, ii.name FROM pragma_index_list(?) AS il, pragma_index_info(il.name) AS ii WHERE il."unique" = 1 """
+        data, error = __db_execute_and_get_output(conn, sql, (table_name,))
+        if error is None:
+            index_columns_dict = {}
+            for index_name, col_name in data:
+                index_columns_dict.setdefault(index_name, set()).add(col_name)
+            for index_columns in index_columns_dict.values():
+                unique_column_sets.add(frozenset(index_columns))
+
+    return unique_column_sets, error
+
+
 def db_get_table_column_info_dict(conn, table_name):
     action = 'PRAGMA table_info'
     sql = """ {} ({}); """.format(action, table_name)
@@ -99,269 +733,2516 @@ def db_get_table_column_info_dict(conn, table_name):
     return column_info_dict, error
 
 
-def db_select_all_from_table(conn, table_info_dict):
-    table_name = table_info_dict[TABLE_NAME_KEY]
+def db_select_all_from_table(conn, table_info_dict, row_format=None):
+    """
+    Select all rows of a table.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :return: rows: rows in the requested row format OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
 
-    # SET UP SQL STATEMENT WITH FORMAT """ SELECT * FROM {TABLE_NAME} """
-    action = 'SELECT * FROM'
-    sql = """ {} {} """.format(action, table_name)
+    rows, error = __db_select_formatted_rows(conn, compiled_table, compiled_table.select_all_sql, None, row_format)
+    return rows, error
+
+
+def db_select_all_where_first_column_equals(conn, table_info_dict, first_column_val, row_format=None):
+    """
+    Select all rows of a table whose first column equals first_column_val.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param first_column_val: value the first column has to equal
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :return: rows: rows in the requested row format OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = compiled_table.select_where_first_column_sql
+    rows, error = __db_select_formatted_rows(conn, compiled_table, sql, (first_column_val,), row_format)
+    return rows, error
 
-    data, error = __db_execute_and_get_output(conn, sql)
-    row_dict = {}
-    table_columns = table_info_dict[COLUMN_MAP_KEY]
-    column_count = len(table_columns)
-    if error is None:
-        row_index = 0
-        # ITERATE THROUGH ROWS IN DATA
-        for row in data:
-            row_data_dict = {}
-            # COPY OVER COLUMNS FROM TABLE_COLUMNS INTO ROW_DATA_DICT'S ROW DICT
-            for col_index in range(column_count):
-                row_val = row[col_index]
-                row_data_dict[col_index] = row_val
-                col_index += 1
-            row_dict[row_index] = row_data_dict
-            row_index += 1
 
-    return row_dict, error
+def db_iter_all_from_table(conn, table_info_dict, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+    """
+    Streaming version of db_select_all_from_table. Rows are pulled batch_size at a time with fetchmany and yielded
+    one by one, so memory use stays constant no matter how big the table is.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param batch_size: number of rows fetched from the cursor at a time
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT (one {col_index: val} dict per row)
+    :return: row_iter: generator of rows OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
 
+    row_iter, error = __db_iter_formatted_rows(conn, compiled_table, compiled_table.select_all_sql, None, batch_size, row_format)
+    return row_iter, error
 
-def db_select_all_where_first_column_equals(conn, table_info_dict, first_column_val):
-    table_name = table_info_dict[TABLE_NAME_KEY]
 
-    # SET UP SQL STATEMENT WITH FORMAT """ SELECT * FROM {TABLE_NAME} """
-    action = 'SELECT * FROM'
-    sql = """ {} {} WHERE {} == '{}' """.format(action, table_name, table_info_dict[COLUMN_MAP_KEY][0][0], first_column_val)
+def db_iter_where_first_column_equals(conn, table_info_dict, first_column_val, batch_size=DEF_FETCH_BATCH_SIZE,
+                                      row_format=RowFormats.TUPLE):
+    """
+    Streaming version of db_select_all_where_first_column_equals, see db_iter_all_from_table.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param first_column_val: value the first column has to equal
+    :param batch_size: number of rows fetched from the cursor at a time
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT (one {col_index: val} dict per row)
+    :return: row_iter: generator of rows OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = compiled_table.select_where_first_column_sql
+    row_iter, error = __db_iter_formatted_rows(conn, compiled_table, sql, (first_column_val,), batch_size, row_format)
+    return row_iter, error
+
+
+def db_select_where_first_column_in(conn, table_info_dict, first_column_vals, row_format=None, chunk_size=DEF_IN_CHUNK_SIZE):
+    """
+    Select the rows of many keys in a few statements instead of one select per key, see db_iter_where_first_column_in.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param first_column_vals: iterable of first column values
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :param chunk_size: number of keys bound to each select
+    :return: rows: rows in the requested row format, in no particular order OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if row_format is None:
+        row_format = RowFormats.DICT
+    if row_format not in ROW_FORMATS:
+        return [], "Unknown row format: '{}'".format(row_format)
+
+    iter_row_format = RowFormats.TUPLE if row_format == RowFormats.COLUMNS else row_format
+    row_iter, error = db_iter_where_first_column_in(conn, compiled_table, first_column_vals, DEF_FETCH_BATCH_SIZE,
+                                                    iter_row_format, chunk_size)
+    try:
+        if row_format == RowFormats.DICT:
+            rows = dict(enumerate(row_iter))
+        elif row_format == RowFormats.COLUMNS:
+            rows = {col_index: [] for col_index in range(compiled_table.column_count)}
+            batch = list(itertools.islice(row_iter, DEF_FETCH_BATCH_SIZE))
+            while batch:
+                for col_index, col_values in enumerate(zip(*batch)):
+                    rows[col_index].extend(col_values)
+                batch = list(itertools.islice(row_iter, DEF_FETCH_BATCH_SIZE))
+        else:
+            rows = list(row_iter)
+    except sqlite3.Error as e:
+        rows = {} if row_format in (RowFormats.DICT, RowFormats.COLUMNS) else []
+        error = "{}: {}".format(type(e).__name__, e)
+    return rows, error
 
-    data, error = __db_execute_and_get_output(conn, sql)
-    row_dict = {}
-    table_columns = table_info_dict[COLUMN_MAP_KEY]
-    column_count = len(table_columns)
-    if error is None:
-        row_index = 0
-        # ITERATE THROUGH ROWS IN DATA
-        for row in data:
-            row_data_dict = {}
-            # COPY OVER COLUMNS FROM TABLE_COLUMNS INTO ROW_DATA_DICT'S ROW DICT
-            for col_index in range(column_count):
-                row_val = row[col_index]
-                row_data_dict[col_index] = row_val
-                col_index += 1
-            row_dict[row_index] = row_data_dict
-            row_index += 1
 
-    return row_dict, error
+def db_iter_where_first_column_in(conn, table_info_dict, first_column_vals, batch_size=DEF_FETCH_BATCH_SIZE,
+                                  row_format=RowFormats.TUPLE, chunk_size=DEF_IN_CHUNK_SIZE):
+    """
+    Stream the rows of many keys. Keys are bound chunk_size at a time to first_column IN (?,...) selects, kept under
+    SQLITE_MAX_VARIABLE_NUMBER, or with more than DEF_IN_KEY_TABLE_MIN_KEYS keys loaded into a temp key table
+    the table is joined against in a single select. A select failing after the first one raises sqlite3.Error from
+    the generator instead of ending it early.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to select from
+    :param first_column_vals: iterable of first column values
+    :param batch_size: number of rows fetched from the cursor at a time
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT (one {col_index: val} dict per row)
+    :param chunk_size: number of keys bound to each select
+    :return: row_iter: generator of rows, in no particular order OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    # DUPLICATE KEYS IN DIFFERENT CHUNKS WOULD RETURN THEIR ROWS TWICE
+    keys = list(dict.fromkeys(first_column_vals))
+
+    if len(keys) > DEF_IN_KEY_TABLE_MIN_KEYS:
+        try:
+            # A TRANSACTION THE CALLER OPENED WITHOUT db_batch IS JOINED, db_batch WOULD COMMIT IT
+            if conn.in_transaction and db_get_active_batch(conn) is None:
+                key_table_name = __db_fill_key_table(conn, compiled_table, keys)
+            else:
+                with db_batch(conn):
+                    key_table_name = __db_fill_key_table(conn, compiled_table, keys)
+        except sqlite3.Error as e:
+            return iter(()), "{} while loading the key table of '{}' ({})".format(type(e).__name__, compiled_table.table_name, e)
+        sql = """ SELECT * FROM {} WHERE {} IN (SELECT in_key FROM {}) """.format(
+            compiled_table.table_name, compiled_table.first_column_name, key_table_name)
+        row_iter, error = __db_iter_formatted_rows(conn, compiled_table, sql, None, batch_size, row_format)
+        return row_iter, error
+
+    # RUN THE FIRST CHUNK RIGHT AWAY SO ITS ERROR IS RETURNED, LATER CHUNKS RUN AS THE ROWS ARE CONSUMED
+    query = DBQuery(compiled_table).where_in(compiled_table.first_column_name, keys[:chunk_size])
+    row_iter, error = db_iter_query(conn, query, batch_size, row_format)
+    if error is None and len(keys) > chunk_size:
+        row_iter = itertools.chain(row_iter, __db_iter_chunked_in_rows(conn, compiled_table, keys[chunk_size:],
+                                                                       chunk_size, batch_size, row_format))
+    return row_iter, error
 
 
 ###########################################################
-# WRITE OPERATIONS
+# QUERIES
 ###########################################################
 
 
-def db_alter_table(conn, table_info_dict):
-    table_name = table_info_dict[TABLE_NAME_KEY]
-    columns = table_info_dict[COLUMN_MAP_KEY]
+def db_select_query(conn, query, row_format=None):
+    """
+    Run a DBQuery and return all of its rows. Only the queried columns come back, row formats index them in query
+    column order (DICT rows are {query_col_index: val}, RECORD rows get one slot per queried column).
+        query = DBQuery(TestTableInfo).where('second_column', QueryOperators.GE, 10).order_by('second_column').limit(5)
+        rows, error = db_select_query(conn, query, RowFormats.TUPLE)
+    :param conn: sqlite3 connection
+    :param query: DBQuery
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :return: rows: rows in the requested row format OR error: error received while compiling or executing
+    """
+    compiled_query, error = db_compile_query(query)
+    if error is not None:
+        return ({} if row_format in (None, RowFormats.DICT, RowFormats.COLUMNS) else []), error
 
+    rows, error = __db_select_formatted_rows(conn, compiled_query, compiled_query.sql, query.get_values(), row_format)
+    return rows, error
 
-def db_drop_table(conn, table_name):
-    action = 'DROP TABLE'
-    sql = """ {} {} """.format(action, table_name)
 
-    data, error = __db_execute_and_get_output(conn, sql)
+def db_iter_query(conn, query, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+    """
+    Streaming version of db_select_query, see db_iter_all_from_table.
+    :param conn: sqlite3 connection
+    :param query: DBQuery
+    :param batch_size: number of rows fetched from the cursor at a time
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT (one {query_col_index: val} dict per row)
+    :return: row_iter: generator of rows OR error: error received while compiling or executing
+    """
+    compiled_query, error = db_compile_query(query)
     if error is not None:
-        conn.commit()
-    return data, error
+        return iter(()), error
 
+    row_iter, error = __db_iter_formatted_rows(conn, compiled_query, compiled_query.sql, query.get_values(), batch_size, row_format)
+    return row_iter, error
 
-def db_create_table(conn, table_info_dict):
-    table_name = table_info_dict[TABLE_NAME_KEY]
-    columns = table_info_dict[COLUMN_MAP_KEY]
 
-    # SET UP SQL STATEMENT WITH FORMAT """ CREATE TABLE IF NOT EXISTS {TABLE_NAME} ({COLUMNS AND TYPES}); """
-    action = 'CREATE TABLE IF NOT EXISTS'
-    columns_str = __get_columns_and_types_str(columns)
-    sql = """ {} {} ({}); """.format(action, table_name, columns_str)
+def db_count(conn, table_info_dict, where_query=None):
+    """
+    Count rows inside sqlite.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to count
+    :param where_query: optional DBQuery on the table, only rows matching its predicates are counted
+    :return: row_count OR error: error received while compiling or executing
+    """
+    row_count, error = db_aggregate(conn, table_info_dict, AggregateFunctions.COUNT, None, where_query)
+    return row_count, error
+
 
-    data, error = __db_execute_and_get_output(conn, sql)
+def db_exists(conn, table_info_dict, first_column_val):
+    """
+    Check for a row whose first column equals first_column_val, stopping at the first match.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to check
+    :param first_column_val: value the first column has to equal
+    :return: row_exists OR error: error received while compiling or executing
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    query = DBQuery(compiled_table).select(compiled_table.first_column_name)
+    query = query.where(compiled_table.first_column_name, QueryOperators.EQ, first_column_val).limit(1)
+    rows, error = db_select_query(conn, query, RowFormats.TUPLE)
+    return len(rows) > 0, error
+
+
+def db_aggregate(conn, table_info_dict, function, column_name=None, where_query=None):
+    """
+    Compute one aggregate of a column inside sqlite. MIN and MAX of an indexed column are a single index lookup.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to aggregate
+    :param function: one of AggregateFunctions
+    :param column_name: column to aggregate, None for COUNT(*)
+    :param where_query: optional DBQuery on the table, only rows matching its predicates are aggregated, its limit,
+        offset and order are ignored
+    :return: value: the aggregate, None for SUM/MIN/MAX/AVG of no rows OR error: error received while compiling or executing
+    """
+    query = where_query.without_paging() if where_query is not None else DBQuery(table_info_dict)
+    rows, error = db_select_query(conn, query.aggregate(function, column_name), RowFormats.TUPLE)
+    value = rows[0][0] if error is None and rows else None
+    return value, error
+
+
+def db_sum(conn, table_info_dict, column_name, where_query=None):
+    value, error = db_aggregate(conn, table_info_dict, AggregateFunctions.SUM, column_name, where_query)
+    return value, error
+
+
+def db_min(conn, table_info_dict, column_name, where_query=None):
+    value, error = db_aggregate(conn, table_info_dict, AggregateFunctions.MIN, column_name, where_query)
+    return value, error
+
+
+def db_max(conn, table_info_dict, column_name, where_query=None):
+    value, error = db_aggregate(conn, table_info_dict, AggregateFunctions.MAX, column_name, where_query)
+    return value, error
+
+
+def db_avg(conn, table_info_dict, column_name, where_query=None):
+    value, error = db_aggregate(conn, table_info_dict, AggregateFunctions.AVG, column_name, where_query)
+    return value, error
+
+
+def db_group_by(conn, table_info_dict, group_column_names, aggregates, where_query=None, row_format=None):
+    """
+    Group rows inside sqlite and return one row per group: the group columns followed by the aggregates.
+        rows, error = db_group_by(conn, TestTableInfo, ['third_column'],
+                                  [(AggregateFunctions.COUNT, None), (AggregateFunctions.SUM, 'second_column')])
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to group
+    :param group_column_names: columns to group by
+    :param aggregates: iterable of (function, column_name) pairs, column_name None for COUNT(*)
+    :param where_query: optional DBQuery on the table, only rows matching its predicates are grouped
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT, RECORD fields are named e.g. sum_second_column
+    :return: rows: one row per group in the requested row format OR error: error received while compiling or executing
+    """
+    query = where_query if where_query is not None else DBQuery(table_info_dict)
+    query = query.group_by(*group_column_names)
+    for function, column_name in aggregates:
+        query = query.aggregate(function, column_name)
+
+    rows, error = db_select_query(conn, query, row_format)
+    return rows, error
+
+
+def db_select_columns_as_arrays(conn, table_info_dict, column_names=None, where_query=None, use_numpy=None):
+    """
+    Export columns as typed arrays, filled straight from fetchmany batches. INTEGER and REAL columns become
+    array.array('q') / array.array('d'), or NumPy int64 / float64 arrays, the other column types and numeric
+    columns holding NULLs or values of another type become lists.
+        array_dict, error = db_select_columns_as_arrays(conn, TestTableInfo, ['second_column'])
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to export
+    :param column_names: columns to export, defaults to all of them
+    :param where_query: optional DBQuery on the table, only rows matching its predicates are exported
+    :param use_numpy: True for NumPy arrays, False for array.array, None for NumPy only when it is installed
+    :return: array_dict: {col_name: array} OR error: error received while compiling or executing
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    column_names = tuple(column_names) if column_names else compiled_table.column_names
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    elif use_numpy and numpy is None:
+        return {}, "NumPy is not installed"
+
+    query = where_query if where_query is not None else DBQuery(compiled_table)
+    compiled_query, error = db_compile_query(query.select(*column_names))
     if error is not None:
-        conn.commit()
-    return data, error
+        return {}, error
+    cursor, error = __db_execute_and_get_cursor(conn, compiled_query.sql, query.get_values())
+    if error is not None:
+        return {}, error
+
+    typecodes = [COLUMN_ARRAY_TYPECODES.get(compiled_table.column_types[compiled_table.column_index_map[col_name]])
+                 for col_name in column_names]
+    arrays = [array.array(typecode) if typecode else [] for typecode in typecodes]
+    try:
+        batch = cursor.fetchmany(DEF_FETCH_BATCH_SIZE)
+        while batch:
+            for col_index, col_values in enumerate(zip(*batch)):
+                values = arrays[col_index]
+                value_count = len(values)
+                try:
+                    values.extend(col_values)
+                except TypeError:
+                    # NULL OR A VALUE OF ANOTHER TYPE, SQLITE COLUMNS DO NOT ENFORCE THEIR TYPE, FALL BACK TO A LIST
+                    del values[value_count:]
+                    arrays[col_index] = values.tolist()
+                    arrays[col_index].extend(col_values)
+                    typecodes[col_index] = None
+            batch = cursor.fetchmany(DEF_FETCH_BATCH_SIZE)
+    except sqlite3.OperationalError:
+        return {}, "OperationalError in statement: '''{}'''".format(compiled_query.sql)
+    finally:
+        cursor.close()
+
+    if use_numpy:
+        for col_index, typecode in enumerate(typecodes):
+            if typecode:
+                # SHARES THE array.array BUFFER INSTEAD OF COPYING IT
+                dtype = numpy.int64 if typecode == 'q' else numpy.float64
+                arrays[col_index] = numpy.frombuffer(arrays[col_index], dtype) if arrays[col_index] else numpy.empty(0, dtype)
+    return dict(zip(column_names, arrays)), error
+
+
+__compiled_query_cache = {}
+
+
+def db_compile_query(query):
+    """
+    Get the DBCompiledQuery of a query. The statement text only depends on the query's shape (columns, predicate
+    operators, ordering, ...) and never on its values, so it is built once per shape and every later query of that
+    shape reuses the same text, which also keeps sqlite3's own statement cache hitting.
+    :param query: DBQuery
+    :return: compiled_query OR error: error describing an unknown column or operator
+    """
+    shape = query.get_shape()
+    compiled_query = __compiled_query_cache.get(shape)
+    error = None
+    if compiled_query is None:
+        compiled_query, error = __db_build_query(query)
+        if error is None:
+            if len(__compiled_query_cache) >= MAX_COMPILED_QUERY_CACHE_SIZE:
+                __compiled_query_cache.clear()
+            __compiled_query_cache[shape] = compiled_query
+    return compiled_query, error
 
 
-def db_insert_into_table(conn, table_info_dict, val_tuple):
-    table_name = table_info_dict[TABLE_NAME_KEY]
-    columns = table_info_dict[COLUMN_MAP_KEY]
+def __db_build_query(query):
+    """
+    Build the select statement of a query.
+    :param query: DBQuery
+    :return: compiled_query OR error: error describing an unknown column or operator
+    """
+    compiled_table = query.compiled_table
+    table_name = compiled_table.table_name
+
+    if query.aggregates or query.group_columns:
+        # GROUP COLUMNS FIRST, THEN ONE RESULT COLUMN PER AGGREGATE, e.g. third_column, count, sum_second_column
+        select_strs = list(query.group_columns)
+        column_names = list(query.group_columns)
+        source_column_names = list(query.group_columns)
+        for function, col_name in query.aggregates:
+            if function not in AGGREGATE_FUNCTIONS:
+                return None, "Unknown aggregate function: '{}'".format(function)
+            if col_name is None:
+                if function != AggregateFunctions.COUNT:
+                    return None, "Aggregate function '{}' needs a column".format(function)
+                select_strs.append("{}(*)".format(function))
+                column_names.append(function.lower())
+            else:
+                select_strs.append("{}({})".format(function, col_name))
+                column_names.append("{}_{}".format(function.lower(), col_name))
+                source_column_names.append(col_name)
+    else:
+        select_strs = column_names = source_column_names = query.column_names or compiled_table.column_names
+
+    order_columns = query.get_order_columns()
+    used_column_names = itertools.chain(source_column_names, (col_name for col_name, operator, values in query.predicates),
+                                        (col_name for col_name, descending in order_columns))
+    for col_name in used_column_names:
+        if col_name not in compiled_table.column_index_map:
+            return None, "Unknown column '{}' in query on table '{}'".format(col_name, table_name)
+
+    conditions = []
+    for col_name, operator, values in query.predicates:
+        if operator not in QUERY_OPERATORS:
+            return None, "Unknown query operator: '{}'".format(operator)
+        if operator in QUERY_LIST_OPERATORS:
+            conditions.append("{} {} ({})".format(col_name, operator, ",".join("?" * len(values))))
+        else:
+            conditions.append("{} {} ?".format(col_name, operator))
+
+    if query.after_values is not None:
+        if len(query.after_values) != len(order_columns):
+            return None, "Keyset query on table '{}' needs one after value per order column {}".format(
+                table_name, tuple(col_name for col_name, descending in order_columns))
+        conditions.append(__db_get_keyset_condition(order_columns))
+
+    sql = " SELECT {} FROM {}".format(",".join(select_strs), table_name)
+    if conditions:
+        sql += " WHERE {}".format(" AND ".join(conditions))
+    if query.group_columns:
+        sql += " GROUP BY {}".format(",".join(query.group_columns))
+    if order_columns:
+        sql += " ORDER BY {}".format(",".join(
+            "{} DESC".format(col_name) if descending else col_name for col_name, descending in order_columns))
+    if query.limit_count is not None or query.offset_count is not None:
+        # SQLITE ONLY TAKES AN OFFSET AFTER A LIMIT, THE LIMIT IS BOUND AS -1 (NO LIMIT) WHEN ONLY AN OFFSET IS SET
+        sql += " LIMIT ?"
+        if query.offset_count is not None:
+            sql += " OFFSET ?"
+    sql += " "
+
+    if tuple(column_names) == compiled_table.column_names:
+        record_class = compiled_table.record_class
+    else:
+        record_class = db_make_record_class(compiled_table.record_class.__name__, column_names)
+    return DBCompiledQuery(sql, column_names, record_class), None
+
+
+def __db_get_keyset_condition(order_columns):
+    """
+    Condition selecting the rows after a key in the given ordering, e.g. (a,b) > (?,?). Orderings mixing ascending
+    and descending columns can not use a row value and are expanded to a > ? OR (a = ? AND b < ?).
+    :param order_columns: tuple of (col_name, descending) pairs
+    :return: condition_str, see DBQuery.get_values for the values it binds
+    """
+    directions = set(descending for col_name, descending in order_columns)
+    if len(directions) == 1:
+        col_names = [col_name for col_name, descending in order_columns]
+        operator = QueryOperators.LT if directions.pop() else QueryOperators.GT
+        if len(col_names) == 1:
+            return "{} {} ?".format(col_names[0], operator)
+        return "({}) {} ({})".format(",".join(col_names), operator, ",".join("?" * len(col_names)))
+
+    or_conditions = []
+    for order_index, (col_name, descending) in enumerate(order_columns):
+        and_conditions = ["{} = ?".format(equal_col_name) for equal_col_name, equal_descending in order_columns[:order_index]]
+        and_conditions.append("{} {} ?".format(col_name, QueryOperators.LT if descending else QueryOperators.GT))
+        or_conditions.append("({})".format(" AND ".join(and_conditions)))
+    return "({})".format(" OR ".join(or_conditions))
+
+
+###########################################################
+# BLOB STREAMING
+###########################################################
+
+
+def db_get_rowid_where_first_column_equals(conn, table_info_dict, first_column_val):
+    """
+    Get the rowid of the first row whose first column equals first_column_val, the handle incremental blob I/O needs.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :param first_column_val: value the first column has to equal
+    :return: rowid: None without a matching row OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = """ SELECT rowid FROM {} WHERE {} = ? LIMIT 1 """.format(compiled_table.table_name, compiled_table.first_column_name)
+    data, error = __db_execute_and_get_output(conn, sql, (first_column_val,))
+    rowid = data[0][0] if data else None
+    return rowid, error
+
+
+def db_open_blob(conn, table_info_dict, first_column_val, column_name, readonly=True):
+    """
+    Open one blob value for incremental I/O through Connection.blobopen, without loading it. The returned
+    sqlite3.Blob is file-like (read, write, seek, tell, close, with-statement). A blob can not change size, see
+    db_preallocate_blob before writing.
+        blob, error = db_open_blob(conn, table, 'key_1', 'data')
+        with blob:
+            header = blob.read(16)
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :param first_column_val: first column value of the row
+    :param column_name: blob column to open
+    :param readonly: open for reading only
+    :return: blob: sqlite3.Blob OR error: missing row, NULL value or error received from sqlite
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if column_name not in compiled_table.column_index_map:
+        return None, "Unknown column '{}' in blob of table '{}'".format(column_name, compiled_table.table_name)
+
+    blob = None
+    rowid, error = db_get_rowid_where_first_column_equals(conn, compiled_table, first_column_val)
+    if error is None and rowid is None:
+        error = "No row with {} = {!r} in table '{}'".format(compiled_table.first_column_name, first_column_val, compiled_table.table_name)
+    if error is None:
+        try:
+            blob = conn.blobopen(compiled_table.table_name, column_name, rowid, readonly=readonly)
+        except sqlite3.Error as e:
+            error = "{} opening blob {}.{} of row {} ({})".format(type(e).__name__, compiled_table.table_name, column_name, rowid, e)
+    return blob, error
+
+
+def db_preallocate_blob(conn, table_info_dict, first_column_val, column_name, size):
+    """
+    Set a blob column to size zero bytes with zeroblob() without building them in python, so it can then be
+    filled through db_open_blob.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :param first_column_val: first column value of the row
+    :param column_name: blob column to preallocate
+    :param size: size in bytes
+    :return: data OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if column_name not in compiled_table.column_index_map:
+        return None, "Unknown column '{}' in blob of table '{}'".format(column_name, compiled_table.table_name)
+
+    sql = """ UPDATE {} SET {} = zeroblob(?) WHERE {} = ? """.format(compiled_table.table_name, column_name, compiled_table.first_column_name)
+    data, error = __db_execute_and_get_output(conn, sql, (size, first_column_val))
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_copy_blob_to_file(conn, table_info_dict, first_column_val, column_name, file_obj, buffer_size=DEF_BLOB_BUFFER_SIZE):
+    """
+    Stream a blob into a binary file object, only buffer_size bytes in memory at a time.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :param first_column_val: first column value of the row
+    :param column_name: blob column to copy
+    :param file_obj: binary file object opened for writing
+    :param buffer_size: number of bytes read per chunk
+    :return: byte_count: number of bytes copied OR error
+    """
+    byte_count = 0
+    blob, error = db_open_blob(conn, table_info_dict, first_column_val, column_name)
+    if error is None:
+        try:
+            with blob:
+                # sqlite3.Blob HAS NO readinto, EVERY CHUNK IS ONE buffer_size bytes OBJECT FREED BEFORE THE NEXT READ
+                chunk = blob.read(buffer_size)
+                while chunk:
+                    file_obj.write(chunk)
+                    byte_count += len(chunk)
+                    chunk = blob.read(buffer_size)
+        except sqlite3.Error as e:
+            error = "{} reading blob {} of {!r} ({})".format(type(e).__name__, column_name, first_column_val, e)
+    return byte_count, error
+
+
+def db_write_blob_from_file(conn, table_info_dict, first_column_val, column_name, file_obj, size=None,
+                            buffer_size=DEF_BLOB_BUFFER_SIZE):
+    """
+    Stream a binary file object into a blob column of an existing row: preallocate it with zeroblob, then copy the
+    file in through one reused buffer, all in a single transaction.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :param first_column_val: first column value of the row
+    :param column_name: blob column to write
+    :param file_obj: binary file object opened for reading, positioned at the start of the data
+    :param size: number of bytes to copy, defaults to the rest of a seekable file_obj
+    :param buffer_size: number of bytes copied per chunk
+    :return: byte_count: number of bytes written OR error: 0 and the error, the failed copy is rolled back
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if size is None:
+        start_position = file_obj.tell()
+        size = file_obj.seek(0, 2) - start_position
+        file_obj.seek(start_position)
+
+    byte_count = 0
+    error = None
+    buffer = bytearray(buffer_size)
+    buffer_view = memoryview(buffer)
+    try:
+        # THE ZEROBLOB AND EVERY CHUNK WRITTEN INTO IT COMMIT TOGETHER
+        with db_batch(conn):
+            data, error = db_preallocate_blob(conn, compiled_table, first_column_val, column_name, size)
+            if error is None:
+                blob, error = db_open_blob(conn, compiled_table, first_column_val, column_name, readonly=False)
+            if error is not None:
+                raise sqlite3.DatabaseError(error)
+            with blob:
+                while byte_count < size:
+                    read_count = file_obj.readinto(buffer_view[:min(buffer_size, size - byte_count)])
+                    if not read_count:
+                        raise sqlite3.DatabaseError("File ended after {} of {} bytes".format(byte_count, size))
+                    blob.write(buffer_view[:read_count])
+                    byte_count += read_count
+    except sqlite3.DatabaseError as e:
+        error = error if error is not None else "{} writing blob {} of {!r} ({})".format(type(e).__name__, column_name, first_column_val, e)
+        # THE BATCH ROLLED BACK, NONE OF THE BYTES COPIED SO FAR ARE STORED
+        byte_count = 0
+    return byte_count, error
+
+
+###########################################################
+# CHANGE FEED
+###########################################################
+
+
+class DBChange:
+    """
+    Row delta returned by db_get_changes_since. Changes of one key are collapsed into the latest one, rows holds the
+    current rows of the key, empty for ChangeOps.DELETE.
+    """
+    __slots__ = ('seq', 'op', 'key', 'rows')
+
+    def __init__(self, seq, op, key, rows):
+        self.seq = seq
+        self.op = op
+        self.key = key
+        self.rows = rows
+
+    def __repr__(self):
+        return "DBChange(seq={}, op={!r}, key={!r}, rows={!r})".format(self.seq, self.op, self.key, self.rows)
+
+
+def db_create_change_feed(conn, table_info_dict):
+    """
+    Start recording the writes of a table. Triggers log the first column value of every inserted, updated and deleted
+    row into a <table>__changes table under an increasing seq, in the transaction of the write itself.
+    Rows deleted by INSERT OR REPLACE are logged as deletes because db_replace_* turn PRAGMA recursive_triggers on for
+    recorded tables, raw INSERT OR REPLACE statements need it on too. db_alter_table recreates the triggers of a
+    rebuilt table.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to record
+    :return: data: output of the last statement OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    change_table_name = __db_get_change_table_name(compiled_table)
+    statements = [(""" CREATE TABLE IF NOT EXISTS {} (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, row_key) """
+                   .format(change_table_name), None)]
+    statements.extend((sql, None) for sql in __db_get_change_trigger_sqls(compiled_table))
+    data, error = __db_execute_statements_in_batch(conn, statements)
+    return data, error
+
+
+def db_drop_change_feed(conn, table_info_dict):
+    """
+    Stop recording the writes of a table and drop its changelog.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the recorded table
+    :return: data: output of the last statement OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    statements = [(""" DROP TRIGGER IF EXISTS {}__changes_{} """.format(compiled_table.table_name, op), None)
+                  for op in (ChangeOps.INSERT, ChangeOps.UPDATE, ChangeOps.DELETE)]
+    statements.append((""" DROP TABLE IF EXISTS {} """.format(__db_get_change_table_name(compiled_table)), None))
+    data, error = __db_execute_statements_in_batch(conn, statements)
+    return data, error
+
+
+def db_get_last_change_seq(conn, table_info_dict):
+    """
+    Get the seq of the latest change of a table. Read it before loading the table, then poll db_get_changes_since
+    with it, changes made in between are delivered again which is harmless as deltas carry the current rows.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the recorded table
+    :return: seq: 0 before the first change OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = """ SELECT seq FROM sqlite_sequence WHERE name = ? """
+    rows, error = __db_select_formatted_rows(conn, compiled_table, sql, (__db_get_change_table_name(compiled_table),),
+                                             RowFormats.TUPLE)
+    return (rows[0][0] if rows else 0), error
+
+
+def db_get_changes_since(conn, table_info_dict, since_seq=0, limit=DEF_CHANGE_BATCH_SIZE, row_format=RowFormats.TUPLE):
+    """
+    Get what changed in a table after since_seq, in O(changes). Reads up to limit changelog entries, collapses them to
+    one DBChange per key and attaches the current rows of every key still present, all in one read transaction.
+    Poll again with LAST_SEQ_KEY until CHANGES_KEY comes back empty. Fails if entries after since_seq were already
+    compacted, the caller has to reload the table then.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the recorded table
+    :param since_seq: seq of the last change already applied, 0 for all
+    :param limit: most changelog entries read per call
+    :param row_format: RowFormats.TUPLE, ROW or RECORD, format of DBChange.rows
+    :return: changes: dict with CHANGES_KEY, a list of DBChange in seq order, and LAST_SEQ_KEY OR error: error received
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if row_format not in (RowFormats.TUPLE, RowFormats.ROW, RowFormats.RECORD):
+        return None, "Unsupported change feed row format: '{}'".format(row_format)
+
+    change_table_name = __db_get_change_table_name(compiled_table)
+    if row_format == RowFormats.RECORD:
+        get_row_key = operator.attrgetter(compiled_table.first_column_name)
+    else:
+        get_row_key = operator.itemgetter(compiled_table.column_names.index(compiled_table.first_column_name))
+    try:
+        # ONE READ TRANSACTION SO THE ROWS MATCH THE CHANGELOG ENTRIES
+        with db_batch(conn):
+            first_seq, last_seq = conn.execute(""" SELECT min(seq), max(seq) FROM {} """.format(change_table_name)).fetchone()
+            if first_seq is None:
+                last_seq, error = db_get_last_change_seq(conn, compiled_table)
+                if error is not None:
+                    return None, error
+                first_seq = last_seq + 1
+            if since_seq < first_seq - 1:
+                return None, "Changes of {} after seq {} were compacted, reload the table".format(compiled_table.table_name, since_seq)
+
+            # LATEST OP OF EACH KEY, IN THE ORDER OF THEIR LATEST CHANGE
+            key_change_dict = {}
+            cursor = conn.execute(""" SELECT seq, op, row_key FROM {} WHERE seq > ? ORDER BY seq LIMIT ? """
+                                  .format(change_table_name), (since_seq, limit))
+            for seq, op, key in cursor:
+                key_change_dict.pop(key, None)
+                key_change_dict[key] = DBChange(seq, op, key, [])
+                since_seq = seq
+
+            # DELETED KEYS ARE SELECTED TOO, WITHOUT A PRIMARY KEY OTHER ROWS OF THE SAME KEY CAN REMAIN
+            rows, error = db_select_where_first_column_in(conn, compiled_table, list(key_change_dict), row_format)
+            if error is not None:
+                return None, error
+            for row in rows:
+                key_change_dict[get_row_key(row)].rows.append(row)
+    except sqlite3.DatabaseError as e:
+        return None, "{}: {}".format(type(e).__name__, e)
+
+    changes = list(key_change_dict.values())
+    for change in changes:
+        # THE ROWS DECIDE, A KEY CAN BE GONE AGAIN OR BACK BY WRITES BEYOND THE ENTRIES READ
+        if not change.rows:
+            change.op = ChangeOps.DELETE
+        elif change.op == ChangeOps.DELETE:
+            change.op = ChangeOps.UPDATE
+    return {CHANGES_KEY: changes, LAST_SEQ_KEY: since_seq}, None
+
+
+def db_compact_changes(conn, table_info_dict, up_to_seq=None, keep_last=None):
+    """
+    Delete old changelog entries. Consumers behind the compacted seq get an error from db_get_changes_since.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the recorded table
+    :param up_to_seq: delete the entries up to and including this seq, all if None
+    :param keep_last: keep at least this many of the latest entries
+    :return: deleted_count: number of entries deleted OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    if up_to_seq is None or keep_last is not None:
+        last_seq, error = db_get_last_change_seq(conn, compiled_table)
+        if error is not None:
+            return 0, error
+        up_to_seq = last_seq if up_to_seq is None else up_to_seq
+        if keep_last is not None:
+            up_to_seq = min(up_to_seq, last_seq - keep_last)
+
+    sql = """ DELETE FROM {} WHERE seq <= ? """.format(__db_get_change_table_name(compiled_table))
+    cursor, error = __db_execute_and_get_cursor(conn, sql, (up_to_seq,))
+    __db_commit_write(conn, error)
+    return (cursor.rowcount if error is None else 0), error
+
+
+###########################################################
+# FULL TEXT SEARCH
+###########################################################
+
+
+def db_search(conn, table_info_dict, query, limit=DEF_SEARCH_LIMIT, row_format=None):
+    """
+    Full text search over the searchable columns of a table, best matches first by FTS5's bm25 rank.
+    The query is FTS5 query syntax, e.g. 'apple OR pear', 'third_column: apple', 'app*'. Pass text typed by a user
+    through db_get_search_phrase first.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of a table with SEARCHABLE_COLUMNS_KEY
+    :param query: FTS5 match query
+    :param limit: most rows returned
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :return: rows: matching rows in the requested row format OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if not compiled_table.searchable_columns:
+        return [], "Table {} has no searchable columns".format(compiled_table.table_name)
+
+    rows, error = __db_select_formatted_rows(conn, compiled_table, compiled_table.search_sql, (query, limit), row_format)
+    return rows, error
+
+
+def db_get_search_phrase(text):
+    """
+    Turn free text into an FTS5 query matching rows that contain all of its words, with quotes and operators in the
+    text taken literally.
+    :param text: text typed by a user
+    :return: query: FTS5 match query
+    """
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def db_rebuild_search_index(conn, table_info_dict, optimize=False):
+    """
+    Rebuild the search index of a table from its rows, e.g. after writes made with the triggers missing. Optionally
+    merge the index b-trees afterwards for faster searches.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of a table with SEARCHABLE_COLUMNS_KEY
+    :param optimize: also run the FTS5 'optimize' command
+    :return: data: output of the last statement OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    if not compiled_table.searchable_columns:
+        return None, "Table {} has no searchable columns".format(compiled_table.table_name)
+
+    statements = [(compiled_table.search_rebuild_sql, None)]
+    if optimize:
+        statements.append((compiled_table.search_optimize_sql, None))
+    data, error = __db_execute_statements_in_batch(conn, statements)
+    return data, error
+
+
+###########################################################
+# WRITE OPERATIONS
+###########################################################
+
+
+def db_alter_table(conn, table_info_dict, old_table_col_dict=None):
+    """
+    Migrates an existing table to the columns of table_info_dict inside sqlite, in a single transaction. Columns are
+    matched by name and type, columns without a match get their DEF_VAL_MAP default.
+    When the old columns are an unchanged prefix of the new ones the new columns are added with ALTER TABLE ADD COLUMN,
+    otherwise a new table is filled with INSERT INTO ... SELECT ... FROM the old one, which is then dropped and the new
+    one renamed. No rows pass through python either way, and a failure rolls the whole migration back.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict to migrate the table to
+    :param old_table_col_dict: column info dict of the existing table, read with db_get_table_column_info_dict if None
+    :return: data: output of the last statement OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    if old_table_col_dict is None:
+        old_table_col_dict, error = db_get_table_column_info_dict(conn, compiled_table.table_name)
+        if error is not None:
+            return None, error
+
+    col_compare_list = db_get_column_compare_list(compiled_table, old_table_col_dict)
+    old_col_count = len(old_table_col_dict)
+    new_col_count = compiled_table.column_count
+    key_columns = set(compiled_table.primary_key).union(*compiled_table.unique_constraints)
+
+    # OLD COLUMNS ARE AN UNCHANGED PREFIX, ADD THE NEW ONES IN PLACE (KEY COLUMNS CAN NOT BE ADDED THIS WAY)
+    if new_col_count > old_col_count and col_compare_list[:old_col_count] == list(range(old_col_count)) \
+            and not key_columns.intersection(compiled_table.column_names[old_col_count:]):
+        statements = []
+        for col_index in range(old_col_count, new_col_count):
+            col_name = compiled_table.column_names[col_index]
+            col_type = compiled_table.column_types[col_index]
+            def_val_literal = __db_get_sql_literal(DEF_VAL_MAP.get(col_type))
+            sql = """ ALTER TABLE {} ADD COLUMN {} {} DEFAULT {} """.format(compiled_table.table_name, col_name, col_type, def_val_literal)
+            statements.append((sql, None))
+    # REBUILD THE TABLE: CREATE NEW, COPY WITH INSERT ... SELECT, DROP OLD, RENAME NEW
+    else:
+        migration_table_name = "{}__migration".format(compiled_table.table_name)
+        select_columns = []
+        select_params = []
+        for col_index in range(new_col_count):
+            old_col_index = col_compare_list[col_index]
+            if old_col_index == COLUMN_MISMATCH_INDEX:
+                select_columns.append("?")
+                select_params.append(DEF_VAL_MAP.get(compiled_table.column_types[col_index]))
+            else:
+                select_columns.append(old_table_col_dict[old_col_index][COLUMN_NAME_INDEX])
+        statements = [
+            (""" DROP TABLE IF EXISTS {} """.format(migration_table_name), None),
+            (compiled_table.get_create_sql(migration_table_name), None),
+            (""" INSERT INTO {} ({}) SELECT {} FROM {} """.format(migration_table_name, compiled_table.column_names_str,
+                                                                 ",".join(select_columns), compiled_table.table_name),
+             tuple(select_params)),
+            (""" DROP TABLE {} """.format(compiled_table.table_name), None),
+            (""" ALTER TABLE {} RENAME TO {} """.format(migration_table_name, compiled_table.table_name), None),
+        ]
+        # DROPPING THE OLD TABLE DROPPED ITS CHANGE FEED TRIGGERS, THE CHANGELOG ITSELF IS KEPT
+        change_feed_exists, error = db_check_table_exists(conn, __db_get_change_table_name(compiled_table))
+        if error is not None:
+            return None, error
+        if change_feed_exists:
+            statements.extend((sql, None) for sql in __db_get_change_trigger_sqls(compiled_table))
+
+    # REBUILT TABLES LOST THEIR INDEXES, ADDED COLUMNS MAY BE INDEXED FOR THE FIRST TIME
+    statements.extend((sql, None) for sql in compiled_table.index_sqls)
+
+    # REBUILT TABLES GET NEW ROWIDS AND THE SEARCHABLE COLUMNS MAY HAVE CHANGED, SO THE SEARCH INDEX IS MADE AGAIN
+    if compiled_table.search_sqls:
+        statements.extend((sql, None) for sql in compiled_table.search_drop_sqls + compiled_table.search_sqls)
+        statements.append((compiled_table.search_rebuild_sql, None))
+
+    data, error = __db_execute_statements_in_batch(conn, statements)
+    return data, error
+
+
+def db_check_tables_match(table_info_dict, other_table_col_dict):
+    """
+    Checks if the columns of the table match other_table_col_dict, name and type, column by column.
+    :param table_info_dict: table info dict of the table
+    :param other_table_col_dict: column dict of the other table, {col_index: (col_name, col_type, ...)}
+    :return: True if match, False if not
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    if compiled_table.column_count != len(other_table_col_dict):
+        return False
+    for col_index in range(compiled_table.column_count):
+        other_col_info = other_table_col_dict[col_index]
+        if other_col_info[COLUMN_NAME_INDEX] != compiled_table.column_names[col_index] or \
+                other_col_info[COLUMN_TYPE_INDEX] != compiled_table.column_types[col_index]:
+            return False
+    return True
+
+
+def db_get_table_signature(table_info_dict):
+    """
+    Get a stable fingerprint of everything declared in a table info dict, used to spot tables whose declaration
+    changed since they were last checked against the database.
+    :param table_info_dict: table info dict, AbstractDBTable subclass or compiled table
+    :return: signature: hex digest
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    cache_key = __get_table_cache_key(compiled_table.table_info_dict)
+    return hashlib.sha1(repr(cache_key).encode()).hexdigest()
+
+
+def db_get_column_compare_list(table_info_dict, other_table_col_dict):
+    """
+    For every column of the table, find the index of the column with the same name and type in other_table_col_dict.
+    :param table_info_dict: table info dict of the table
+    :param other_table_col_dict: column dict of the other table, {col_index: (col_name, col_type, ...)}
+    :return: col_compare_list: other column index per column index, COLUMN_MISMATCH_INDEX where there is no match
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    other_col_index_dict = {}
+    for other_col_index in range(len(other_table_col_dict)):
+        other_col_info = other_table_col_dict[other_col_index]
+        # COLUMNS CAN ONLY MATCH ONCE, KEEP THE FIRST
+        other_col_index_dict.setdefault((other_col_info[COLUMN_NAME_INDEX], other_col_info[COLUMN_TYPE_INDEX]), other_col_index)
+
+    col_compare_list = [
+        other_col_index_dict.get(col_name_type, COLUMN_MISMATCH_INDEX)
+        for col_name_type in zip(compiled_table.column_names, compiled_table.column_types)
+    ]
+    return col_compare_list
+
+
+def db_drop_table(conn, table_name):
+    action = 'DROP TABLE'
+    sql = """ {} {} """.format(action, table_name)
+
+    data, error = __db_execute_and_get_output(conn, sql)
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_create_table(conn, table_info_dict):
+    compiled_table = db_compile_table(table_info_dict)
+
+    data, error = __db_execute_and_get_output(conn, compiled_table.create_sql)
+    # SECONDARY INDEXES AND THE SEARCH INDEX, PRIMARY KEY AND UNIQUE CONSTRAINTS ARE PART OF THE CREATE STATEMENT ITSELF
+    for sql in compiled_table.index_sqls + compiled_table.search_sqls:
+        if error is not None:
+            break
+        data, error = __db_execute_and_get_output(conn, sql)
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_create_table_indexes(conn, table_info_dict):
+    """
+    Adds the declared keys and indexes an existing table is missing. A primary key or unique constraint can not be
+    added to an existing sqlite table, so those are created as unique indexes, which gives the same O(log n) lookups.
+    A missing search index is created and filled from the existing rows.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table
+    :return: data: output of the last statement OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    data = None
+    error = None
+    if compiled_table.key_index_sqls:
+        unique_column_sets, error = db_get_table_unique_column_sets(conn, compiled_table.table_name)
+        for key_columns, sql in compiled_table.key_index_sqls:
+            if error is not None:
+                break
+            if frozenset(key_columns) not in unique_column_sets:
+                data, error = __db_execute_and_get_output(conn, sql)
+    for sql in compiled_table.index_sqls:
+        if error is not None:
+            break
+        data, error = __db_execute_and_get_output(conn, sql)
+    if compiled_table.search_sqls and error is None:
+        search_index_exists, error = db_check_table_exists(conn, compiled_table.search_table_name)
+        if error is None and not search_index_exists:
+            statements = [(sql, None) for sql in compiled_table.search_sqls + (compiled_table.search_rebuild_sql,)]
+            data, error = __db_execute_statements_in_batch(conn, statements)
+    return data, error
+
+
+def db_insert_into_table(conn, table_info_dict, val_tuple):
+    compiled_table = db_compile_table(table_info_dict)
+
+    data, error = __db_execute_and_get_output(conn, compiled_table.insert_sql, val_tuple)
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_insert_many(conn, table_info_dict, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Bulk insert rows through executemany inside a single transaction. val_tuples can be any iterable, including a
+    generator, it is consumed chunk_size rows at a time and never materialized as a whole.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to insert into
+    :param val_tuples: iterable of value tuples, one tuple per row
+    :param chunk_size: number of rows handed to each executemany call
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error: error received from execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    stats, error = __db_executemany_in_transaction(conn, compiled_table.insert_sql, val_tuples, chunk_size)
+    return stats, error
+
+
+def db_upsert(conn, table_info_dict, val_tuple, update_column_names=None, conflict_column_names=None):
+    """
+    Insert a row, or update the existing row it conflicts with, in one statement (INSERT ... ON CONFLICT DO UPDATE).
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to upsert into
+    :param val_tuple: values of all columns, in column order
+    :param update_column_names: columns overwritten on a conflict, defaults to every column outside the conflict
+                                target, empty to keep the existing row (DO NOTHING)
+    :param conflict_column_names: columns of a unique key, defaults to the primary key, then the first unique constraint
+    :return: data OR error: error received from sql execute, or a missing conflict target
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql, error = __db_get_upsert_sql(compiled_table, update_column_names, conflict_column_names)
+    if error is None:
+        data, error = __db_execute_and_get_output(conn, sql, val_tuple)
+        __db_commit_write(conn, error)
+    else:
+        data = None
+    return data, error
+
+
+def db_upsert_many(conn, table_info_dict, val_tuples, update_column_names=None, conflict_column_names=None,
+                   chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Bulk version of db_upsert, through executemany inside a single transaction, see db_insert_many.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to upsert into
+    :param val_tuples: iterable of value tuples, one tuple per row
+    :param update_column_names: see db_upsert
+    :param conflict_column_names: see db_upsert
+    :param chunk_size: number of rows handed to each executemany call
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql, error = __db_get_upsert_sql(compiled_table, update_column_names, conflict_column_names)
+    if error is None:
+        stats, error = __db_executemany_in_transaction(conn, sql, val_tuples, chunk_size)
+    else:
+        stats = None
+    return stats, error
+
+
+def db_replace_into_table(conn, table_info_dict, val_tuple):
+    """
+    Insert a row, deleting every row it conflicts with on any unique key first (INSERT OR REPLACE). Unlike
+    db_upsert the replaced rows lose the values of columns val_tuple does not set, and their rowid.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to insert into
+    :param val_tuple: values of all columns, in column order
+    :return: data OR error: error received from sql execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    with __db_replace_deletes_fire_triggers(conn, compiled_table):
+        data, error = __db_execute_and_get_output(conn, compiled_table.replace_sql, val_tuple)
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_replace_many(conn, table_info_dict, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Bulk version of db_replace_into_table, through executemany inside a single transaction, see db_insert_many.
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    with __db_replace_deletes_fire_triggers(conn, compiled_table):
+        stats, error = __db_executemany_in_transaction(conn, compiled_table.replace_sql, val_tuples, chunk_size)
+    return stats, error
+
+
+def db_update_where_first_column_equals(conn, table_info_dict, val_tuple, first_column_val):
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = compiled_table.update_where_first_column_sql
+    data, error = __db_execute_and_get_output(conn, sql, tuple(val_tuple) + (first_column_val,))
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_update_many(conn, table_info_dict, update_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Batched version of db_update_where_first_column_equals, runs through executemany in a single transaction.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to update
+    :param update_tuples: iterable of (val_tuple, first_column_val) pairs, generators are streamed
+    :param chunk_size: number of rows handed to each executemany call
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error: error received from execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    param_tuples = (tuple(val_tuple) + (first_column_val,) for val_tuple, first_column_val in update_tuples)
+    stats, error = __db_executemany_in_transaction(conn, compiled_table.update_where_first_column_sql, param_tuples, chunk_size)
+    return stats, error
+
+
+def db_delete_where_first_column_equals(conn, table_info_dict, first_column_val):
+    compiled_table = db_compile_table(table_info_dict)
+
+    sql = compiled_table.delete_where_first_column_sql
+    data, error = __db_execute_and_get_output(conn, sql, (first_column_val,))
+    __db_commit_write(conn, error)
+    return data, error
+
+
+def db_delete_many_by_first_column(conn, table_info_dict, first_column_vals, chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Batched version of db_delete_where_first_column_equals, runs through executemany in a single transaction.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to delete from
+    :param first_column_vals: iterable of first column values to delete, generators are streamed
+    :param chunk_size: number of keys handed to each executemany call
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error: error received from execute
+    """
+    compiled_table = db_compile_table(table_info_dict)
+
+    param_tuples = ((first_column_val,) for first_column_val in first_column_vals)
+    stats, error = __db_executemany_in_transaction(conn, compiled_table.delete_where_first_column_sql, param_tuples, chunk_size)
+    return stats, error
+
+
+def db_delete_where_first_column_in(conn, table_info_dict, first_column_vals, chunk_size=DEF_IN_CHUNK_SIZE):
+    """
+    Delete the rows of many keys in a single transaction with first_column IN (?,...) deletes of chunk_size keys,
+    or one delete against a temp key table for more than DEF_IN_KEY_TABLE_MIN_KEYS keys.
+    :param conn: sqlite3 connection
+    :param table_info_dict: table info dict of the table to delete from
+    :param first_column_vals: iterable of first column values
+    :param chunk_size: number of keys bound to each delete
+    :return: stats: dict with ROW_COUNT_KEY (rows deleted), ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error
+    """
+    compiled_table = db_compile_table(table_info_dict)
+    keys = list(dict.fromkeys(first_column_vals))
+
+    stats = None
+    error = None
+    row_count = 0
+    start_time = time.perf_counter()
+    try:
+        # A FAILED CHUNK ROLLS BACK EVERY CHUNK BEFORE IT
+        with db_batch(conn) as batch:
+            if len(keys) > DEF_IN_KEY_TABLE_MIN_KEYS:
+                key_table_name = __db_fill_key_table(conn, compiled_table, keys)
+                row_count = conn.execute(""" DELETE FROM {} WHERE {} IN (SELECT in_key FROM {}) """.format(
+                    compiled_table.table_name, compiled_table.first_column_name, key_table_name)).rowcount
+            else:
+                for chunk_start in range(0, len(keys), chunk_size):
+                    chunk = keys[chunk_start:chunk_start + chunk_size]
+                    sql = """ DELETE FROM {} WHERE {} IN ({}) """.format(
+                        compiled_table.table_name, compiled_table.first_column_name, ",".join("?" * len(chunk)))
+                    row_count += conn.execute(sql, chunk).rowcount
+            batch.record_write(row_count)
+    except sqlite3.Error as e:
+        error = "{} while deleting keys from '{}' ({})".format(type(e).__name__, compiled_table.table_name, e)
+    else:
+        stats = __db_get_write_stats(row_count, start_time)
+    return stats, error
+
+
+def db_delete_all_from_table(conn, table_info_dict):
+    compiled_table = db_compile_table(table_info_dict)
+
+    data, error = __db_execute_and_get_output(conn, compiled_table.delete_all_sql)
+    __db_commit_write(conn, error)
+    return data, error
+
+
+###########################################################
+# HELPER FUNCTIONS
+###########################################################
+
+
+def __db_get_row_factory(compiled_table, row_format):
+    """
+    Get the cursor row_factory producing rows in row_format directly from sqlite3, None for plain tuples.
+    :param compiled_table: compiled table the rows belong to
+    :param row_format: one of RowFormats
+    :return: row_factory
+    """
+    if row_format == RowFormats.ROW:
+        return sqlite3.Row
+    if row_format == RowFormats.RECORD:
+        record_class = compiled_table.record_class
+        return lambda cursor, row: record_class(*row)
+    return None
+
+
+def __db_select_formatted_rows(conn, compiled_table, sql, tuple_values=None, row_format=None):
+    """
+    Executes a select statement and returns all of its rows in row_format.
+    :param conn: sqlite3 connection
+    :param compiled_table: compiled table the rows belong to
+    :param sql: select statement to execute
+    :param tuple_values: tuple of values to bind to the statement
+    :param row_format: one of RowFormats, defaults to RowFormats.DICT
+    :return: rows: rows in the requested row format OR error: error received from sql execute
+    """
+    if row_format is None:
+        row_format = RowFormats.DICT
+    if row_format in (RowFormats.DICT, RowFormats.COLUMNS):
+        rows = {}
+    else:
+        rows = []
+
+    if row_format not in ROW_FORMATS:
+        return rows, "Unknown row format: '{}'".format(row_format)
+
+    statement_stats = __statement_stats
+    start_time = time.perf_counter() if statement_stats is not None else 0
+    cursor, error = __db_execute_and_get_cursor(conn, sql, tuple_values, __db_get_row_factory(compiled_table, row_format))
+    if error is None:
+        column_count = compiled_table.column_count
+        try:
+            if row_format == RowFormats.DICT:
+                row_index = 0
+                # ITERATE THROUGH ROWS IN DATA
+                for row in cursor.fetchall():
+                    # COPY OVER COLUMNS FROM TABLE_COLUMNS INTO ROW_DATA_DICT'S ROW DICT
+                    rows[row_index] = dict(zip(range(column_count), row))
+                    row_index += 1
+            elif row_format == RowFormats.COLUMNS:
+                rows = {col_index: [] for col_index in range(column_count)}
+                # TRANSPOSE ONE FETCHMANY BATCH AT A TIME SO THE ROW TUPLES NEVER ALL LIVE AT ONCE
+                batch = cursor.fetchmany(DEF_FETCH_BATCH_SIZE)
+                while batch:
+                    for col_index, col_values in enumerate(zip(*batch)):
+                        rows[col_index].extend(col_values)
+                    batch = cursor.fetchmany(DEF_FETCH_BATCH_SIZE)
+            else:
+                rows = cursor.fetchall()
+        except sqlite3.OperationalError:
+            error = "OperationalError in statement: '''{}'''".format(sql)
+        finally:
+            cursor.close()
+
+    if statement_stats is not None:
+        row_count = len(next(iter(rows.values()), ())) if row_format == RowFormats.COLUMNS else len(rows)
+        statement_stats.record(conn, sql, tuple_values, time.perf_counter() - start_time, row_count, error)
+    return rows, error
+
+
+def __db_iter_formatted_rows(conn, compiled_table, sql, tuple_values=None, batch_size=DEF_FETCH_BATCH_SIZE,
+                             row_format=RowFormats.TUPLE):
+    """
+    Executes a select statement and returns a generator streaming its rows in row_format.
+    :param conn: sqlite3 connection
+    :param compiled_table: compiled table the rows belong to
+    :param sql: select statement to execute
+    :param tuple_values: tuple of values to bind to the statement
+    :param batch_size: number of rows per fetchmany call
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT
+    :return: row_iter: generator of rows OR error: error received from sql execute
+    """
+    if row_format not in (RowFormats.TUPLE, RowFormats.ROW, RowFormats.RECORD, RowFormats.DICT):
+        return iter(()), "Row format '{}' can not be streamed".format(row_format)
+
+    if row_format == RowFormats.DICT:
+        col_indexes = range(compiled_table.column_count)
+        row_factory = lambda cursor, row: dict(zip(col_indexes, row))
+    else:
+        row_factory = __db_get_row_factory(compiled_table, row_format)
+
+    statement_stats = __statement_stats
+    start_time = time.perf_counter() if statement_stats is not None else 0
+    cursor, error = __db_execute_and_get_cursor(conn, sql, tuple_values, row_factory)
+    row_iter = __db_iter_cursor_rows(cursor, batch_size, sql) if error is None else iter(())
+    if statement_stats is not None:
+        statement_stats.record(conn, sql, tuple_values, time.perf_counter() - start_time, None, error)
+    return row_iter, error
+
+
+def __db_execute_and_get_output(conn, sql, tuple_values=None):
+    """
+    Most important function for db interfacing. Executes sql statement with option of tuple_values and returns
+    data or error message.
+    :param conn: sqlite3 connection
+    :param sql: sql statement to execute
+    :param tuple_values: tuple of values to execute in an insert statement etc..
+    :return: data: rows returned from sql statement OR error: error received from sql execute
+    """
+    data = None
+
+    # INSTRUMENTATION OFF COSTS ONE GLOBAL LOOKUP, NO TIMING
+    statement_stats = __statement_stats
+    start_time = time.perf_counter() if statement_stats is not None else 0
+    cursor, error = __db_execute_and_get_cursor(conn, sql, tuple_values)
+    if error is None:
+        try:
+            data = cursor.fetchall()
+        except sqlite3.OperationalError:
+            error = "OperationalError in statement: '''{}'''".format(sql)
+
+    if statement_stats is not None:
+        statement_stats.record(conn, sql, tuple_values, time.perf_counter() - start_time, len(data) if data else 0, error)
+    return data, error
+
+
+def __db_execute_and_get_cursor(conn, sql, tuple_values=None, row_factory=None):
+    """
+    Executes sql statement with option of tuple_values and returns the cursor without fetching anything, so the
+    caller decides how rows are pulled (fetchall, fetchmany, ...).
+    :param conn: sqlite3 connection
+    :param sql: sql statement to execute
+    :param tuple_values: tuple of values to bind to the statement
+    :param row_factory: optional row_factory set on the cursor before executing
+    :return: cursor: executed cursor OR error: error received from sql execute
+    """
+    error = None
+
+    cursor = conn.cursor()
+    # CONNECTION EXISTS
+    if cursor is not None:
+        if row_factory is not None:
+            cursor.row_factory = row_factory
+        logging.debug("sending sql: {}".format(sql))
+        try:
+            # SENDING SIMPLE SQL STATEMENT
+            if tuple_values is None:
+                cursor.execute(sql)
+            # SENDING A TUPLE FOR SELECT STATEMENT
+            else:
+                cursor.execute(sql, tuple_values)
+        except (sqlite3.OperationalError, sqlite3.IntegrityError) as e:
+            error = "{} in statement: '''{}'''".format(type(e).__name__, sql)
+    # CONNECTION FAILED
+    else:
+        error = "Could not connect to database."
+
+    return cursor, error
+
+
+def __db_iter_cursor_rows(cursor, batch_size, sql):
+    """
+    Generator pulling rows from an executed cursor batch_size at a time. Closes the cursor once it is exhausted.
+    Errors while fetching are logged and re-raised, so a failed read never looks like a shorter result.
+    :param cursor: executed cursor
+    :param batch_size: number of rows per fetchmany call
+    :param sql: sql statement the cursor executed, only used for logging errors
+    :return: row tuples
+    """
+    try:
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            yield from rows
+            rows = cursor.fetchmany(batch_size)
+    except sqlite3.Error as e:
+        logging.error("{} while fetching rows of statement: '''{}'''".format(type(e).__name__, sql))
+        raise
+    finally:
+        cursor.close()
+
+
+def __db_get_sql_literal(val):
+    """
+    Format a python value as a sql literal, for the few statements (e.g. DEFAULT clauses) that can not bind parameters.
+    :param val: None, int, float, str or bytes
+    :return: literal_str
+    """
+    if val is None:
+        return "NULL"
+    if isinstance(val, (int, float)):
+        return repr(val)
+    if isinstance(val, bytes):
+        return "X'{}'".format(val.hex())
+    return "'{}'".format(str(val).replace("'", "''"))
+
+
+def __db_execute_statements_in_batch(conn, statements):
+    """
+    Executes (sql, tuple_values) statements in one db_batch, rolling all of them back if one fails.
+    :param conn: sqlite3 connection
+    :param statements: iterable of (sql, tuple_values) pairs, tuple_values can be None
+    :return: data: output of the last statement OR error: error of the failed statement
+    """
+    data = None
+    error = None
+    try:
+        with db_batch(conn) as batch:
+            for sql, tuple_values in statements:
+                data, error = __db_execute_and_get_output(conn, sql, tuple_values)
+                if error is not None:
+                    # RAISE SO DB_BATCH ROLLS BACK EVERYTHING EXECUTED SO FAR
+                    raise sqlite3.DatabaseError(error)
+                batch.record_write()
+    except sqlite3.DatabaseError as e:
+        error = error if error is not None else "{}: {}".format(type(e).__name__, e)
+    return data, error
+
+
+def __db_commit_write(conn, error, write_count=1):
+    """
+    Commits a finished write statement. Inside a db_batch the batch decides when to commit instead, so many writes
+    share one commit. A failed write outside a db_batch rolls back the implicit transaction it opened, so the
+    connection does not keep holding the write lock.
+    :param conn: sqlite3 connection
+    :param error: error of the write, nothing is committed or recorded if it failed
+    :param write_count: number of writes the statement made
+    :return: None
+    """
+    batch = __active_batch_dict.get(id(conn))
+    if error is not None:
+        if batch is None and conn.in_transaction:
+            conn.rollback()
+        return
+    if batch is not None:
+        batch.record_write(write_count)
+    elif conn.in_transaction:
+        conn.commit()
+
+
+def __db_executemany_in_transaction(conn, sql, param_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+    """
+    Streams param_tuples through executemany in chunks of chunk_size inside one transaction. Commits once at the end,
+    rolls everything back if any chunk fails.
+    :param conn: sqlite3 connection
+    :param sql: sql statement to execute for every tuple
+    :param param_tuples: iterable of parameter tuples
+    :param chunk_size: number of tuples handed to each executemany call
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY OR error: error received from execute
+    """
+    stats = None
+    error = None
+
+    cursor = conn.cursor()
+    # CONNECTION EXISTS
+    if cursor is not None:
+        logging.debug("sending sql (bulk): {}".format(sql))
+        row_count = 0
+        start_time = time.perf_counter()
+        try:
+            # OWN TRANSACTION, OR A SAVEPOINT INSIDE THE CALLER'S db_batch, SO A FAILED CHUNK UNDOES THE WHOLE CALL
+            with db_batch(conn) as batch:
+                param_iter = iter(param_tuples)
+                # HAND ROWS TO EXECUTEMANY ONE CHUNK AT A TIME SO GENERATORS ARE NEVER MATERIALIZED
+                chunk = list(itertools.islice(param_iter, chunk_size))
+                while chunk:
+                    cursor.executemany(sql, chunk)
+                    row_count += len(chunk)
+                    chunk = list(itertools.islice(param_iter, chunk_size))
+                batch.record_write(row_count)
+        except sqlite3.Error as e:
+            error = "{} in statement: '''{}''' ({})".format(type(e).__name__, sql, e)
+        else:
+            stats = __db_get_write_stats(row_count, start_time)
+        statement_stats = __statement_stats
+        if statement_stats is not None:
+            statement_stats.record(conn, sql, None, time.perf_counter() - start_time, row_count, error)
+    # CONNECTION FAILED
+    else:
+        error = "Could not connect to database."
+
+    return stats, error
+
+
+def __db_get_write_stats(row_count, start_time):
+    """
+    Stats dict of a finished bulk write.
+    :param row_count: number of rows written
+    :param start_time: time.perf_counter() value the write started at
+    :return: stats: dict with ROW_COUNT_KEY, ELAPSED_SEC_KEY and ROWS_PER_SEC_KEY
+    """
+    elapsed_sec = time.perf_counter() - start_time
+    rows_per_sec = row_count / elapsed_sec if elapsed_sec > 0 else float(row_count)
+    logging.debug("bulk wrote {} rows in {:.3f}s ({:.0f} rows/s)".format(row_count, elapsed_sec, rows_per_sec))
+    return {
+        ROW_COUNT_KEY: row_count,
+        ELAPSED_SEC_KEY: elapsed_sec,
+        ROWS_PER_SEC_KEY: rows_per_sec,
+    }
+
+
+def __db_fill_key_table(conn, compiled_table, keys):
+    """
+    Load keys into the connection's temp key table of a table, replacing what an earlier call left there. Raises
+    sqlite3.Error, call it inside a db_batch.
+    :param conn: sqlite3 connection
+    :param compiled_table: compiled table the keys belong to
+    :param keys: iterable of first column values, duplicates are dropped
+    :return: key_table_name: name to select the keys from, column in_key
+    """
+    key_table_name = "temp.{}__in_keys".format(compiled_table.table_name)
+    conn.execute(""" CREATE TEMP TABLE IF NOT EXISTS {} (in_key PRIMARY KEY) """.format(key_table_name))
+    conn.execute(""" DELETE FROM {} """.format(key_table_name))
+    conn.executemany(""" INSERT OR IGNORE INTO {} (in_key) VALUES (?) """.format(key_table_name), ((key,) for key in keys))
+    return key_table_name
+
+
+def __db_iter_chunked_in_rows(conn, compiled_table, keys, chunk_size, batch_size, row_format):
+    """
+    Generator running one first column IN (...) select per chunk of keys, each only once the previous one is
+    exhausted, and yielding their rows in row_format. Raises sqlite3.DatabaseError if a chunk fails.
+    :param conn: sqlite3 connection
+    :param compiled_table: compiled table to select from
+    :param keys: list of first column values
+    :param chunk_size: number of keys bound to each select
+    :param batch_size: number of rows per fetchmany call
+    :param row_format: RowFormats.TUPLE, ROW, RECORD or DICT
+    :return: rows
+    """
+    for chunk_start in range(0, len(keys), chunk_size):
+        query = DBQuery(compiled_table).where_in(compiled_table.first_column_name, keys[chunk_start:chunk_start + chunk_size])
+        row_iter, error = db_iter_query(conn, query, batch_size, row_format)
+        if error is not None:
+            logging.error(error)
+            raise sqlite3.DatabaseError(error)
+        yield from row_iter
+
+
+@contextmanager
+def __db_replace_deletes_fire_triggers(conn, compiled_table):
+    """
+    Turn PRAGMA recursive_triggers on for the block if the table has a search index or a changelog, so the rows
+    INSERT OR REPLACE deletes fire their AFTER DELETE triggers, leaving the external content index and reaching the
+    change feed. Restores the previous setting.
+    :param conn: sqlite3 connection
+    :param compiled_table: compiled table being replaced into
+    """
+    if not compiled_table.search_sqls:
+        change_feed_exists, error = db_check_table_exists(conn, __db_get_change_table_name(compiled_table))
+        if not change_feed_exists:
+            yield
+            return
+    recursive_triggers = conn.execute('PRAGMA recursive_triggers').fetchone()[0]
+    if not recursive_triggers:
+        conn.execute('PRAGMA recursive_triggers = ON')
+    try:
+        yield
+    finally:
+        if not recursive_triggers:
+            conn.execute('PRAGMA recursive_triggers = OFF')
+
+
+def __db_get_change_table_name(compiled_table):
+    return "{}__changes".format(compiled_table.table_name)
+
+
+def __db_get_change_trigger_sqls(compiled_table):
+    """
+    Get the statements creating the change feed triggers of a table. An update changing the first column logs a
+    delete of the old key before the update of the new one.
+    :param compiled_table: compiled table to record
+    :return: sqls: list of CREATE TRIGGER IF NOT EXISTS statements
+    """
+    table_name = compiled_table.table_name
+    change_table_name = __db_get_change_table_name(compiled_table)
+    key_name = compiled_table.first_column_name
+    insert_sql = """ INSERT INTO {} (op, row_key) """.format(change_table_name)
+    return [
+        """ CREATE TRIGGER IF NOT EXISTS {0}__changes_{1} AFTER INSERT ON {0} BEGIN {2} VALUES ('{1}', NEW.{3}); END """
+        .format(table_name, ChangeOps.INSERT, insert_sql, key_name),
+        """ CREATE TRIGGER IF NOT EXISTS {0}__changes_{1} AFTER UPDATE ON {0} BEGIN
+                {2} SELECT '{4}', OLD.{3} WHERE OLD.{3} IS NOT NEW.{3};
+                {2} VALUES ('{1}', NEW.{3});
+            END """.format(table_name, ChangeOps.UPDATE, insert_sql, key_name, ChangeOps.DELETE),
+        """ CREATE TRIGGER IF NOT EXISTS {0}__changes_{1} AFTER DELETE ON {0} BEGIN {2} VALUES ('{1}', OLD.{3}); END """
+        .format(table_name, ChangeOps.DELETE, insert_sql, key_name),
+    ]
+
+
+__upsert_sql_cache = {}
+
+
+def __db_get_upsert_sql(compiled_table, update_column_names=None, conflict_column_names=None):
+    """
+    Get the upsert statement of a table for one choice of update and conflict columns, built once per choice.
+    :param compiled_table: compiled table to upsert into
+    :param update_column_names: see db_upsert
+    :param conflict_column_names: see db_upsert
+    :return: sql OR error: error describing a missing conflict target or an unknown column
+    """
+    cache_key = (compiled_table,
+                 None if update_column_names is None else tuple(update_column_names),
+                 None if conflict_column_names is None else tuple(conflict_column_names))
+    sql = __upsert_sql_cache.get(cache_key)
+    if sql is not None:
+        return sql, None
+
+    conflict_column_names = compiled_table.get_conflict_column_names(conflict_column_names)
+    if not conflict_column_names:
+        return None, "Table '{}' declares no primary key or unique constraint to upsert on".format(compiled_table.table_name)
+    if update_column_names is None:
+        update_column_names = [col_name for col_name in compiled_table.column_names if col_name not in conflict_column_names]
+    for col_name in itertools.chain(conflict_column_names, update_column_names):
+        if col_name not in compiled_table.column_index_map:
+            return None, "Unknown column '{}' in upsert on table '{}'".format(col_name, compiled_table.table_name)
+
+    if update_column_names:
+        # excluded.<col> IS THE VALUE THE CONFLICTING INSERT TRIED TO WRITE
+        set_columns_str = ",".join("{} = excluded.{}".format(col_name, col_name) for col_name in update_column_names)
+        conflict_action_str = "DO UPDATE SET {}".format(set_columns_str)
+    else:
+        conflict_action_str = "DO NOTHING"
+    sql = """ {} ON CONFLICT ({}) {} """.format(compiled_table.insert_sql.strip(), ",".join(conflict_column_names), conflict_action_str)
+    __upsert_sql_cache[cache_key] = sql
+    return sql, None
+
+
+def __get_table_cache_key(table_info_dict):
+    """
+    Get a hashable key describing the whole table info dict, used to look up compiled tables.
+    :param table_info_dict:
+    :return: tuple of (key, frozen value) pairs
+    """
+    def freeze(value):
+        if isinstance(value, dict):
+            return tuple((k, freeze(v)) for k, v in sorted(value.items(), key=lambda item: str(item[0])))
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(v) for v in value)
+        return value
+
+    return freeze(table_info_dict)
+
+
+__compiled_table_cache = {}
+
+
+def db_compile_table(table_info):
+    """
+    Get the DBCompiledTable for a table, compiling it once and caching it for every later call. Accepts a
+    table_info_dict, an AbstractDBTable subclass or an already compiled table.
+    :param table_info: table_info_dict, AbstractDBTable subclass or DBCompiledTable
+    :return: compiled_table
+    """
+    if isinstance(table_info, DBCompiledTable):
+        return table_info
+    if isinstance(table_info, type) and issubclass(table_info, AbstractDBTable):
+        table_info = table_info.table_info_dict()
+
+    cache_key = __get_table_cache_key(table_info)
+    compiled_table = __compiled_table_cache.get(cache_key)
+    if compiled_table is None:
+        compiled_table = DBCompiledTable(table_info)
+        __compiled_table_cache[cache_key] = compiled_table
+    return compiled_table
+
+
+class DBRecord:
+    """
+    Base class of the generated per table record classes. Subclasses only add __slots__, one per column, so a record
+    costs about as much memory as a tuple while still allowing record.column_name access.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for col_name, value in zip(self.__slots__, values):
+            setattr(self, col_name, value)
+
+    def __iter__(self):
+        return (getattr(self, col_name) for col_name in self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        values = ", ".join("{}={!r}".format(col_name, getattr(self, col_name)) for col_name in self.__slots__)
+        return "{}({})".format(type(self).__name__, values)
+
+
+def db_make_record_class(class_name, column_names):
+    """
+    Generate a DBRecord subclass with one slot per column name.
+    :param class_name: name of the generated class
+    :param column_names: column names in column index order
+    :return: record_class
+    """
+    return type(class_name, (DBRecord,), {'__slots__': tuple(column_names)})
+
+
+class DBCompiledTable:
+    """
+    All statement texts, column maps and placeholder strings of one table, built once from its table_info_dict.
+    Statements are kept byte-identical between calls so sqlite3's own statement cache hits as well.
+    Use db_compile_table() to get a cached instance instead of constructing this directly.
+    """
+    def __init__(self, table_info_dict):
+        self.table_info_dict = table_info_dict
+        self.table_name = table_info_dict[TABLE_NAME_KEY]
+        self.column_map = table_info_dict[COLUMN_MAP_KEY]
+        self.column_count = len(self.column_map)
+
+        # DECLARED KEYS AND INDEXES, EACH AS A TUPLE OF COLUMN NAMES
+        self.primary_key = self.__as_column_tuple(table_info_dict.get(PRIMARY_KEY_KEY))
+        self.unique_constraints = tuple(self.__as_column_tuple(columns) for columns in table_info_dict.get(UNIQUE_CONSTRAINTS_KEY, ()))
+        self.indexes = tuple(self.__as_column_tuple(columns) for columns in table_info_dict.get(INDEXES_KEY, ()))
+        self.searchable_columns = self.__as_column_tuple(table_info_dict.get(SEARCHABLE_COLUMNS_KEY))
+
+        # COLUMN INFO, IN COLUMN INDEX ORDER
+        self.column_names = tuple(self.column_map[col_index][COLUMN_NAME_INDEX] for col_index in range(self.column_count))
+        self.column_types = tuple(self.column_map[col_index][COLUMN_TYPE_INDEX] for col_index in range(self.column_count))
+        self.column_index_map = {col_name: col_index for col_index, col_name in enumerate(self.column_names)}
+        self.first_column_name = self.column_names[0] if self.column_count > 0 else None
+
+        # STATEMENT PARTS
+        self.column_names_str = ",".join(self.column_names)
+        self.columns_and_types_str = ",".join(
+            "{} {}".format(col_name, col_type) for col_name, col_type in zip(self.column_names, self.column_types)
+        )
+        self.placeholders_str = ",".join("?" * self.column_count)
+
+        # RECORD CLASS FOR RowFormats.RECORD, e.g. TEST_TABLE -> TestTableRecord
+        record_class_name = "{}Record".format("".join(part.capitalize() for part in self.table_name.split("_")))
+        self.record_class = db_make_record_class(record_class_name, self.column_names)
+
+        # TABLE CONSTRAINTS FOR THE CREATE STATEMENT
+        table_definitions = [self.columns_and_types_str]
+        if self.primary_key:
+            table_definitions.append("PRIMARY KEY ({})".format(",".join(self.primary_key)))
+        for unique_columns in self.unique_constraints:
+            table_definitions.append("UNIQUE ({})".format(",".join(unique_columns)))
+
+        # FULL STATEMENTS
+        self.table_definitions_str = ",".join(table_definitions)
+        self.create_sql = self.get_create_sql(self.table_name)
+        self.insert_sql = """ INSERT INTO {} ({}) VALUES({}) """.format(self.table_name, self.column_names_str, self.placeholders_str)
+        self.replace_sql = """ INSERT OR REPLACE INTO {} ({}) VALUES({}) """.format(self.table_name, self.column_names_str, self.placeholders_str)
+        self.select_all_sql = """ SELECT * FROM {} """.format(self.table_name)
+        self.delete_all_sql = """ DELETE FROM {} """.format(self.table_name)
+
+        # FIRST COLUMN STATEMENTS, VALUES ARE BOUND AS PARAMETERS SO THE TEXT NEVER CHANGES BETWEEN KEYS
+        first_column_where_str = "WHERE {} = ?".format(self.first_column_name)
+        set_columns_str = ",".join("{} = ?".format(col_name) for col_name in self.column_names)
+        self.select_where_first_column_sql = """ SELECT * FROM {} {} """.format(self.table_name, first_column_where_str)
+        self.update_where_first_column_sql = """ UPDATE {} SET {} {} """.format(self.table_name, set_columns_str, first_column_where_str)
+        self.delete_where_first_column_sql = """ DELETE FROM {} {} """.format(self.table_name, first_column_where_str)
+
+        # SECONDARY INDEXES
+        self.index_sqls = tuple(
+            """ CREATE INDEX IF NOT EXISTS idx_{}_{} ON {} ({}) """.format(self.table_name, "_".join(columns), self.table_name, ",".join(columns))
+            for columns in self.indexes
+        )
+        # UNIQUE INDEXES STANDING IN FOR THE KEYS OF A TABLE CREATED BEFORE THEY WERE DECLARED
+        key_index_sqls = []
+        if self.primary_key:
+            key_index_sqls.append((self.primary_key, """ CREATE UNIQUE INDEX IF NOT EXISTS pk_{} ON {} ({}) """.format(
+                self.table_name, self.table_name, ",".join(self.primary_key))))
+        for unique_columns in self.unique_constraints:
+            key_index_sqls.append((unique_columns, """ CREATE UNIQUE INDEX IF NOT EXISTS uq_{}_{} ON {} ({}) """.format(
+                self.table_name, "_".join(unique_columns), self.table_name, ",".join(unique_columns))))
+        self.key_index_sqls = tuple(key_index_sqls)
+
+        # EXTERNAL CONTENT FTS5 INDEX OF THE SEARCHABLE COLUMNS, ROWS STAY IN THIS TABLE AND ARE JOINED BY ROWID
+        self.search_table_name = "{}__search".format(self.table_name)
+        self.search_sqls = ()
+        self.search_drop_sqls = ()
+        if self.searchable_columns:
+            search_columns_str = ",".join(self.searchable_columns)
+            new_columns_str = ",".join("new.{}".format(col_name) for col_name in self.searchable_columns)
+            old_columns_str = ",".join("old.{}".format(col_name) for col_name in self.searchable_columns)
+            search_insert_str = "INSERT INTO {0} (rowid,{1}) VALUES (new.rowid,{2});".format(
+                self.search_table_name, search_columns_str, new_columns_str)
+            search_delete_str = "INSERT INTO {0} ({0},rowid,{1}) VALUES ('delete',old.rowid,{2});".format(
+                self.search_table_name, search_columns_str, old_columns_str)
+            self.search_sqls = (
+                """ CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5({}, content='{}', content_rowid='rowid') """.format(
+                    self.search_table_name, search_columns_str, self.table_name),
+                """ CREATE TRIGGER IF NOT EXISTS {0}_insert AFTER INSERT ON {1} BEGIN {2} END """.format(
+                    self.search_table_name, self.table_name, search_insert_str),
+                """ CREATE TRIGGER IF NOT EXISTS {0}_delete AFTER DELETE ON {1} BEGIN {2} END """.format(
+                    self.search_table_name, self.table_name, search_delete_str),
+                """ CREATE TRIGGER IF NOT EXISTS {0}_update AFTER UPDATE ON {1} BEGIN {2} {3} END """.format(
+                    self.search_table_name, self.table_name, search_delete_str, search_insert_str),
+            )
+            self.search_drop_sqls = tuple(
+                """ DROP TRIGGER IF EXISTS {}_{} """.format(self.search_table_name, op) for op in ('insert', 'delete', 'update')
+            ) + (""" DROP TABLE IF EXISTS {} """.format(self.search_table_name),)
+        self.search_rebuild_sql = """ INSERT INTO {0} ({0}) VALUES ('rebuild') """.format(self.search_table_name)
+        self.search_optimize_sql = """ INSERT INTO {0} ({0}) VALUES ('optimize') """.format(self.search_table_name)
+        self.search_sql = """ SELECT {0}.* FROM {1} JOIN {0} ON {0}.rowid = {1}.rowid WHERE {1} MATCH ? ORDER BY {1}.rank LIMIT ? """.format(
+            self.table_name, self.search_table_name)
+
+    def get_conflict_column_names(self, conflict_column_names=None):
+        """
+        Conflict target of an upsert, conflict_column_names if given, else the primary key, else the first unique
+        constraint, empty if the table declares neither
+        """
+        if conflict_column_names is not None:
+            return tuple(conflict_column_names)
+        if self.primary_key:
+            return self.primary_key
+        if self.unique_constraints:
+            return self.unique_constraints[0]
+        return ()
+
+    def get_create_sql(self, table_name):
+        """
+        Create statement of this table's columns and constraints under another name, e.g. for a migration table
+        """
+        return """ CREATE TABLE IF NOT EXISTS {} ({}); """.format(table_name, self.table_definitions_str)
+
+    @staticmethod
+    def __as_column_tuple(columns):
+        if not columns:
+            return ()
+        if isinstance(columns, str):
+            return (columns,)
+        return tuple(columns)
+
+
+class DBCompiledQuery:
+    """
+    Statement text and result column info of one query shape, built by db_compile_query.
+    """
+    def __init__(self, sql, column_names, record_class):
+        self.sql = sql
+        self.column_names = tuple(column_names)
+        self.column_count = len(self.column_names)
+        self.record_class = record_class
+
+
+class DBQuery:
+    """
+    Composable select on one table. Every method returns a new query so a base query can be shared and refined:
+        base_query = DBQuery(TestTableInfo).select('first_column', 'second_column')
+        query = base_query.where('second_column', QueryOperators.GE, 10).where_in('third_column', ['a', 'b'])
+        query = query.order_by('second_column', descending=True).limit(20)
+        rows, error = db_select_query(conn, query)
+    Keyset pagination continues after the last row of the previous page, in the order_by columns (defaulting to
+    the primary key, or the first column), which have to identify a row:
+        page_query = DBQuery(TestTableInfo).order_by('first_column').limit(100)
+        rows, error = db_select_query(conn, page_query, RowFormats.TUPLE)
+        rows, error = db_select_query(conn, page_query.after(rows[-1][0]), RowFormats.TUPLE)
+    All values are bound as parameters, see db_compile_query for how the statement text is cached.
+    """
+    def __init__(self, table_info):
+        self.compiled_table = db_compile_table(table_info)
+        self.column_names = ()
+        self.predicates = ()
+        self.order_columns = ()
+        self.limit_count = None
+        self.offset_count = None
+        self.after_values = None
+        self.group_columns = ()
+        self.aggregates = ()
+
+    def select(self, *column_names):
+        """
+        Only return these columns, in this order
+        """
+        return self.__copy(column_names=tuple(column_names))
 
-    # SET UP SQL STATEMENT WITH FORMAT """ INSERT INTO {TABLE_NAME}({COLUMN_NAMES}) VALUES({QUESTIONS_MARK_COUNT}) """
-    action = 'INSERT INTO'
-    column_names = __get_column_names(columns)
-    question_mark_count = __get_question_mark_count(columns)
-    sql = """ {} {} ({}) VALUES({}) """.format(action, table_name, column_names, question_mark_count)
+    def where(self, column_name, operator, value):
+        """
+        Add a predicate, all predicates have to hold. IN and NOT IN take an iterable of values.
+        :param column_name: column to compare
+        :param operator: one of QueryOperators
+        :param value: value to compare to, an iterable of values for IN and NOT IN
+        """
+        values = tuple(value) if operator in QUERY_LIST_OPERATORS else (value,)
+        return self.__copy(predicates=self.predicates + ((column_name, operator, values),))
 
-    data, error = __db_execute_and_get_output(conn, sql, val_tuple)
-    if error is not None:
-        conn.commit()
-    return data, error
+    def where_in(self, column_name, values):
+        return self.where(column_name, QueryOperators.IN, values)
 
+    def order_by(self, column_name, descending=False):
+        """
+        Add an order column, later calls break ties of earlier ones
+        """
+        return self.__copy(order_columns=self.order_columns + ((column_name, descending),))
 
-def db_update_where_first_column_equals(conn, table_info_dict, val_tuple, first_column_val):
-    table_name = table_info_dict[TABLE_NAME_KEY]
-    col_dict = table_info_dict[COLUMN_MAP_KEY]
+    def limit(self, limit_count, offset_count=None):
+        return self.__copy(limit_count=limit_count, offset_count=offset_count)
 
-    # SET UP SQL STATEMENT WITH FORMAT """ INSERT INTO {TABLE_NAME}({COLUMN_NAMES}) VALUES({QUESTIONS_MARK_COUNT}) """
-    action = 'UPDATE'
-    set_columns = __db_get_set_columns_and_values(col_dict, val_tuple)
-    where_condition = __db_get_first_column_where_condition(col_dict, first_column_val)
-    sql = """ {} {} SET {} {} """.format(action, table_name, set_columns, where_condition)
+    def offset(self, offset_count):
+        return self.__copy(offset_count=offset_count)
 
-    data, error = __db_execute_and_get_output(conn, sql)
-    if error is not None:
-        conn.commit()
-    return data, error
+    def without_paging(self):
+        """
+        Same rows without limit, offset and, unless a keyset after needs it, order. An aggregate over the query then
+        covers every matching row instead of a page of them.
+        """
+        order_columns = self.order_columns if self.after_values is not None else ()
+        return self.__copy(limit_count=None, offset_count=None, order_columns=order_columns)
 
+    def after(self, *after_values):
+        """
+        Only return rows after this key, one value per order column
+        """
+        return self.__copy(after_values=tuple(after_values))
 
-def db_delete_where_first_column_equals(conn, table_info_dict, first_column_val):
-    table_name = table_info_dict[TABLE_NAME_KEY]
-    col_dict = table_info_dict[COLUMN_MAP_KEY]
+    def group_by(self, *column_names):
+        """
+        Group rows by these columns, the result has one row per group with the group columns followed by the
+        aggregates
+        """
+        return self.__copy(group_columns=tuple(column_names))
 
-    # SET UP SQL STATEMENT WITH FORMAT """ INSERT INTO {TABLE_NAME}({COLUMN_NAMES}) VALUES({QUESTIONS_MARK_COUNT}) """
-    action = 'DELETE FROM'
-    where_condition = __db_get_first_column_where_condition(col_dict, first_column_val)
-    sql = """ {} {} {} """.format(action, table_name, where_condition)
+    def aggregate(self, function, column_name=None):
+        """
+        Return an aggregate instead of the rows, over each group when grouped. Replaces the select columns.
+        :param function: one of AggregateFunctions
+        :param column_name: column to aggregate, None for COUNT(*)
+        """
+        return self.__copy(aggregates=self.aggregates + ((function, column_name),))
 
-    data, error = __db_execute_and_get_output(conn, sql)
-    if error is not None:
-        conn.commit()
-    return data, error
+    def get_order_columns(self):
+        """
+        The (col_name, descending) pairs the query orders by. A keyset query without order_by orders by the primary
+        key, or the first column, so its pages are well defined. Order its first page (without after) the same way.
+        """
+        if self.order_columns or self.after_values is None:
+            return self.order_columns
+        key_column_names = self.compiled_table.primary_key or (self.compiled_table.first_column_name,)
+        return tuple((col_name, False) for col_name in key_column_names)
 
+    def get_shape(self):
+        """
+        Hashable description of everything the statement text depends on, but none of the values
+        """
+        predicate_shape = tuple(
+            (col_name, operator, len(values) if operator in QUERY_LIST_OPERATORS else None)
+            for col_name, operator, values in self.predicates
+        )
+        has_limit = self.limit_count is not None or self.offset_count is not None
+        return (self.compiled_table, self.column_names, predicate_shape, self.get_order_columns(),
+                None if self.after_values is None else len(self.after_values), has_limit, self.offset_count is not None,
+                self.group_columns, self.aggregates)
+
+    def get_values(self):
+        """
+        The values bound to the compiled statement, in placeholder order
+        """
+        values = [value for col_name, operator, predicate_values in self.predicates for value in predicate_values]
+        if self.after_values is not None:
+            order_columns = self.get_order_columns()
+            if len(set(descending for col_name, descending in order_columns)) > 1:
+                # EXPANDED KEYSET CONDITION, EACH OR TERM BINDS THE KEY UP TO AND INCLUDING ITS OWN COLUMN
+                for order_index in range(len(self.after_values)):
+                    values.extend(self.after_values[:order_index + 1])
+            else:
+                values.extend(self.after_values)
+        if self.limit_count is not None or self.offset_count is not None:
+            values.append(-1 if self.limit_count is None else self.limit_count)
+            if self.offset_count is not None:
+                values.append(self.offset_count)
+        return tuple(values)
 
-def db_delete_all_from_table(conn, table_info_dict):
-    table_name = table_info_dict[TABLE_NAME_KEY]
+    def __copy(self, **changes):
+        query = DBQuery.__new__(DBQuery)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
 
-    # SET UP SQL STATEMENT WITH FORMAT """ DELETE FROM {TABLE_NAME} """
-    action = 'DELETE FROM'
-    sql = """ {} {} """.format(action, table_name)
 
-    data, error = __db_execute_and_get_output(conn, sql)
-    if error is not None:
-        conn.commit()
-    return data, error
+class DBConnectionManager:
+    """
+    Hands out sqlite3 connections for one database file. By default every thread gets its own connection, with
+    pool_size set the threads share a bounded pool instead and block until a connection is released. Connections
+    are opened in WAL mode so any number of readers can run alongside one writer, and get profile applied to them.
+    Pass an instance to DBTableInterface in place of a connection. A thread keeps its connection, also across
+    DBTableInterface calls, until it calls release_connection or leaves a connection() block, so with pool_size
+    at most pool_size threads can hold one at a time and the next one raises queue.Empty after timeout seconds.
+    """
+    def __init__(self, db_path, pool_size=None, wal_mode=True, timeout=5.0, profile=None):
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.wal_mode = wal_mode
+        self.timeout = timeout
+        self.profile = profile
+
+        self.__thread_local = threading.local()
+        self.__lock = threading.Lock()
+        self.__connections = []
+        self.__pool = queue.LifoQueue() if pool_size else None
+        self.__pool_open_count = 0
+
+    def get_connection(self):
+        """
+        Get the connection of the calling thread, opening it (or taking one from the pool) on first use.
+        :return: sqlite3 connection
+        """
+        conn = getattr(self.__thread_local, 'conn', None)
+        if conn is None:
+            if self.__pool is None:
+                conn = self.__open_connection(check_same_thread=True)
+            else:
+                conn = self.__acquire_pool_connection()
+            self.__thread_local.conn = conn
+        return conn
 
+    def release_connection(self):
+        """
+        Give up the connection of the calling thread. Pooled connections go back to the pool, per thread
+        connections are closed.
+        :return: None
+        """
+        conn = getattr(self.__thread_local, 'conn', None)
+        if conn is not None:
+            self.__thread_local.conn = None
+            if self.__pool is None:
+                with self.__lock:
+                    self.__connections.remove(conn)
+                conn.close()
+            else:
+                if conn.in_transaction:
+                    conn.rollback()
+                self.__pool.put(conn)
 
-###########################################################
-# HELPER FUNCTIONS
-###########################################################
+    @contextmanager
+    def connection(self):
+        """
+        Context manager yielding the calling thread's connection, released again on exit if it was opened for it.
+        """
+        had_connection = getattr(self.__thread_local, 'conn', None) is not None
+        conn = self.get_connection()
+        try:
+            yield conn
+        finally:
+            if not had_connection:
+                self.release_connection()
 
-def __db_get_first_column_where_condition(col_dict, first_col_val):
-    first_col_name, col_type, col_length = col_dict[0]
-    where_condition = """WHERE {} = '{}'""".format(first_col_name, first_col_val)
-    return where_condition
+    def close_all(self):
+        """
+        Close every connection this manager opened, call once all threads are done with the database.
+        :return: None
+        """
+        with self.__lock:
+            connections = self.__connections
+            self.__connections = []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                # PER THREAD CONNECTIONS CAN ONLY BE CLOSED FROM THEIR OWN THREAD, THEY ARE FREED WITH THE THREAD
+                pass
+        self.__thread_local = threading.local()
+        if self.__pool is not None:
+            self.__pool = queue.LifoQueue()
+            self.__pool_open_count = 0
+
+    def __acquire_pool_connection(self):
+        try:
+            return self.__pool.get_nowait()
+        except queue.Empty:
+            pass
+        # RESERVE A SLOT UNDER THE LOCK SO CONCURRENT THREADS NEVER OPEN MORE THAN POOL_SIZE CONNECTIONS
+        with self.__lock:
+            can_open = self.__pool_open_count < self.pool_size
+            if can_open:
+                self.__pool_open_count += 1
+        if can_open:
+            return self.__open_connection(check_same_thread=False)
+        # POOL EXHAUSTED, WAIT FOR ANOTHER THREAD TO RELEASE ITS CONNECTION (RAISES queue.Empty ON TIMEOUT)
+        return self.__pool.get(timeout=self.timeout)
+
+    def __open_connection(self, check_same_thread):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=check_same_thread)
+        if self.wal_mode:
+            conn.execute('PRAGMA journal_mode=WAL')
+        if self.profile is not None:
+            previous_pragmas, error = db_apply_profile(conn, self.profile)
+            if error is not None:
+                logging.error(error)
+        with self.__lock:
+            self.__connections.append(conn)
+        return conn
 
 
-def __db_get_set_columns_and_values(col_dict, set_tuple):
-    set_string = ""
-    separator = ", "
-    for col_index in range(len(col_dict)):
-        col_name, col_type, col_length = col_dict[col_index]
-        set_val = set_tuple[col_index]
-        next_val_str = "{} = '{}'{}".format(col_name, set_val, separator)
-        set_string += next_val_str
-    for x in range(len(separator)):
-        set_string = set_string[:-1]
-    return set_string
+def db_get_connection(db_conn):
+    """
+    Resolve a sqlite3 connection or a DBConnectionManager to the connection the calling thread should use.
+    :param db_conn: sqlite3 connection or DBConnectionManager
+    :return: sqlite3 connection
+    """
+    if isinstance(db_conn, DBConnectionManager):
+        return db_conn.get_connection()
+    return db_conn
 
 
-def __db_execute_and_get_output(conn, sql, tuple_values=None):
+class DBSnapshot:
     """
-    Most important function for db interfacing. Executes sql statement with option of tuple_values and returns
-    data or error message.
-    :param conn: sqlite3 connection
-    :param sql: sql statement to execute
-    :param tuple_values: tuple of values to execute in an insert statement etc..
-    :return: data: rows returned from sql statement OR error: error received from sql execute
+    Read only in-memory copy of a database, made with the sqlite backup API. Heavy scans against the snapshot do not
+    take locks on the database file or compete with its writers for the page cache. refresh copies the database
+    again, but only when it changed since the last copy. With pages set the copy runs in steps of that many pages so
+    writers get the file lock back between steps, progress is called after each step with (status, remaining, total).
     """
-    data = None
-    error = None
-
-    cursor = conn.cursor()
-    # CONNECTION EXISTS
-    if cursor is not None:
-        logging.debug("sending sql: {}".format(sql))
+    def __init__(self, source, pages=-1, progress=None):
+        # SOURCE IS A DB FILE PATH, A SQLITE3 CONNECTION OR A DBConnectionManager
+        self.pages = pages
+        self.progress = progress
+        self.conn = sqlite3.connect(':memory:')
+
+        self.__owns_source = isinstance(source, str)
+        self.__source = sqlite3.connect(source) if self.__owns_source else source
+        self.__source_version = None
+        self.__row_caches = []
+
+    def refresh(self, force=False):
+        """
+        Copy the source database into the snapshot if it changed since the last refresh.
+        :param force: copy even when the source looks unchanged
+        :return: data: True if the snapshot was copied again, False if it was already current OR error: error received
+        """
+        source_conn = db_get_connection(self.__source)
         try:
-            # SENDING A TUPLE FOR SELECT STATEMENT
-            if tuple_values is None:
-                cursor.execute(sql)
-                data = cursor.fetchall()
-            # SENDING SIMPLE SQL STATEMENT
-            else:
-                cursor.execute(sql, tuple_values)
-                data = cursor.fetchall()
-        except sqlite3.OperationalError:
-            error = "OperationalError in statement: '''{}'''".format(sql)
-    # CONNECTION FAILED
-    else:
-        error = "Could not connect to database."
+            # DATA_VERSION CHANGES ON COMMITS OF OTHER CONNECTIONS, TOTAL_CHANGES COVERS THOSE OF THE SOURCE CONNECTION
+            source_version = (source_conn.execute('PRAGMA data_version').fetchone()[0], source_conn.total_changes)
+            if not force and source_version == self.__source_version:
+                return False, None
+            if self.conn.in_transaction:
+                # LEFT OPEN BY A REJECTED WRITE, THE BACKUP NEEDS THE DESTINATION FREE
+                self.conn.rollback()
+            self.conn.execute('PRAGMA query_only = OFF')
+            try:
+                source_conn.backup(self.conn, pages=self.pages, progress=self.progress)
+            finally:
+                self.conn.execute('PRAGMA query_only = ON')
+        except sqlite3.Error as e:
+            return None, str(e)
+        self.__source_version = source_version
+        for row_cache in self.__row_caches:
+            row_cache.clear()
+        return True, None
+
+    def get_table_interface(self, table_info_dict, row_format=RowFormats.DICT, cache_size=None, cache_ttl_sec=None):
+        """
+        Get a DBTableInterface bound to the snapshot, its writes return the sqlite readonly error.
+        Takes the first copy of the source if the snapshot was never refreshed.
+        :return: DBTableInterface
+        """
+        if self.__source_version is None:
+            copied, error = self.refresh()
+            if error is not None:
+                logging.error(error)
+        table_interface = DBTableInterface(self.conn, table_info_dict, row_format, cache_size, cache_ttl_sec)
+        if table_interface.row_cache is not None:
+            self.__row_caches.append(table_interface.row_cache)
+        return table_interface
 
-    return data, error
+    def close(self):
+        """
+        Close the snapshot, and the source connection if the snapshot opened it.
+        :return: None
+        """
+        self.conn.close()
+        if self.__owns_source:
+            self.__source.close()
 
 
-def __get_columns_and_types_str(columns_dict):
+class DBSchemaRegistry:
     """
-    Get a formatted string of columns and types for the create table sql statement.
-    :param columns_dict:
-    :return: columns_str FORMAT "{column_name} {column_type}, {column_name} {column_type}, ... {column_name} {column_type}"
+    Schema metadata cache for fast startup with many tables. All tables of the database are introspected in one query,
+    and after init_tables has created or migrated a table, its declaration signature is stored in the database next
+    to PRAGMA schema_version and user_version. Later init_tables calls, in this or any other process, read those in
+    one query and skip every table whose signature and versions still match. Bump user_version to force a recheck.
     """
-    # GET COLUMNS FROM COLUMNS DICT AND FORMAT STRING WITH COLUMN NAME AND COLUMN TYPE
-    columns_str = ""
-    current_column = 0
-    last_column_found = False
-    while not last_column_found:
-        col_info_tup = columns_dict.get(current_column)
-        if col_info_tup is not None:
-            col_name, col_type, col_length = col_info_tup
-            columns_str += "{} {},".format(col_name, col_type)
-        else:
-            last_column_found = True
-        current_column += 1
-    # REMOVE FINAL COMMA
-    columns_str = columns_str[:-1]
+    registry_table_name = "db_schema_registry"
+
+    def __init__(self, db_conn):
+        # DB_CONN IS A SQLITE3 CONNECTION OR A DBConnectionManager
+        self.__db_conn_source = db_conn
+        self.__versions = None
+        self.__table_col_dict = {}
+
+    @property
+    def __db_conn(self):
+        return db_get_connection(self.__db_conn_source)
+
+    def get_versions(self):
+        """
+        :return: versions: (schema_version, user_version) OR error: error received from sql execute
+        """
+        sql = """ SELECT s.schema_version, u.user_version FROM pragma_schema_version AS s, pragma_user_version AS u """
+        data, error = db_debug_test_statement(self.__db_conn, sql)
+        versions = tuple(data[0]) if error is None else None
+        return versions, error
+
+    def refresh(self):
+        """
+        Introspect the columns of every table in the database in one query, if the schema changed since last time.
+        :return: error: error received from sql execute
+        """
+        versions, error = self.get_versions()
+        if error is not None or versions == self.__versions:
+            return error
+
+        sql = """ SELECT m.name, p.cid, p.name, p.type FROM sqlite_master AS m, pragma_table_info(m.name) AS p
+                  WHERE m.type = 'table' ORDER BY m.name, p.cid """
+        data, error = db_debug_test_statement(self.__db_conn, sql)
+        if error is None:
+            table_col_dict = {}
+            for table_name, col_index, col_name, col_type in data:
+                table_col_dict.setdefault(table_name, {})[col_index] = (col_name, col_type)
+            self.__table_col_dict = table_col_dict
+            self.__versions = versions
+        return error
+
+    def get_table_column_info_dict(self, table_name):
+        """
+        Cached version of db_get_table_column_info_dict.
+        :param table_name: name of the table
+        :return: column_info_dict: None if the table does not exist OR error: error received from sql execute
+        """
+        error = self.refresh()
+        return self.__table_col_dict.get(table_name), error
+
+    def get_stored_signatures(self):
+        """
+        :return: signature_dict: {table_name: (signature, schema_version, user_version)} OR error
+        """
+        sql = """ SELECT table_name, signature, schema_version, user_version FROM {} """.format(self.registry_table_name)
+        data, error = db_debug_test_statement(self.__db_conn, sql)
+        if error is not None:
+            # NO REGISTRY TABLE YET, EVERY TABLE HAS TO BE CHECKED
+            return {}, None
+        return {table_name: tuple(stored_info) for table_name, *stored_info in data}, None
 
-    return columns_str
+    def init_tables(self, table_infos):
+        """
+        Create or migrate many tables in one transaction, skipping the ones already verified for the current schema.
+        :param table_infos: iterable of table info dicts, AbstractDBTable subclasses or DBTableInterface objects
+        :return: error: error received from sql execute, nothing is changed if there is one
+        """
+        conn = self.__db_conn
+        compiled_tables = [
+            table_info.compiled_table if isinstance(table_info, DBTableInterface) else db_compile_table(table_info)
+            for table_info in table_infos
+        ]
+        signature_dict = {compiled_table.table_name: db_get_table_signature(compiled_table) for compiled_table in compiled_tables}
+
+        versions, error = self.get_versions()
+        if error is not None:
+            return error
+        stored_signature_dict, error = self.get_stored_signatures()
+        pending_tables = [
+            compiled_table for compiled_table in compiled_tables
+            if stored_signature_dict.get(compiled_table.table_name) != (signature_dict[compiled_table.table_name],) + versions
+        ]
+        if not pending_tables:
+            return None
+
+        error = self.refresh()
+        if error is not None:
+            return error
+        try:
+            with db_batch(conn):
+                for compiled_table in pending_tables:
+                    old_table_col_dict = self.__table_col_dict.get(compiled_table.table_name)
+                    if old_table_col_dict is None:
+                        data, error = db_create_table(conn, compiled_table)
+                    elif not db_check_tables_match(compiled_table, old_table_col_dict):
+                        data, error = db_alter_table(conn, compiled_table, old_table_col_dict)
+                    if error is None:
+                        data, error = db_create_table_indexes(conn, compiled_table)
+                    if error is not None:
+                        raise sqlite3.DatabaseError(error)
+                error = self.__store_signatures(conn, signature_dict)
+                if error is not None:
+                    raise sqlite3.DatabaseError(error)
+        except sqlite3.DatabaseError as e:
+            error = error if error is not None else "{}: {}".format(type(e).__name__, e)
+        return error
+
+    def __store_signatures(self, conn, signature_dict):
+        sql = """ CREATE TABLE IF NOT EXISTS {} (table_name TEXT PRIMARY KEY, signature TEXT, schema_version INTEGER,
+                  user_version INTEGER) """.format(self.registry_table_name)
+        data, error = db_debug_test_statement(conn, sql)
+        if error is not None:
+            return error
+        # READ THE VERSIONS AFTER ALL DDL ABOVE, THEY ARE WHAT THE NEXT STARTUP WILL SEE
+        versions, error = self.get_versions()
+        if error is not None:
+            return error
+        sql = """ INSERT OR REPLACE INTO {} (table_name, signature, schema_version, user_version) VALUES (?,?,?,?) """.format(
+            self.registry_table_name)
+        # RUNS INSIDE THE BATCH OF init_tables, A FAILURE RAISES AND ROLLS THE WHOLE INIT BACK
+        conn.executemany(sql, [(table_name, signature) + versions for table_name, signature in signature_dict.items()])
+        return None
 
 
-def __get_column_names(columns_dict):
+class DBRowCache:
     """
-    Get a formatted string of column names for insert sql statement
-    :param columns_dict:
-    :return: columns_name_str FORMAT "{column_name}, {column_name}, ... {column_name}"
+    Bounded LRU cache of keyed select results with an optional TTL, enabled with DBTableInterface(cache_size=...).
+    Every connection gets its own partition of up to max_size keys, so rows one connection reads never leak into
+    another connection's view. A partition is dropped as soon as PRAGMA data_version shows another connection
+    committed or total_changes shows a write on the connection itself, e.g. through raw db_* functions or another
+    interface, writes through the owning interface invalidate their keys directly.
+    Cached rows are shared between callers and must not be modified.
     """
-    # GET COLUMN NAMES FROM COLUMNS DICT AND FORMAT STRING WITH COLUMN NAME
-    columns_name_str = ""
-    current_column = 0
-    last_column_found = False
-    while not last_column_found:
-        col_info_tup = columns_dict.get(current_column)
-        if col_info_tup is not None:
-            col_name, col_type, col_length = col_info_tup
-            columns_name_str += "{},".format(col_name)
-        else:
-            last_column_found = True
-        current_column += 1
-    # REMOVE FINAL COMMA
-    columns_name_str = columns_name_str[:-1]
+    def __init__(self, max_size, ttl_sec=None):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+
+        self.__lock = threading.Lock()
+        # {id(conn): [conn, (data_version, total_changes), OrderedDict({key: (expire_time, {row_format: rows})})]}
+        self.__partitions = {}
+        # BUMPED BY EVERY INVALIDATION SO A READ RACING A WRITE NEVER STORES ITS STALE ROWS
+        self.__generation = 0
+        self.__stats = {
+            CACHE_HITS_KEY: 0,
+            CACHE_MISSES_KEY: 0,
+            CACHE_EVICTIONS_KEY: 0,
+            CACHE_EXPIRATIONS_KEY: 0,
+            CACHE_INVALIDATIONS_KEY: 0,
+        }
+
+    def get(self, conn, key, row_format):
+        """
+        Look up the cached rows of a key, in row_format.
+        :param conn: sqlite3 connection the rows are read on
+        :param key: first column value
+        :param row_format: one of RowFormats
+        :return: rows: cached rows, None on a miss, generation: pass on to put
+        """
+        pragma_dict, error = db_get_pragmas(conn, ('data_version',))
+        # DATA_VERSION ONLY MOVES FOR OTHER CONNECTIONS' COMMITS, TOTAL_CHANGES FOR THIS CONNECTION'S OWN WRITES
+        data_version = (pragma_dict.get('data_version'), conn.total_changes)
+
+        with self.__lock:
+            partition = self.__get_partition(conn, data_version)
+            entries = partition[2]
+            rows = None
+            entry = entries.get(key)
+            if entry is not None:
+                expire_time, format_dict = entry
+                if expire_time is not None and time.monotonic() >= expire_time:
+                    del entries[key]
+                    self.__stats[CACHE_EXPIRATIONS_KEY] += 1
+                else:
+                    rows = format_dict.get(row_format)
+                    entries.move_to_end(key)
 
-    return columns_name_str
+            if rows is None:
+                self.__stats[CACHE_MISSES_KEY] += 1
+            else:
+                self.__stats[CACHE_HITS_KEY] += 1
+            return rows, self.__generation
+
+    def put(self, conn, key, row_format, rows, generation):
+        """
+        Cache the rows of a key read after get returned generation, evicting the least recently used key when full.
+        :return: None
+        """
+        with self.__lock:
+            partition = self.__partitions.get(id(conn))
+            if generation != self.__generation or partition is None:
+                return
+            entries = partition[2]
+            entry = entries.get(key)
+            if entry is None:
+                expire_time = None if self.ttl_sec is None else time.monotonic() + self.ttl_sec
+                entry = (expire_time, {})
+                entries[key] = entry
+                if len(entries) > self.max_size:
+                    entries.popitem(last=False)
+                    self.__stats[CACHE_EVICTIONS_KEY] += 1
+            entry[1][row_format] = rows
+
+    def invalidate(self, key):
+        """
+        Drop one key from every partition.
+        :return: None
+        """
+        with self.__lock:
+            self.__generation += 1
+            for conn, data_version, entries in self.__partitions.values():
+                if entries.pop(key, None) is not None:
+                    self.__stats[CACHE_INVALIDATIONS_KEY] += 1
+
+    def clear(self):
+        """
+        Drop every key from every partition.
+        :return: None
+        """
+        with self.__lock:
+            self.__generation += 1
+            for conn, data_version, entries in self.__partitions.values():
+                self.__stats[CACHE_INVALIDATIONS_KEY] += len(entries)
+                entries.clear()
 
+    def get_stats(self):
+        """
+        Hit, miss, eviction, expiration and invalidation counters and the current number of cached keys.
+        :return: stats dict
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats[CACHE_SIZE_KEY] = sum(len(entries) for conn, data_version, entries in self.__partitions.values())
+        return stats
+
+    def __get_partition(self, conn, data_version):
+        partition = self.__partitions.get(id(conn))
+        if partition is None:
+            # FIRST USE OF THIS CONNECTION, FORGET THE PARTITIONS OF CONNECTIONS CLOSED SINCE
+            for conn_id, (other_conn, other_data_version, other_entries) in list(self.__partitions.items()):
+                try:
+                    other_conn.total_changes
+                except sqlite3.ProgrammingError:
+                    del self.__partitions[conn_id]
+            partition = [conn, data_version, OrderedDict()]
+            self.__partitions[id(conn)] = partition
+        elif partition[1] != data_version:
+            # A COMMIT OF ANOTHER CONNECTION OR A WRITE ON THIS ONE SINCE THE LAST LOOKUP
+            self.__stats[CACHE_INVALIDATIONS_KEY] += len(partition[2])
+            partition[1] = data_version
+            partition[2].clear()
+        return partition
+
+
+class DBListChildTable:
+    """
+    ListFormats.CHILD_TABLE, normalized storage of one list column: a <table>__<column> table with one
+    (parent_key, position, value) row per entry, keyed by the parent's first column and indexed on value so list
+    contents can be searched in sql. Child rows are not deleted with their parent row, call db_write_lists with
+    empty lists or db_delete_lists.
+        tags = DBListChildTable(TestTableInfo, 'tags')
+        tags.db_create_table(conn)
+        tags.db_write_lists(conn, [('key_1', ['a', 'b'])])
+        list_dict, error = tags.db_read_lists(conn, ['key_1'])
+        keys, error = tags.db_select_keys_containing(conn, 'a')
+    """
+    def __init__(self, table_info, column_name, value_type=ColumnTypes.TEXT):
+        self.parent_table = db_compile_table(table_info)
+        self.column_name = column_name
+        self.table_info_dict = {
+            TABLE_NAME_KEY: "{}__{}".format(self.parent_table.table_name, column_name),
+            COLUMN_MAP_KEY: {
+                0: ('parent_key', self.parent_table.column_types[0]),
+                1: ('position', ColumnTypes.INTEGER),
+                2: ('value', value_type),
+            },
+            PRIMARY_KEY_KEY: ('parent_key', 'position'),
+            INDEXES_KEY: ['value'],
+        }
+        self.compiled_table = db_compile_table(self.table_info_dict)
 
-def __get_question_mark_count(columns_dict):
-    # GET QUESTIONS MARKS FOR INSERT SQL STATEMENT
-    question_mark_str = ""
-    column_count = len(columns_dict)
-    for q in range(column_count):
-        question_mark_str += "?,"
-    question_mark_str = question_mark_str[:-1]
+    def db_create_table(self, conn):
+        data, error = db_create_table(conn, self.compiled_table)
+        return data, error
 
-    return question_mark_str
+    def db_write_lists(self, conn, key_list_pairs, chunk_size=DEF_BULK_CHUNK_SIZE):
+        """
+        Replace the lists of parent keys, in a single transaction
+        :param key_list_pairs: iterable of (parent_key, row_list) pairs
+        :return: stats of the inserted entries, error
+        """
+        key_list_pairs = list(key_list_pairs)
+        entry_tuples = ((parent_key, position, value) for parent_key, row_list in key_list_pairs
+                        for position, value in enumerate(row_list))
+        stats = None
+        error = None
+        try:
+            with db_batch(conn):
+                stats, error = db_delete_where_first_column_in(conn, self.compiled_table, (parent_key for parent_key, row_list in key_list_pairs))
+                if error is None:
+                    stats, error = db_insert_many(conn, self.compiled_table, entry_tuples, chunk_size)
+                if error is not None:
+                    # RAISE SO DB_BATCH ROLLS THE DELETE BACK TOO
+                    raise sqlite3.DatabaseError(error)
+        except sqlite3.DatabaseError as e:
+            stats = None
+            error = error if error is not None else "{}: {}".format(type(e).__name__, e)
+        return stats, error
+
+    def db_delete_lists(self, conn, parent_keys):
+        stats, error = db_delete_where_first_column_in(conn, self.compiled_table, parent_keys)
+        return stats, error
+
+    def db_read_lists(self, conn, parent_keys):
+        """
+        Read the lists of parent keys
+        :return: list_dict: {parent_key: [value, ...]}, an empty list for keys without entries, error
+        """
+        parent_keys = list(parent_keys)
+        entry_dict = {parent_key: [] for parent_key in parent_keys}
+        row_iter, error = db_iter_where_first_column_in(conn, self.compiled_table, parent_keys)
+        try:
+            for parent_key, position, value in row_iter:
+                entry_dict[parent_key].append((position, value))
+        except sqlite3.Error as e:
+            return {}, "{}: {}".format(type(e).__name__, e)
+        list_dict = {parent_key: [value for position, value in sorted(entries)] for parent_key, entries in entry_dict.items()}
+        return list_dict, error
+
+    def db_select_keys_containing(self, conn, value):
+        """
+        Parent keys whose list contains value, through the value index
+        :return: parent_keys, error
+        """
+        query = DBQuery(self.compiled_table).where('value', QueryOperators.EQ, value).group_by('parent_key')
+        rows, error = db_select_query(conn, query, RowFormats.TUPLE)
+        return [row[0] for row in rows], error
 
 
 class DBTableInterface:
@@ -376,35 +3257,140 @@ class DBTableInterface:
     # def table_info_dict(self):
     #     pass
 
+    def __init__(self, db_conn, table_info_dict, row_format=RowFormats.DICT, cache_size=None, cache_ttl_sec=None):
+        # DB_CONN IS A SQLITE3 CONNECTION OR A DBConnectionManager HANDING OUT ONE CONNECTION PER THREAD, THE
+        # INTERFACE NEVER RELEASES IT AS ITERATORS AND TRANSACTIONS SPAN CALLS, POOLED THREADS RELEASE IT THEMSELVES
+        self.__db_conn_source = db_conn
+        self.table_info_dict = table_info_dict
+        # DEFAULT ROW FORMAT OF THE SELECT METHODS, CAN BE OVERRIDDEN PER CALL
+        self.row_format = row_format
+        # OPT IN LRU CACHE OF db_select_all_where_first_column_equals, row_cache.get_stats() HAS ITS COUNTERS
+        self.row_cache = DBRowCache(cache_size, cache_ttl_sec) if cache_size else None
+
     @property
-    def __mismatch_index(self):
-        return -1
+    def table_info_dict(self):
+        return self.__compiled_table.table_info_dict
 
-    def __init__(self, db_conn, table_info_dict):
-        self.__db_conn = db_conn
-        self.table_info_dict = table_info_dict
+    @table_info_dict.setter
+    def table_info_dict(self, table_info_dict):
+        # COMPILE ONCE HERE SO EVERY CALL BELOW ONLY DOES A STATEMENT LOOKUP
+        self.__compiled_table = db_compile_table(table_info_dict)
+
+    @property
+    def compiled_table(self):
+        return self.__compiled_table
+
+    @property
+    def __db_conn(self):
+        return db_get_connection(self.__db_conn_source)
 
     ###########################################################
     # WRITE OPERATIONS
     ###########################################################
 
+    def transaction(self, commit_every=None):
+        """
+        Unit of work on this table's connection, see db_batch:
+            with table.transaction(commit_every=1000):
+                table.db_insert_into_table(val_tuple)
+        :param commit_every: commit after this many writes, None to commit once at the end
+        :return: db_batch context manager
+        """
+        return db_batch(self.__db_conn, commit_every)
+
     def db_create_table(self):
-        data, error = db_create_table(self.__db_conn, self.table_info_dict)
+        self.__invalidate_cache()
+        data, error = db_create_table(self.__db_conn, self.__compiled_table)
+        return data, error
+
+    def db_create_table_indexes(self):
+        data, error = db_create_table_indexes(self.__db_conn, self.__compiled_table)
         return data, error
 
     def db_insert_into_table(self, val_tuple):
-        data, error = db_insert_into_table(self.__db_conn, self.table_info_dict, val_tuple)
+        self.__invalidate_cache(val_tuple[0])
+        data, error = db_insert_into_table(self.__db_conn, self.__compiled_table, val_tuple)
+        return data, error
+
+    def db_insert_many(self, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        """
+        Bulk insert rows into the table associated with this object in a single transaction
+        :param val_tuples: iterable of value tuples, generators are streamed
+        :param chunk_size: number of rows handed to each executemany call
+        :return: stats, error
+        """
+        self.__invalidate_cache()
+        stats, error = db_insert_many(self.__db_conn, self.__compiled_table, val_tuples, chunk_size)
+        return stats, error
+
+    def db_upsert(self, val_tuple, update_column_names=None, conflict_column_names=None):
+        """
+        Insert a row or update the row it conflicts with on the table's declared key, in one statement
+        :param update_column_names: columns overwritten on a conflict, defaults to every non key column
+        :param conflict_column_names: defaults to the primary key, then the first unique constraint
+        :return: data, error
+        """
+        if self.__compiled_table.get_conflict_column_names(conflict_column_names) == (self.__compiled_table.first_column_name,):
+            self.__invalidate_cache(val_tuple[0])
+        else:
+            # A CONFLICT ON ANY OTHER COLUMNS CAN UPDATE THE ROW OF A DIFFERENT FIRST COLUMN KEY
+            self.__invalidate_cache()
+        data, error = db_upsert(self.__db_conn, self.__compiled_table, val_tuple, update_column_names, conflict_column_names)
+        return data, error
+
+    def db_upsert_many(self, val_tuples, update_column_names=None, conflict_column_names=None, chunk_size=DEF_BULK_CHUNK_SIZE):
+        self.__invalidate_cache()
+        stats, error = db_upsert_many(self.__db_conn, self.__compiled_table, val_tuples, update_column_names,
+                                      conflict_column_names, chunk_size)
+        return stats, error
+
+    def db_replace_into_table(self, val_tuple):
+        # A REPLACE CAN DELETE ROWS CONFLICTING ON ANY UNIQUE KEY, NOT ONLY THE ROW OF ITS OWN FIRST COLUMN
+        self.__invalidate_cache()
+        data, error = db_replace_into_table(self.__db_conn, self.__compiled_table, val_tuple)
+        return data, error
+
+    def db_replace_many(self, val_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        self.__invalidate_cache()
+        stats, error = db_replace_many(self.__db_conn, self.__compiled_table, val_tuples, chunk_size)
+        return stats, error
+
+    def db_preallocate_blob(self, first_column_val, column_name, size):
+        self.__invalidate_cache(first_column_val)
+        data, error = db_preallocate_blob(self.__db_conn, self.__compiled_table, first_column_val, column_name, size)
         return data, error
 
+    def db_write_blob_from_file(self, first_column_val, column_name, file_obj, size=None, buffer_size=DEF_BLOB_BUFFER_SIZE):
+        """
+        Stream a binary file into a blob column of an existing row through one reused buffer
+        :return: byte_count, error
+        """
+        self.__invalidate_cache(first_column_val)
+        byte_count, error = db_write_blob_from_file(self.__db_conn, self.__compiled_table, first_column_val, column_name,
+                                                    file_obj, size, buffer_size)
+        return byte_count, error
+
     def db_delete_all_from_table(self):
-        data, error = db_delete_all_from_table(self.__db_conn, self.table_info_dict)
+        self.__invalidate_cache()
+        data, error = db_delete_all_from_table(self.__db_conn, self.__compiled_table)
         return data, error
 
     def db_drop_table(self):
-        return db_drop_table(self.__db_conn, self.table_info_dict[TABLE_NAME_KEY])
+        self.__invalidate_cache()
+        data, error = db_drop_table(self.__db_conn, self.__compiled_table.table_name)
+        if error is None and self.__compiled_table.searchable_columns:
+            data, error = db_drop_table(self.__db_conn, self.__compiled_table.search_table_name)
+        return data, error
 
-    def db_table_init(self):
-        table_exists, error = db_check_table_exists(self.__db_conn, self.table_info_dict[TABLE_NAME_KEY])
+    def db_table_init(self, schema_registry=None):
+        self.__invalidate_cache()
+        if schema_registry is not None:
+            # SKIPS ALL CHECKS WHEN THE REGISTRY ALREADY VERIFIED THIS TABLE FOR THE CURRENT SCHEMA
+            error = schema_registry.init_tables([self])
+            if error is not None:
+                logging.error(error)
+            return
+        table_exists, error = db_check_table_exists(self.__db_conn, self.__compiled_table.table_name)
         if error is not None:
             logging.error(error)
         else:
@@ -421,63 +3407,234 @@ class DBTableInterface:
                             logging.error(error)
                     else:
                         return
-                else:
-                    return
-
-    def db_alter_table(self, old_table_col_dict):
-        data = {}
-        error = None
-        # SET UP OTHER_TABLE_INFO_DICT, THIS IS NEEDED TO DO THE DB_SELECT_ALL
-        other_table_info_dict = dict()
-        other_table_info_dict[TABLE_NAME_KEY] = self.table_info_dict[TABLE_NAME_KEY]
-        other_table_info_dict[COLUMN_MAP_KEY] = old_table_col_dict
-
-        other_table_row_data_dict, error = db_select_all_from_table(self.__db_conn, other_table_info_dict)
-
-        # COMPARE EACH ROW AND PUT MATCHING COLUMNS WHERE THEY BELONG
-        col_compare_list = self.__get_column_compare_list(old_table_col_dict)
-
-        # TAKE THE CURRENT DATA FROM THE OLD TABLE
-        temp_row_data_dict = self.__get_joined_row_data_dict(other_table_row_data_dict, col_compare_list)
-
-        self.db_drop_table()
-        self.db_create_table()
-
-        # INSERT EACH ROW BACK INTO THE NEW ALTERED TABLE
-        for col_index, col_dict in temp_row_data_dict.items():
-            val_tuple = db_row_dict_to_tuple(col_dict)
-            data, error = self.db_insert_into_table(val_tuple)
-            if error is not None:
-                break
-
+                # ADD ANY DECLARED KEYS OR INDEXES THE EXISTING TABLE IS MISSING
+                output, error = self.db_create_table_indexes()
+                if error is not None:
+                    logging.error(error)
+
+    def db_alter_table(self, old_table_col_dict=None):
+        self.__invalidate_cache()
+        data, error = db_alter_table(self.__db_conn, self.__compiled_table, old_table_col_dict)
         return data, error
 
     def db_update_where_first_column_equals(self, val_tuple, first_column_val):
-        data, error = db_update_where_first_column_equals(self.__db_conn, self.table_info_dict, val_tuple, first_column_val)
+        self.__invalidate_cache(first_column_val)
+        self.__invalidate_cache(val_tuple[0])
+        data, error = db_update_where_first_column_equals(self.__db_conn, self.__compiled_table, val_tuple, first_column_val)
         return data, error
 
+    def db_update_many(self, update_tuples, chunk_size=DEF_BULK_CHUNK_SIZE):
+        """
+        Update many rows in a single transaction
+        :param update_tuples: iterable of (val_tuple, first_column_val) pairs
+        :param chunk_size: number of rows handed to each executemany call
+        :return: stats, error
+        """
+        self.__invalidate_cache()
+        stats, error = db_update_many(self.__db_conn, self.__compiled_table, update_tuples, chunk_size)
+        return stats, error
+
     def db_delete_where_first_column_equals(self, first_column_val):
-        data, error = db_delete_where_first_column_equals(self.__db_conn, self.table_info_dict, first_column_val)
+        self.__invalidate_cache(first_column_val)
+        data, error = db_delete_where_first_column_equals(self.__db_conn, self.__compiled_table, first_column_val)
         return data, error
 
+    def db_delete_many_by_first_column(self, first_column_vals, chunk_size=DEF_BULK_CHUNK_SIZE):
+        self.__invalidate_cache()
+        stats, error = db_delete_many_by_first_column(self.__db_conn, self.__compiled_table, first_column_vals, chunk_size)
+        return stats, error
+
+    def db_delete_where_first_column_in(self, first_column_vals, chunk_size=DEF_IN_CHUNK_SIZE):
+        """
+        Delete the rows of many keys with chunked IN (...) deletes in a single transaction
+        :return: stats, error
+        """
+        self.__invalidate_cache()
+        stats, error = db_delete_where_first_column_in(self.__db_conn, self.__compiled_table, first_column_vals, chunk_size)
+        return stats, error
+
+    def __invalidate_cache(self, first_column_val=None):
+        # BULK WRITES AND SCHEMA CHANGES DROP EVERYTHING, SINGLE ROW WRITES ONLY THEIR KEY
+        if self.row_cache is not None:
+            if first_column_val is None:
+                self.row_cache.clear()
+            else:
+                self.row_cache.invalidate(first_column_val)
+
     ###########################################################
     # READ OPERATIONS
     ###########################################################
 
-    def db_select_all_from_table(self):
+    def db_select_all_from_table(self, row_format=None):
         """
         Return all rows from the table associated with this object
+        :param row_format: one of RowFormats, defaults to self.row_format
         :return: row_dict, error
         """
-        row_dict, error = db_select_all_from_table(self.__db_conn, self.table_info_dict)
+        row_format = self.row_format if row_format is None else row_format
+        row_dict, error = db_select_all_from_table(self.__db_conn, self.__compiled_table, row_format)
         return row_dict, error
 
-    def db_select_all_where_first_column_equals(self, first_column_val):
-        row_dict, error = db_select_all_where_first_column_equals(self.__db_conn, self.table_info_dict, first_column_val)
+    def db_select_all_where_first_column_equals(self, first_column_val, row_format=None):
+        row_format = self.row_format if row_format is None else row_format
+        conn = self.__db_conn
+        # READS INSIDE A TRANSACTION CAN SEE ROWS THAT MAY STILL BE ROLLED BACK, THEY NEVER GO THROUGH THE CACHE
+        use_cache = self.row_cache is not None and not conn.in_transaction
+        if use_cache:
+            row_dict, generation = self.row_cache.get(conn, first_column_val, row_format)
+            if row_dict is not None:
+                return row_dict, None
+        row_dict, error = db_select_all_where_first_column_equals(conn, self.__compiled_table, first_column_val, row_format)
+        if use_cache and error is None:
+            self.row_cache.put(conn, first_column_val, row_format, row_dict, generation)
         return row_dict, error
 
+    def db_iter_all_from_table(self, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+        """
+        Stream all rows from the table associated with this object, batch_size rows in memory at a time
+        :return: row_iter, error
+        """
+        row_iter, error = db_iter_all_from_table(self.__db_conn, self.__compiled_table, batch_size, row_format)
+        return row_iter, error
+
+    def db_iter_where_first_column_equals(self, first_column_val, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+        row_iter, error = db_iter_where_first_column_equals(self.__db_conn, self.__compiled_table, first_column_val, batch_size, row_format)
+        return row_iter, error
+
+    def db_select_where_first_column_in(self, first_column_vals, row_format=None, chunk_size=DEF_IN_CHUNK_SIZE):
+        """
+        Return the rows of many keys, selected with chunked IN (...) statements
+        :return: rows, error
+        """
+        row_format = self.row_format if row_format is None else row_format
+        rows, error = db_select_where_first_column_in(self.__db_conn, self.__compiled_table, first_column_vals, row_format, chunk_size)
+        return rows, error
+
+    def db_iter_where_first_column_in(self, first_column_vals, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE,
+                                      chunk_size=DEF_IN_CHUNK_SIZE):
+        row_iter, error = db_iter_where_first_column_in(self.__db_conn, self.__compiled_table, first_column_vals, batch_size,
+                                                        row_format, chunk_size)
+        return row_iter, error
+
+    def db_open_blob(self, first_column_val, column_name, readonly=True):
+        """
+        Open a blob value of this table as a file-like sqlite3.Blob, see db_open_blob. Blobs opened for writing
+        bypass the row cache, call row_cache.invalidate(first_column_val) after writing through one.
+        :return: blob, error
+        """
+        blob, error = db_open_blob(self.__db_conn, self.__compiled_table, first_column_val, column_name, readonly)
+        return blob, error
+
+    def db_copy_blob_to_file(self, first_column_val, column_name, file_obj, buffer_size=DEF_BLOB_BUFFER_SIZE):
+        byte_count, error = db_copy_blob_to_file(self.__db_conn, self.__compiled_table, first_column_val, column_name,
+                                                 file_obj, buffer_size)
+        return byte_count, error
+
+    def db_select_columns_as_arrays(self, column_names=None, where_query=None, use_numpy=None):
+        """
+        Export columns as array.array or NumPy arrays typed from the schema, see db_select_columns_as_arrays
+        :return: array_dict, error
+        """
+        array_dict, error = db_select_columns_as_arrays(self.__db_conn, self.__compiled_table, column_names, where_query, use_numpy)
+        return array_dict, error
+
+    def db_create_change_feed(self):
+        """
+        Start recording the writes of the table in its changelog, see db_create_change_feed
+        """
+        data, error = db_create_change_feed(self.__db_conn, self.__compiled_table)
+        return data, error
+
+    def db_drop_change_feed(self):
+        data, error = db_drop_change_feed(self.__db_conn, self.__compiled_table)
+        return data, error
+
+    def db_get_last_change_seq(self):
+        seq, error = db_get_last_change_seq(self.__db_conn, self.__compiled_table)
+        return seq, error
+
+    def db_get_changes_since(self, since_seq=0, limit=DEF_CHANGE_BATCH_SIZE, row_format=None):
+        """
+        Get the row deltas after since_seq, see db_get_changes_since
+        :param row_format: defaults to the interface row format if that is TUPLE, ROW or RECORD, else TUPLE
+        :return: changes, error
+        """
+        if row_format is None:
+            row_format = self.row_format if self.row_format in (RowFormats.ROW, RowFormats.RECORD) else RowFormats.TUPLE
+        changes, error = db_get_changes_since(self.__db_conn, self.__compiled_table, since_seq, limit, row_format)
+        return changes, error
+
+    def db_compact_changes(self, up_to_seq=None, keep_last=None):
+        deleted_count, error = db_compact_changes(self.__db_conn, self.__compiled_table, up_to_seq, keep_last)
+        return deleted_count, error
+
+    def db_search(self, query, limit=DEF_SEARCH_LIMIT, row_format=None):
+        """
+        Ranked full text search over the searchable columns of the table, see db_search
+        :return: rows, error
+        """
+        rows, error = db_search(self.__db_conn, self.__compiled_table, query, limit, row_format or self.row_format)
+        return rows, error
+
+    def db_rebuild_search_index(self, optimize=False):
+        data, error = db_rebuild_search_index(self.__db_conn, self.__compiled_table, optimize)
+        return data, error
+
+    def query(self):
+        """
+        Start a DBQuery on the table associated with this object, run it with db_select_query or db_iter_query
+        """
+        return DBQuery(self.__compiled_table)
+
+    def db_select_query(self, query, row_format=None):
+        row_format = self.row_format if row_format is None else row_format
+        rows, error = db_select_query(self.__db_conn, query, row_format)
+        return rows, error
+
+    def db_iter_query(self, query, batch_size=DEF_FETCH_BATCH_SIZE, row_format=RowFormats.TUPLE):
+        row_iter, error = db_iter_query(self.__db_conn, query, batch_size, row_format)
+        return row_iter, error
+
+    def db_count(self, where_query=None):
+        """
+        Count the rows of the table associated with this object inside sqlite
+        :param where_query: optional DBQuery from self.query(), only rows matching its predicates are counted
+        :return: row_count, error
+        """
+        row_count, error = db_count(self.__db_conn, self.__compiled_table, where_query)
+        return row_count, error
+
+    def db_exists(self, first_column_val):
+        row_exists, error = db_exists(self.__db_conn, self.__compiled_table, first_column_val)
+        return row_exists, error
+
+    def db_sum(self, column_name, where_query=None):
+        value, error = db_sum(self.__db_conn, self.__compiled_table, column_name, where_query)
+        return value, error
+
+    def db_min(self, column_name, where_query=None):
+        value, error = db_min(self.__db_conn, self.__compiled_table, column_name, where_query)
+        return value, error
+
+    def db_max(self, column_name, where_query=None):
+        value, error = db_max(self.__db_conn, self.__compiled_table, column_name, where_query)
+        return value, error
+
+    def db_avg(self, column_name, where_query=None):
+        value, error = db_avg(self.__db_conn, self.__compiled_table, column_name, where_query)
+        return value, error
+
+    def db_group_by(self, group_column_names, aggregates, where_query=None, row_format=None):
+        """
+        One row per group with the group columns followed by the aggregates, see db_group_by
+        :return: rows, error
+        """
+        row_format = self.row_format if row_format is None else row_format
+        rows, error = db_group_by(self.__db_conn, self.__compiled_table, group_column_names, aggregates, where_query, row_format)
+        return rows, error
+
     def db_get_table_column_info_dict(self):
-        col_info_dict, error = db_get_table_column_info_dict(self.__db_conn, self.table_info_dict[TABLE_NAME_KEY])
+        col_info_dict, error = db_get_table_column_info_dict(self.__db_conn, self.__compiled_table.table_name)
         return col_info_dict, error
 
     def db_debug_test_statement(self, sql):
@@ -485,25 +3642,9 @@ class DBTableInterface:
         return output, error
 
     def db_check_table_exists(self):
-        table_exists, error = db_check_table_exists(self.__db_conn, self.table_info_dict[TABLE_NAME_KEY])
+        table_exists, error = db_check_table_exists(self.__db_conn, self.__compiled_table.table_name)
         return table_exists, error
 
-    def __get_joined_row_data_dict(self, other_table_row_data_dict, col_compare_list):
-        temp_row_data_dict = {}
-        for row_index, col_dict in other_table_row_data_dict.items():
-            temp_row_data_dict[row_index] = {}
-            for col_index in range(len(col_compare_list)):
-                col_index_to_get_data_from = col_compare_list[col_index]
-                if col_index_to_get_data_from == self.__mismatch_index:
-                    # INSERT DEFAULT VALUE FOR THAT TYPE
-                    col_type = self.table_info_dict[COLUMN_MAP_KEY][col_index][COLUMN_TYPE_INDEX]
-                    def_val = DEF_VAL_MAP[col_type]
-                    temp_row_data_dict[row_index][col_index] = def_val
-                else:
-                    temp_row_data_dict[row_index][col_index] = other_table_row_data_dict[row_index][col_index_to_get_data_from]
-
-        return temp_row_data_dict
-
     @staticmethod
     def __debug_output_row_col_from_table(row_data_dict):
         print("outputting all data from dict below:")
@@ -512,51 +3653,13 @@ class DBTableInterface:
             for col_index, col_val in col_dict.items():
                 print("    COL: {} '{}'".format(col_index, col_val))
 
-    def __get_column_compare_list(self, other_table_col_dict):
-        table_col_dict = self.table_info_dict[COLUMN_MAP_KEY]
-        table_col_count = len(table_col_dict)
-        other_table_col_count = len(other_table_col_dict)
-        col_compare_list = []
-
-        # ITERATE THROUGH ALL TABLE COLUMNS
-        for col_index in range(table_col_count):
-            # ITERATE THROUGH ALL OTHER TABLE COLUMNS
-            for other_col_index in range(other_table_col_count):
-                # IF NAMES MATCH, APPEND OTHER_COL_INDEX TO COL_COMPARE_LIST
-                names_match = table_col_dict[col_index][COLUMN_NAME_INDEX] == other_table_col_dict[other_col_index][COLUMN_NAME_INDEX]
-                types_match = table_col_dict[col_index][COLUMN_TYPE_INDEX] == other_table_col_dict[other_col_index][COLUMN_TYPE_INDEX]
-                if names_match and types_match:
-                    col_compare_list.append(other_col_index)
-                    break  # DON'T KEEP SEARCHING, COLUMNS CAN ONLY MATCH ONCE
-            # IF NOTHING WAS APPENDED, IT MEANS THERE WAS A MISMATCH, APPEND THAT TO COL_COMPARE_LIST
-            if not((0 <= col_index) and (col_index < len(col_compare_list))):
-                col_compare_list.append(self.__mismatch_index)
-
-        return col_compare_list
-
     def check_tables_match(self, other_table_col_dict):
         """
         Checks if the table column dicts are a match
         :param other_table_col_dict: The other table column dict to compare to
         :return: True if match, False if not
         """
-        table_is_match = True
-
-        this_table_col_dict = self.table_info_dict[COLUMN_MAP_KEY]
-
-        col_count = len(this_table_col_dict)
-        other_col_count = len(other_table_col_dict)
-
-        # IF NUMBER OF COLUMNS DON'T MATCH RETURN FALSE
-        if col_count != other_col_count:
-            table_is_match = False
-
-        # CHECK EACH COLUMN NUMBER, IF DIFFERENT RETURN FALSE
-        for col_index in range(col_count):
-            if this_table_col_dict[COLUMN_NAME_INDEX][:2] != other_table_col_dict[COLUMN_NAME_INDEX][:2] or this_table_col_dict[COLUMN_TYPE_INDEX][:2] != other_table_col_dict[COLUMN_TYPE_INDEX][:2]:
-                table_is_match = False
-
-        return table_is_match
+        return db_check_tables_match(self.__compiled_table, other_table_col_dict)
 
 
 # class AbstractDBTable:
@@ -601,6 +3704,18 @@ def AbstractTableColumn(column_name, type_, length):
 
 
 class AbstractDBTable:
+    """
+    Optional key declarations, column names or tuples of column names:
+        table_primary_key = 'first_column'
+        table_unique_constraints = [('second_column', 'third_column')]
+        table_indexes = ['second_column', ('third_column', 'first_column')]
+    TEXT columns to full text search with db_search:
+        table_searchable_columns = ['third_column']
+    """
+    table_primary_key = ()
+    table_unique_constraints = ()
+    table_indexes = ()
+    table_searchable_columns = ()
 
     @classmethod
     @abstractmethod
@@ -617,9 +3732,20 @@ class AbstractDBTable:
         table_info_dict = {
             TABLE_NAME_KEY: cls.table_name.lower(),
             COLUMN_MAP_KEY: cls.table_columns_dict,
+            PRIMARY_KEY_KEY: cls.table_primary_key,
+            UNIQUE_CONSTRAINTS_KEY: cls.table_unique_constraints,
+            INDEXES_KEY: cls.table_indexes,
+            SEARCHABLE_COLUMNS_KEY: cls.table_searchable_columns,
         }
         return table_info_dict
 
+    @classmethod
+    def record_class(cls):
+        """
+        Generated __slots__ record class used for RowFormats.RECORD rows of this table
+        """
+        return db_compile_table(cls).record_class
+
     def __init__(self, table_name, table_columns_dict):
         self.table_name = table_name
         self.table_columns_dict = table_columns_dict
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import tempfile
+import unittest
+
+from DataLib.db_async_helpers import *
+from DataLib.tests.test_db_helpers import KeyedTestTableInfo, TestTableInfo, get_test_rows
+
+
+class TestAsyncDBTableInterface(unittest.TestCase):
+    temp_dir = None
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.temp_dir.name, 'test.db')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_writes_and_reads(self):
+        async def run():
+            table = AsyncDBTableInterface(self.db_path, KeyedTestTableInfo.table_info_dict(), row_format=RowFormats.TUPLE)
+            await table.db_table_init()
+
+            # CONCURRENT WRITES ARE GROUP COMMITTED BY THE WRITER THREAD, EACH STILL GETS ITS OWN RESULT
+            results = await asyncio.gather(*[table.db_insert_into_table(row) for row in get_test_rows(50)])
+            self.assertEqual([error for data, error in results], [None] * 50)
+            data, error = await table.db_insert_into_table(('key_0', 0, 'val_0'))
+            self.assertIsNotNone(error)
+
+            rows, error = await table.db_select_all_from_table()
+            self.assertIsNone(error)
+            self.assertEqual(len(rows), 50)
+
+            data, error = await table.db_update_where_first_column_equals(('key_1', 1, 'updated'), 'key_1')
+            self.assertIsNone(error)
+            data, error = await table.db_delete_where_first_column_equals('key_2')
+            self.assertIsNone(error)
+            rows, error = await table.db_select_all_where_first_column_equals('key_1')
+            self.assertEqual(rows, [('key_1', 1, 'updated')])
+            rows, error = await table.db_select_all_where_first_column_equals('key_2')
+            self.assertEqual(rows, [])
+
+            exists, error = await table.run_read(lambda t: t.db_check_table_exists())
+            self.assertTrue(exists)
+            await table.close()
+
+        asyncio.run(run())
+
+    def test_async_iter(self):
+        async def run():
+            table = AsyncDBTableInterface(self.db_path, TestTableInfo.table_info_dict(), reader_count=1)
+            await table.db_table_init()
+            stats, error = await table.db_insert_many(get_test_rows(1000))
+            self.assertIsNone(error)
+
+            row_iter, error = await table.db_iter_all_from_table(batch_size=64)
+            self.assertIsNone(error)
+            self.assertEqual([row async for row in row_iter], list(get_test_rows(1000)))
+
+            # STOPPING EARLY HANDS THE ONLY READER THREAD BACK FOR THE NEXT READ
+            row_iter, error = await table.db_iter_all_from_table(batch_size=10)
+            async for row in row_iter:
+                break
+            await row_iter.aclose()
+            rows, error = await table.db_select_all_where_first_column_equals('key_999')
+            self.assertEqual(len(rows), 1)
+
+            row_iter, error = await table.db_iter_where_first_column_equals('key_5')
+            self.assertEqual([row async for row in row_iter], [('key_5', 5, 'val_5')])
+            await table.close()
+
+        asyncio.run(run())
+
+    def test_failing_write_rolls_back_only_itself(self):
+        async def run():
+            table = AsyncDBTableInterface(self.db_path, KeyedTestTableInfo.table_info_dict(), row_format=RowFormats.TUPLE)
+            await table.db_table_init()
+
+            def insert_then_raise(write_table):
+                write_table.db_insert_into_table(('key_bad', 1, 'val_bad'))
+                raise ValueError("bad request")
+
+            results = await asyncio.gather(table.db_insert_into_table(('key_0', 0, 'val_0')),
+                                           table.run_write(insert_then_raise),
+                                           table.db_insert_into_table(('key_2', 2, 'val_2')), return_exceptions=True)
+            self.assertIsInstance(results[1], ValueError)
+            rows, error = await table.db_select_all_from_table()
+            self.assertEqual(sorted(rows), [('key_0', 0, 'val_0'), ('key_2', 2, 'val_2')])
+            await table.close()
+
+        asyncio.run(run())
+
+    def test_writer_failure_fails_writes(self):
+        async def run():
+            # THE WRITER CAN NOT OPEN A DATABASE IN A MISSING DIRECTORY
+            with self.assertLogs(level=logging.ERROR):
+                table = AsyncDBTableInterface(os.path.join(self.temp_dir.name, 'missing', 'test.db'), TestTableInfo.table_info_dict())
+                with self.assertRaises(sqlite3.OperationalError):
+                    await asyncio.wait_for(table.db_table_init(), timeout=5)
+            with self.assertRaises(sqlite3.OperationalError):
+                await asyncio.wait_for(table.db_insert_into_table(('key_0', 0, 'val_0')), timeout=5)
+            await table.close()
+
+        asyncio.run(run())
+
+    def test_abandoned_async_iter(self):
+        async def run():
+            table = AsyncDBTableInterface(self.db_path, TestTableInfo.table_info_dict(), reader_count=1)
+            await table.db_table_init()
+            await table.db_insert_many(get_test_rows(1000))
+
+            # NEVER ITERATED, ITS READER THREAD FILLS THE QUEUE AND WAITS, close() HAS TO STOP IT
+            unused_iter, error = await table.db_iter_all_from_table(batch_size=10)
+            self.assertIsNone(error)
+            await asyncio.wait_for(table.close(), timeout=5)
+
+        asyncio.run(run())
+
+    def test_async_iter_raises_mid_stream_errors(self):
+        async def run():
+            table = AsyncDBTableInterface(self.db_path, TestTableInfo.table_info_dict(), reader_count=1)
+            await table.db_table_init()
+            await table.db_insert_many([('key_a', x, 'val') for x in range(100)] + [('key_b', 0, 'val')])
+
+            # THE FIRST CHUNK IS STILL STREAMING WHEN THE TABLE GOES AWAY, THE SECOND ONE FAILS
+            row_iter, error = await table.db_iter_where_first_column_in(['key_a', 'key_b'], batch_size=1, chunk_size=1)
+            self.assertIsNone(error)
+            await table.db_drop_table()
+            rows = []
+            with self.assertLogs(level=logging.ERROR), self.assertRaises(sqlite3.DatabaseError):
+                async for row in row_iter:
+                    rows.append(row)
+            self.assertEqual(len(rows), 100)
+            await table.close()
+
+        asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
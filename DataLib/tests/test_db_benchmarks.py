@@ -0,0 +1,44 @@
+import json
+import os
+import tempfile
+import unittest
+
+from DataLib.db_benchmarks import *
+
+
+class TestDBBenchmarks(unittest.TestCase):
+    def test_run_benchmarks(self):
+        results = run_benchmarks(row_counts=(100,), repeat=1)
+        self.assertEqual(list(results[RESULTS_KEY]), list(BENCHMARKS))
+        for name, row_count_dict in results[RESULTS_KEY].items():
+            self.assertGreater(row_count_dict['100'][OP_COUNT_KEY], 0)
+            self.assertGreaterEqual(row_count_dict['100'][SEC_PER_OP_KEY], 0)
+        # RESULTS SURVIVE A JSON ROUND TRIP UNCHANGED SO A STORED BASELINE COMPARES LIKE A FRESH ONE
+        self.assertEqual(compare_results(json.loads(json.dumps(results)), results), [])
+
+    def test_compare_results(self):
+        def make_results(sec_per_op_dict):
+            return {RESULTS_KEY: {name: {'100': {SEC_PER_OP_KEY: sec}} for name, sec in sec_per_op_dict.items()}}
+
+        baseline = make_results({'insert_bulk': 1.0, 'select_all': 1.0, 'table_init': 1.0})
+        current = make_results({'insert_bulk': 1.1, 'select_all': 1.5, 'delete_bulk': 9.0})
+        regressions = compare_results(baseline, current, threshold=0.2)
+        self.assertEqual([(name, row_count) for name, row_count, _, _, _ in regressions], [('select_all', '100')])
+        self.assertEqual(compare_results(baseline, current, threshold=0.6), [])
+
+    def test_main_compare_exit_status(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            baseline_path = os.path.join(temp_dir, 'baseline.json')
+            argv = ['--rows', '50', '--repeat', '1', '--only', 'insert_bulk', 'select_keyed']
+            self.assertEqual(main(argv + ['--output', baseline_path]), 0)
+            with open(baseline_path) as read_file:
+                baseline = json.load(read_file)
+            for row_count_dict in baseline[RESULTS_KEY].values():
+                row_count_dict['50'][SEC_PER_OP_KEY] /= 1000
+            with open(baseline_path, 'w') as write_file:
+                json.dump(baseline, write_file)
+            self.assertEqual(main(argv + ['--output', os.path.join(temp_dir, 'current.json'), '--compare', baseline_path]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,1028 @@
+import array
+import io
+import logging
+import os
+import tempfile
+import threading
+import unittest
+
+from DataLib.db_helpers import *
+
+
+class TestTableInfo(AbstractDBTable):
+    table_name = "TEST_TABLE"
+    table_columns_dict = {
+        0: AbstractTableColumn('first_column', ColumnTypes.TEXT, 20),
+        1: AbstractTableColumn('second_column', ColumnTypes.INTEGER, 20),
+        2: AbstractTableColumn('third_column', ColumnTypes.TEXT, 20),
+    }
+
+    @staticmethod
+    def get_insert_tuple(first_column, second_column, third_column):
+        return first_column, second_column, third_column
+
+
+class KeyedTestTableInfo(TestTableInfo):
+    table_name = "KEYED_TEST_TABLE"
+    table_primary_key = 'first_column'
+    table_unique_constraints = [('second_column', 'third_column')]
+    table_indexes = ['third_column']
+
+
+def get_test_rows(row_count):
+    for x in range(row_count):
+        yield TestTableInfo.get_insert_tuple('key_{}'.format(x), x, 'val_{}'.format(x))
+
+
+class TestDBHelpers(unittest.TestCase):
+    db_conn = None
+    table_interface = None
+
+    def setUp(self):
+        self.db_conn = sqlite3.connect(':memory:')
+        self.table_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict())
+        self.table_interface.db_create_table()
+
+    def tearDown(self):
+        self.db_conn.close()
+
+    def test_insert_many(self):
+        row_count = 2500
+        stats, error = self.table_interface.db_insert_many(get_test_rows(row_count), chunk_size=1000)
+        self.assertIsNone(error)
+        self.assertEqual(stats[ROW_COUNT_KEY], row_count)
+        self.assertGreater(stats[ROWS_PER_SEC_KEY], 0)
+        self.assertFalse(self.db_conn.in_transaction)
+
+        row_dict, error = self.table_interface.db_select_all_from_table()
+        self.assertIsNone(error)
+        self.assertEqual(len(row_dict), row_count)
+        self.assertEqual(row_dict[10], {0: 'key_10', 1: 10, 2: 'val_10'})
+
+    def test_insert_many_rolls_back_on_error(self):
+        bad_rows = itertools.chain(get_test_rows(10), [('too', 'few')])
+        stats, error = self.table_interface.db_insert_many(bad_rows, chunk_size=4)
+        self.assertIsNone(stats)
+        self.assertIsNotNone(error)
+
+        row_dict, error = self.table_interface.db_select_all_from_table()
+        self.assertEqual(len(row_dict), 0)
+
+    def test_compile_table_is_cached(self):
+        compiled_table = db_compile_table(TestTableInfo)
+        self.assertIs(compiled_table, db_compile_table(TestTableInfo.table_info_dict()))
+        self.assertIs(compiled_table, self.table_interface.compiled_table)
+        self.assertIs(compiled_table, db_compile_table(compiled_table))
+        self.assertEqual(compiled_table.column_index_map['third_column'], 2)
+        self.assertEqual(compiled_table.placeholders_str, '?,?,?')
+
+    def test_update_and_delete_where_first_column_equals(self):
+        self.table_interface.db_insert_many(get_test_rows(3))
+        data, error = self.table_interface.db_update_where_first_column_equals(('key_1', 100, 'changed'), 'key_1')
+        self.assertIsNone(error)
+        row_dict, error = self.table_interface.db_select_all_where_first_column_equals('key_1')
+        self.assertEqual(row_dict, {0: {0: 'key_1', 1: 100, 2: 'changed'}})
+
+        data, error = self.table_interface.db_delete_where_first_column_equals('key_1')
+        self.assertIsNone(error)
+        row_dict, error = self.table_interface.db_select_all_from_table()
+        self.assertEqual(len(row_dict), 2)
+
+    def test_quoted_values_are_bound_as_parameters(self):
+        self.table_interface.db_insert_into_table(("it's", 1, 'val'))
+        data, error = self.table_interface.db_update_where_first_column_equals(("it's", 2, "o'clock"), "it's")
+        self.assertIsNone(error)
+        rows, error = self.table_interface.db_select_all_where_first_column_equals("it's", RowFormats.TUPLE)
+        self.assertEqual(rows, [("it's", 2, "o'clock")])
+        data, error = self.table_interface.db_delete_where_first_column_equals("it's")
+        self.assertIsNone(error)
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+        self.assertEqual(rows, [])
+
+    def test_update_many_and_delete_many(self):
+        self.table_interface.db_insert_many(get_test_rows(100))
+        update_tuples = ((('key_{}'.format(x), x * 10, 'new_{}'.format(x)), 'key_{}'.format(x)) for x in range(50))
+        stats, error = self.table_interface.db_update_many(update_tuples, chunk_size=7)
+        self.assertIsNone(error)
+        self.assertEqual(stats[ROW_COUNT_KEY], 50)
+        rows, error = self.table_interface.db_select_all_where_first_column_equals('key_7', RowFormats.TUPLE)
+        self.assertEqual(rows, [('key_7', 70, 'new_7')])
+
+        stats, error = self.table_interface.db_delete_many_by_first_column('key_{}'.format(x) for x in range(0, 100, 2))
+        self.assertIsNone(error)
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+        self.assertEqual(len(rows), 50)
+        self.assertEqual(rows[0], ('key_1', 10, 'new_1'))
+
+    def test_iter_all_from_table(self):
+        row_count = 2500
+        self.table_interface.db_insert_many(get_test_rows(row_count))
+        row_iter, error = self.table_interface.db_iter_all_from_table(batch_size=100)
+        self.assertIsNone(error)
+        rows = list(row_iter)
+        self.assertEqual(len(rows), row_count)
+        self.assertEqual(rows[42], ('key_42', 42, 'val_42'))
+
+        row_iter, error = self.table_interface.db_iter_where_first_column_equals('key_7')
+        self.assertIsNone(error)
+        self.assertEqual(list(row_iter), [('key_7', 7, 'val_7')])
+
+        # A READ FAILING MID STREAM RAISES INSTEAD OF LOOKING LIKE A SHORTER RESULT
+        row_iter, error = self.table_interface.db_iter_all_from_table(batch_size=100)
+        next(row_iter)
+        self.db_conn.interrupt()
+        with self.assertLogs(level=logging.ERROR), self.assertRaises(sqlite3.OperationalError):
+            list(row_iter)
+
+    def test_select_row_formats(self):
+        self.table_interface.db_insert_many(get_test_rows(3))
+
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+        self.assertIsNone(error)
+        self.assertEqual(rows[1], ('key_1', 1, 'val_1'))
+
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.ROW)
+        self.assertEqual(rows[1]['third_column'], 'val_1')
+
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.RECORD)
+        self.assertIsInstance(rows[1], TestTableInfo.record_class())
+        self.assertEqual(rows[1].second_column, 1)
+        self.assertEqual(tuple(rows[1]), ('key_1', 1, 'val_1'))
+        self.assertFalse(hasattr(rows[1], '__dict__'))
+
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.COLUMNS)
+        self.assertEqual(rows, {0: ['key_0', 'key_1', 'key_2'], 1: [0, 1, 2], 2: ['val_0', 'val_1', 'val_2']})
+
+        rows, error = self.table_interface.db_select_all_where_first_column_equals('key_2', RowFormats.TUPLE)
+        self.assertEqual(rows, [('key_2', 2, 'val_2')])
+
+        row_iter, error = self.table_interface.db_iter_all_from_table(row_format=RowFormats.DICT)
+        self.assertEqual(next(row_iter), {0: 'key_0', 1: 0, 2: 'val_0'})
+
+        rows, error = self.table_interface.db_select_all_from_table('unknown')
+        self.assertIsNotNone(error)
+
+    def test_interface_default_row_format(self):
+        table_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_insert_into_table(('key', 1, 'val'))
+        rows, error = table_interface.db_select_all_from_table()
+        self.assertEqual(rows, [('key', 1, 'val')])
+
+    def test_table_keys_and_indexes(self):
+        table_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict())
+        table_interface.db_table_init()
+        table_interface.db_insert_many(get_test_rows(10))
+
+        data, error = table_interface.db_insert_into_table(('key_1', 1, 'val_1'))
+        self.assertIn('IntegrityError', error)
+
+        unique_column_sets, error = db_get_table_unique_column_sets(self.db_conn, table_interface.compiled_table.table_name)
+        self.assertEqual(unique_column_sets, {frozenset(['first_column']), frozenset(['second_column', 'third_column'])})
+
+        plan, error = table_interface.db_debug_test_statement(
+            "EXPLAIN QUERY PLAN SELECT * FROM keyed_test_table WHERE third_column = 'val_1'")
+        self.assertIn('idx_keyed_test_table_third_column', str(plan))
+
+    def test_table_init_adds_missing_keys_to_existing_table(self):
+        self.db_conn.execute("CREATE TABLE keyed_test_table (first_column TEXT, second_column INTEGER, third_column TEXT)")
+        table_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict())
+        table_interface.db_table_init()
+
+        unique_column_sets, error = db_get_table_unique_column_sets(self.db_conn, 'keyed_test_table')
+        self.assertIsNone(error)
+        self.assertEqual(unique_column_sets, {frozenset(['first_column']), frozenset(['second_column', 'third_column'])})
+
+        plan, error = table_interface.db_debug_test_statement(
+            "EXPLAIN QUERY PLAN SELECT * FROM keyed_test_table WHERE first_column = 'key_1'")
+        self.assertIn('pk_keyed_test_table', str(plan))
+
+        # RUNNING INIT AGAIN DOES NOT ADD DUPLICATE INDEXES
+        table_interface.db_table_init()
+        data, error = table_interface.db_debug_test_statement("SELECT name FROM pragma_index_list('keyed_test_table')")
+        self.assertEqual(len(data), 3)
+
+    def test_connection_manager_per_thread(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_manager = DBConnectionManager(os.path.join(temp_dir, 'test.db'))
+            table_interface = DBTableInterface(db_manager, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            table_interface.db_create_table()
+            table_interface.db_insert_many(get_test_rows(10))
+
+            main_conn = db_manager.get_connection()
+            self.assertEqual(main_conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+            thread_results = {}
+
+            def read_in_thread():
+                thread_results['conn'] = db_manager.get_connection()
+                thread_results['rows'] = table_interface.db_select_all_from_table()
+                db_manager.release_connection()
+
+            thread = threading.Thread(target=read_in_thread)
+            thread.start()
+            thread.join()
+            self.assertIsNot(thread_results['conn'], main_conn)
+            self.assertEqual(len(thread_results['rows'][0]), 10)
+            db_manager.close_all()
+
+    def test_connection_manager_pool(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_manager = DBConnectionManager(os.path.join(temp_dir, 'test.db'), pool_size=1)
+            with db_manager.connection() as conn:
+                first_conn = conn
+            thread_conns = []
+
+            def use_pool():
+                with db_manager.connection() as conn:
+                    thread_conns.append(conn)
+
+            thread = threading.Thread(target=use_pool)
+            thread.start()
+            thread.join()
+            self.assertIs(thread_conns[0], first_conn)
+            db_manager.close_all()
+
+    def test_connection_manager_pool_limit(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_manager = DBConnectionManager(os.path.join(temp_dir, 'test.db'), pool_size=1, timeout=0.1)
+            table_interface = DBTableInterface(db_manager, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            table_interface.db_create_table()
+            thread_results = []
+
+            def read_in_thread():
+                try:
+                    thread_results.append(table_interface.db_count())
+                except queue.Empty:
+                    thread_results.append('pool exhausted')
+                finally:
+                    db_manager.release_connection()
+
+            # THE INTERFACE KEEPS THIS THREAD'S POOLED CONNECTION UNTIL IT IS RELEASED
+            for release_first in (False, True):
+                if release_first:
+                    db_manager.release_connection()
+                thread = threading.Thread(target=read_in_thread)
+                thread.start()
+                thread.join()
+            self.assertEqual(thread_results, ['pool exhausted', (0, None)])
+            db_manager.close_all()
+
+    def test_connect_profiles(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            conn, error = db_connect(os.path.join(temp_dir, 'test.db'), DBProfiles.READ_MOSTLY)
+            self.assertIsNone(error)
+            pragma_dict, error = db_get_pragmas(conn, ['journal_mode', 'synchronous', 'mmap_size', 'temp_store'])
+            self.assertEqual(pragma_dict, {'journal_mode': 'wal', 'synchronous': 1, 'mmap_size': 268435456, 'temp_store': 2})
+
+            # SWITCH AT RUNTIME AND RESTORE
+            with db_profile(conn, DBProfiles.BULK_LOAD):
+                pragma_dict, error = db_get_pragmas(conn, ['synchronous', 'cache_size'])
+                self.assertEqual(pragma_dict, {'synchronous': 0, 'cache_size': -262144})
+            pragma_dict, error = db_get_pragmas(conn, ['synchronous', 'cache_size'])
+            self.assertEqual(pragma_dict, {'synchronous': 1, 'cache_size': -65536})
+            conn.close()
+
+            conn, error = db_connect(os.path.join(temp_dir, 'test.db'), 'unknown')
+            self.assertIsNotNone(error)
+            conn.close()
+
+    def test_single_writes_are_committed(self):
+        self.table_interface.db_insert_into_table(('key', 1, 'val'))
+        self.assertFalse(self.db_conn.in_transaction)
+
+    def test_failed_single_write_releases_write_lock(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'test.db')
+            conn = sqlite3.connect(db_path, timeout=0)
+            other_conn = sqlite3.connect(db_path, timeout=0)
+            table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            table_interface.db_create_table()
+            table_interface.db_insert_into_table(('key', 1, 'val'))
+
+            data, error = table_interface.db_insert_into_table(('key', 2, 'dup'))
+            self.assertIn('IntegrityError', error)
+            self.assertFalse(conn.in_transaction)
+            other_interface = DBTableInterface(other_conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            self.assertIsNone(other_interface.db_insert_into_table(('other', 3, 'val'))[1])
+            conn.close()
+            other_conn.close()
+
+    def test_batch_commits_once_and_rolls_back_on_error(self):
+        with self.table_interface.transaction() as batch:
+            for val_tuple in get_test_rows(20):
+                self.table_interface.db_insert_into_table(val_tuple)
+            self.assertTrue(self.db_conn.in_transaction)
+        self.assertEqual(batch.write_count, 20)
+        self.assertEqual(batch.commit_count, 1)
+        self.assertFalse(self.db_conn.in_transaction)
+
+        with self.assertRaises(ValueError):
+            with db_batch(self.db_conn):
+                self.table_interface.db_delete_all_from_table()
+                raise ValueError()
+        rows, error = self.table_interface.db_select_all_from_table()
+        self.assertEqual(len(rows), 20)
+
+    def test_batch_commit_every(self):
+        with db_batch(self.db_conn, commit_every=7) as batch:
+            self.table_interface.db_insert_many(get_test_rows(3))
+            for x in range(10):
+                self.table_interface.db_update_where_first_column_equals(('key_0', x, 'val_0'), 'key_0')
+        # 13 WRITES, ONE COMMIT AT 7 PENDING WRITES PLUS THE FINAL ONE
+        self.assertEqual(batch.write_count, 13)
+        self.assertEqual(batch.commit_count, 2)
+
+    def test_nested_batch_savepoint(self):
+        with db_batch(self.db_conn) as batch:
+            self.table_interface.db_insert_into_table(('outer', 1, 'val'))
+            try:
+                with db_batch(self.db_conn) as nested_batch:
+                    self.assertEqual(nested_batch.depth, 1)
+                    self.table_interface.db_insert_into_table(('inner', 2, 'val'))
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.assertIs(db_get_active_batch(self.db_conn), batch)
+        self.assertIsNone(db_get_active_batch(self.db_conn))
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+        self.assertEqual(rows, [('outer', 1, 'val')])
+
+    def test_failed_bulk_write_in_batch_only_undoes_itself(self):
+        with db_batch(self.db_conn):
+            self.table_interface.db_insert_into_table(('first', 1, 'val'))
+            stats, error = self.table_interface.db_insert_many([('second', 2, 'val'), ('too', 'few')])
+            self.assertIsNotNone(error)
+        rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+        self.assertEqual(rows, [('first', 1, 'val')])
+
+    def test_alter_table_adds_columns_in_place(self):
+        self.db_conn.execute("CREATE TABLE altered_table (first_column TEXT, second_column INTEGER)")
+        self.db_conn.executemany("INSERT INTO altered_table VALUES (?, ?)", [('a', 1), ('b', 2)])
+        self.db_conn.commit()
+        table_info_dict = dict(TestTableInfo.table_info_dict(), **{TABLE_NAME_KEY: 'altered_table'})
+
+        table_interface = DBTableInterface(self.db_conn, table_info_dict, RowFormats.TUPLE)
+        table_interface.db_table_init()
+        rows, error = table_interface.db_select_all_from_table()
+        self.assertEqual(rows, [('a', 1, ''), ('b', 2, '')])
+
+        # INDEXES ON ADDED COLUMNS ARE CREATED BY A DIRECT CALL TOO
+        self.db_conn.execute("CREATE TABLE indexed_table (first_column TEXT, second_column INTEGER)")
+        self.db_conn.commit()
+
+        class IndexedTableInfo(TestTableInfo):
+            table_name = "INDEXED_TABLE"
+            table_indexes = ['third_column']
+
+        self.assertIsNone(db_alter_table(self.db_conn, IndexedTableInfo.table_info_dict())[1])
+        index_names = [row[0] for row in self.db_conn.execute("SELECT name FROM pragma_index_list('indexed_table')")]
+        self.assertEqual(index_names, ['idx_indexed_table_third_column'])
+
+    def test_alter_table_rebuilds_in_sql(self):
+        self.db_conn.execute("CREATE TABLE altered_table (third_column TEXT, old_column REAL, first_column TEXT)")
+        self.db_conn.executemany("INSERT INTO altered_table VALUES (?, ?, ?)", [("it's", 1.5, 'a'), ('y', 2.5, 'b')])
+        self.db_conn.commit()
+        table_info_dict = dict(TestTableInfo.table_info_dict(), **{TABLE_NAME_KEY: 'altered_table'})
+
+        data, error = db_alter_table(self.db_conn, table_info_dict)
+        self.assertIsNone(error)
+        self.assertFalse(self.db_conn.in_transaction)
+        col_info_dict, error = db_get_table_column_info_dict(self.db_conn, 'altered_table')
+        self.assertEqual(col_info_dict, {0: ('first_column', 'TEXT'), 1: ('second_column', 'INTEGER'), 2: ('third_column', 'TEXT')})
+        rows, error = db_select_all_from_table(self.db_conn, table_info_dict, RowFormats.TUPLE)
+        self.assertEqual(rows, [('a', 0, "it's"), ('b', 0, 'y')])
+
+    def test_alter_table_rolls_back_on_error(self):
+        self.db_conn.execute("CREATE TABLE keyed_test_table (first_column TEXT, old_column TEXT)")
+        self.db_conn.executemany("INSERT INTO keyed_test_table VALUES (?, ?)", [('same', 'x'), ('same', 'y')])
+        self.db_conn.commit()
+
+        # DUPLICATE FIRST COLUMN VALUES CAN NOT GO INTO THE NEW PRIMARY KEY
+        data, error = db_alter_table(self.db_conn, KeyedTestTableInfo)
+        self.assertIn('IntegrityError', error)
+        col_info_dict, error = db_get_table_column_info_dict(self.db_conn, 'keyed_test_table')
+        self.assertEqual(col_info_dict, {0: ('first_column', 'TEXT'), 1: ('old_column', 'TEXT')})
+        data, error = self.table_interface.db_debug_test_statement("SELECT COUNT(*) FROM keyed_test_table")
+        self.assertEqual(data, [(2,)])
+
+    def test_schema_registry_init_tables(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'test.db')
+            conn = sqlite3.connect(db_path)
+            conn.execute("CREATE TABLE keyed_test_table (first_column TEXT, old_column TEXT)")
+            conn.execute("INSERT INTO keyed_test_table VALUES ('a', 'x')")
+            conn.commit()
+
+            schema_registry = DBSchemaRegistry(conn)
+            error = schema_registry.init_tables([TestTableInfo, KeyedTestTableInfo])
+            self.assertIsNone(error)
+            self.assertFalse(conn.in_transaction)
+            col_info_dict, error = schema_registry.get_table_column_info_dict('keyed_test_table')
+            self.assertEqual(col_info_dict, {0: ('first_column', 'TEXT'), 1: ('second_column', 'INTEGER'), 2: ('third_column', 'TEXT')})
+            self.assertIsNotNone(schema_registry.get_table_column_info_dict('test_table')[0])
+            stored_signature_dict, error = schema_registry.get_stored_signatures()
+            self.assertEqual(set(stored_signature_dict), {'test_table', 'keyed_test_table'})
+            conn.close()
+
+            # A NEW PROCESS WITH AN UNCHANGED SCHEMA SKIPS EVERY TABLE
+            conn = sqlite3.connect(db_path)
+            schema_registry = DBSchemaRegistry(conn)
+            statements = []
+            # ONLY COUNT TOP LEVEL STATEMENTS, NOT THE PRAGMAS THEY RUN INTERNALLY
+            conn.set_trace_callback(lambda sql: statements.append(sql) if not sql.startswith('--') else None)
+            table_interface = DBTableInterface(conn, TestTableInfo.table_info_dict())
+            table_interface.db_table_init(schema_registry)
+            self.assertEqual(len(statements), 2)
+
+            # BUMPING USER_VERSION FORCES A RECHECK
+            conn.execute("PRAGMA user_version = 1")
+            statements.clear()
+            table_interface.db_table_init(schema_registry)
+            self.assertGreater(len(statements), 2)
+            conn.close()
+
+    def test_iter_all_from_missing_table(self):
+        row_iter, error = db_iter_all_from_table(self.db_conn, {TABLE_NAME_KEY: 'missing', COLUMN_MAP_KEY: {}})
+        self.assertIsNotNone(error)
+        self.assertEqual(list(row_iter), [])
+
+    def test_query_builder(self):
+        self.table_interface.db_insert_many(get_test_rows(100))
+        base_query = self.table_interface.query().select('second_column', 'first_column')
+
+        query = base_query.where('second_column', QueryOperators.GE, 10).where('second_column', QueryOperators.LT, 50)
+        query = query.where_in('third_column', ['val_12', 'val_13', 'val_14', 'val_60']).order_by('second_column', descending=True)
+        rows, error = self.table_interface.db_select_query(query, RowFormats.TUPLE)
+        self.assertIsNone(error)
+        self.assertEqual(rows, [(14, 'key_14'), (13, 'key_13'), (12, 'key_12')])
+        rows, error = self.table_interface.db_select_query(query.limit(1, 1), RowFormats.RECORD)
+        self.assertEqual([(record.second_column, record.first_column) for record in rows], [(13, 'key_13')])
+        rows, error = self.table_interface.db_select_query(query.offset(2))
+        self.assertEqual(rows, {0: {0: 12, 1: 'key_12'}})
+
+        # SAME SHAPE, DIFFERENT VALUES, SAME STATEMENT
+        other_query = base_query.where('second_column', QueryOperators.GE, 0).where('second_column', QueryOperators.LT, 1)
+        other_query = other_query.where_in('third_column', ['a', 'b', 'c', 'd']).order_by('second_column', descending=True)
+        self.assertIs(db_compile_query(query)[0], db_compile_query(other_query)[0])
+
+        rows, error = self.table_interface.db_select_query(base_query.where('missing_column', QueryOperators.EQ, 1))
+        self.assertIsNotNone(error)
+        rows, error = self.table_interface.db_select_query(base_query.where('second_column', 'BETWEEN', 1))
+        self.assertIsNotNone(error)
+
+    def test_aggregates(self):
+        self.table_interface.db_insert_many((('key_{}'.format(x), x, 'group_{}'.format(x % 3)) for x in range(10)))
+
+        self.assertEqual(self.table_interface.db_count(), (10, None))
+        where_query = self.table_interface.query().where('third_column', QueryOperators.EQ, 'group_0')
+        self.assertEqual(self.table_interface.db_count(where_query), (4, None))
+        self.assertEqual(self.table_interface.db_exists('key_3'), (True, None))
+        self.assertEqual(self.table_interface.db_exists('key_30'), (False, None))
+        self.assertEqual(self.table_interface.db_sum('second_column'), (45, None))
+        self.assertEqual(self.table_interface.db_sum('second_column', where_query), (18, None))
+        self.assertEqual(self.table_interface.db_min('second_column'), (0, None))
+        self.assertEqual(self.table_interface.db_max('second_column'), (9, None))
+        self.assertEqual(self.table_interface.db_avg('second_column'), (4.5, None))
+        self.assertEqual(self.table_interface.db_max('second_column', where_query.where('second_column', QueryOperators.GT, 100)), (None, None))
+        # PAGING OF THE WHERE QUERY IS IGNORED, AN OFFSET PAST THE ONE AGGREGATE ROW USED TO RAISE
+        self.assertEqual(self.table_interface.db_count(where_query.limit(1, 5)), (4, None))
+        self.assertEqual(self.table_interface.db_sum('second_column', where_query.order_by('second_column').limit(2)), (18, None))
+
+        aggregates = [(AggregateFunctions.COUNT, None), (AggregateFunctions.SUM, 'second_column')]
+        rows, error = self.table_interface.db_group_by(['third_column'], aggregates, row_format=RowFormats.RECORD)
+        self.assertIsNone(error)
+        self.assertEqual([(row.third_column, row.count, row.sum_second_column) for row in rows],
+                         [('group_0', 4, 18), ('group_1', 3, 12), ('group_2', 3, 15)])
+
+        value, error = self.table_interface.db_sum('missing_column')
+        self.assertIsNotNone(error)
+        value, error = db_aggregate(self.db_conn, TestTableInfo, AggregateFunctions.SUM, None)
+        self.assertIsNotNone(error)
+
+    def test_upsert_and_replace(self):
+        table_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_test_rows(3))
+
+        data, error = table_interface.db_upsert(('key_1', 100, 'changed'))
+        self.assertIsNone(error)
+        data, error = table_interface.db_upsert(('key_5', 5, 'val_5'))
+        self.assertIsNone(error)
+        data, error = table_interface.db_upsert(('key_2', 200, 'ignored'), update_column_names=['second_column'])
+        self.assertIsNone(error)
+        rows, error = table_interface.db_select_all_from_table()
+        self.assertEqual(sorted(rows), [('key_0', 0, 'val_0'), ('key_1', 100, 'changed'), ('key_2', 200, 'val_2'), ('key_5', 5, 'val_5')])
+
+        stats, error = table_interface.db_upsert_many([('key_0', 0, 'bulk'), ('key_6', 6, 'val_6')], update_column_names=[])
+        self.assertIsNone(error)
+        self.assertEqual(stats[ROW_COUNT_KEY], 2)
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_0'), ([('key_0', 0, 'val_0')], None))
+        self.assertEqual(table_interface.db_count(), (5, None))
+
+        # CONFLICTS ON THE UNIQUE (second_column, third_column) KEY REPLACE THAT ROW TOO
+        data, error = table_interface.db_replace_into_table(('key_9', 5, 'val_5'))
+        self.assertIsNone(error)
+        self.assertEqual(table_interface.db_exists('key_5'), (False, None))
+        stats, error = table_interface.db_replace_many([('key_9', 9, 'val_9'), ('key_6', 60, 'replaced')])
+        self.assertIsNone(error)
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_6'), ([('key_6', 60, 'replaced')], None))
+
+        data, error = self.table_interface.db_upsert(('key_1', 1, 'val_1'))
+        self.assertIsNotNone(error)
+        data, error = table_interface.db_upsert(('key_1', 1, 'val_1'), update_column_names=['missing_column'])
+        self.assertIsNotNone(error)
+
+    def test_upsert_on_other_unique_key_clears_cache(self):
+        table_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=10)
+        table_interface.db_create_table()
+        table_interface.db_insert_into_table(('key_a', 1, 'x@'))
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_a'), ([('key_a', 1, 'x@')], None))
+
+        # THE CONFLICT ON (second_column, third_column) REWRITES THE ROW OF key_a INTO key_b
+        data, error = table_interface.db_upsert(('key_b', 1, 'x@'), update_column_names=['first_column'],
+                                                conflict_column_names=('second_column', 'third_column'))
+        self.assertIsNone(error)
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_a'), ([], None))
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_b'), ([('key_b', 1, 'x@')], None))
+
+    def test_select_and_delete_where_first_column_in(self):
+        self.table_interface.db_insert_many(get_test_rows(100))
+        keys = ['key_{}'.format(x) for x in range(0, 100, 3)] + ['missing', 'key_0']
+
+        rows, error = self.table_interface.db_select_where_first_column_in(keys, RowFormats.TUPLE, chunk_size=7)
+        self.assertIsNone(error)
+        self.assertEqual(sorted(rows), sorted(('key_{}'.format(x), x, 'val_{}'.format(x)) for x in range(0, 100, 3)))
+        rows, error = self.table_interface.db_select_where_first_column_in(['key_1', 'key_2'], RowFormats.COLUMNS)
+        self.assertEqual(sorted(rows[1]), [1, 2])
+        rows, error = self.table_interface.db_select_where_first_column_in(['key_1'])
+        self.assertEqual(rows, {0: {0: 'key_1', 1: 1, 2: 'val_1'}})
+        row_iter, error = self.table_interface.db_iter_where_first_column_in([])
+        self.assertEqual(list(row_iter), [])
+
+        stats, error = self.table_interface.db_delete_where_first_column_in(keys, chunk_size=7)
+        self.assertIsNone(error)
+        self.assertEqual(stats[ROW_COUNT_KEY], 34)
+        self.assertEqual(self.table_interface.db_count(), (66, None))
+
+    def test_where_first_column_in_key_table(self):
+        row_count = DEF_IN_KEY_TABLE_MIN_KEYS + 10
+        self.table_interface.db_insert_many(get_test_rows(row_count))
+        # MISSING KEYS TAKE THE KEY COUNT OVER DEF_IN_KEY_TABLE_MIN_KEYS
+        keys = ['key_{}'.format(x) for x in range(1, row_count, 2)] + ['key_0'] + \
+            ['missing_{}'.format(x) for x in range(row_count // 2)]
+        self.assertGreater(len(keys), DEF_IN_KEY_TABLE_MIN_KEYS)
+
+        row_iter, error = self.table_interface.db_iter_where_first_column_in(keys)
+        self.assertIsNone(error)
+        self.assertEqual(len(list(row_iter)), row_count // 2 + 1)
+
+        # LOADING THE KEY TABLE JOINS A TRANSACTION THE CALLER OPENED INSTEAD OF COMMITTING IT
+        self.db_conn.execute("INSERT INTO test_table VALUES ('uncommitted', -1, 'val')")
+        row_iter, error = self.table_interface.db_iter_where_first_column_in(keys + ['uncommitted'])
+        self.assertEqual(len(list(row_iter)), row_count // 2 + 2)
+        self.assertTrue(self.db_conn.in_transaction)
+        self.db_conn.rollback()
+        self.assertEqual(self.table_interface.db_count(), (row_count, None))
+
+        stats, error = self.table_interface.db_delete_where_first_column_in(keys)
+        self.assertIsNone(error)
+        self.assertEqual(self.table_interface.db_count(), (row_count // 2 - 1, None))
+        self.assertFalse(self.db_conn.in_transaction)
+
+    def test_list_codecs(self):
+        self.assertEqual(db_list_to_string(['a', 1, 2.5]), 'a**1**2.5')
+        self.assertEqual(db_string_to_list('a**1**2.5'), ['a', '1', '2.5'])
+        self.assertEqual(db_string_to_list(db_list_to_string([])), [])
+
+        rows = [('key_0', 0, ['a', 'b']), ('key_1', 1, []), ('key_2', 2, None)]
+        for list_format in (ListFormats.SEPARATOR, ListFormats.JSON):
+            self.table_interface.db_delete_all_from_table()
+            self.table_interface.db_insert_many(db_encode_list_columns(rows, [2], list_format))
+            stored_rows, error = self.table_interface.db_select_all_from_table(RowFormats.TUPLE)
+            self.assertEqual(db_decode_list_columns(stored_rows, [2], list_format), rows)
+            stored_columns, error = self.table_interface.db_select_all_from_table(RowFormats.COLUMNS)
+            self.assertEqual(db_decode_list_columns(stored_columns, [2], list_format)[2], [['a', 'b'], [], None])
+
+        codec = LIST_CODECS[ListFormats.JSON]
+        self.assertEqual(codec.decode(codec.encode(['a**b', 1, None])), ['a**b', 1, None])
+
+        # BLANK VALUES WRITTEN BY db_alter_table DECODE TO EMPTY LISTS, MALFORMED ONES FAIL INSTEAD OF SHIFTING ROWS
+        self.assertEqual(codec.decode_many(['[1]', '', None, '[2,3]']), [[1], [], None, [2, 3]])
+        with self.assertRaises(ValueError):
+            codec.decode_many(['[1],[2]', '[3]'])
+
+        # DICT ROWS AND EMPTY RESULTS
+        stored_dict, error = self.table_interface.db_select_all_from_table()
+        self.assertEqual(db_decode_list_columns(stored_dict, [2], ListFormats.JSON),
+                         {0: {0: 'key_0', 1: 0, 2: ['a', 'b']}, 1: {0: 'key_1', 1: 1, 2: []}, 2: {0: 'key_2', 1: 2, 2: None}})
+        self.table_interface.db_delete_all_from_table()
+        for row_format, empty_rows in ((RowFormats.DICT, {}), (RowFormats.TUPLE, []), (RowFormats.COLUMNS, {0: [], 1: [], 2: []})):
+            stored_rows, error = self.table_interface.db_select_all_from_table(row_format)
+            self.assertEqual(db_decode_list_columns(stored_rows, [2], ListFormats.JSON), empty_rows)
+
+    def test_list_child_table(self):
+        tags = DBListChildTable(TestTableInfo, 'tags')
+        data, error = tags.db_create_table(self.db_conn)
+        self.assertIsNone(error)
+
+        stats, error = tags.db_write_lists(self.db_conn, [('key_0', ['b', 'a']), ('key_1', ['a']), ('key_2', ['c'])])
+        self.assertIsNone(error)
+        stats, error = tags.db_write_lists(self.db_conn, [('key_2', ['c', 'a', 'c'])])
+        self.assertIsNone(error)
+        list_dict, error = tags.db_read_lists(self.db_conn, ['key_0', 'key_2', 'key_9'])
+        self.assertEqual(list_dict, {'key_0': ['b', 'a'], 'key_2': ['c', 'a', 'c'], 'key_9': []})
+        keys, error = tags.db_select_keys_containing(self.db_conn, 'a')
+        self.assertEqual(sorted(keys), ['key_0', 'key_1', 'key_2'])
+
+        stats, error = tags.db_delete_lists(self.db_conn, ['key_0'])
+        self.assertEqual(stats[ROW_COUNT_KEY], 2)
+        self.assertFalse(self.db_conn.in_transaction)
+
+    def test_blob_streaming(self):
+        blob_table_info = {
+            TABLE_NAME_KEY: 'blob_table',
+            COLUMN_MAP_KEY: {0: ('name', ColumnTypes.TEXT), 1: ('data', ColumnTypes.BLOB)},
+        }
+        table_interface = DBTableInterface(self.db_conn, blob_table_info, RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_into_table(('file_1', None))
+        payload = bytes(range(256)) * 1000
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            in_path = os.path.join(temp_dir, 'in.bin')
+            out_path = os.path.join(temp_dir, 'out.bin')
+            with open(in_path, 'wb') as in_file:
+                in_file.write(payload)
+
+            with open(in_path, 'rb') as in_file:
+                byte_count, error = table_interface.db_write_blob_from_file('file_1', 'data', in_file, buffer_size=4096)
+            self.assertIsNone(error)
+            self.assertEqual(byte_count, len(payload))
+            self.assertFalse(self.db_conn.in_transaction)
+
+            with open(out_path, 'wb') as out_file:
+                byte_count, error = table_interface.db_copy_blob_to_file('file_1', 'data', out_file, buffer_size=5000)
+            self.assertIsNone(error)
+            with open(out_path, 'rb') as out_file:
+                self.assertEqual(out_file.read(), payload)
+
+        blob, error = table_interface.db_open_blob('file_1', 'data')
+        with blob:
+            blob.seek(256)
+            self.assertEqual(blob.read(3), bytes([0, 1, 2]))
+            self.assertEqual(len(blob), len(payload))
+
+        data, error = table_interface.db_preallocate_blob('file_1', 'data', 10)
+        self.assertEqual(table_interface.db_select_all_from_table(), ([('file_1', bytes(10))], None))
+        blob, error = table_interface.db_open_blob('missing', 'data')
+        self.assertIsNotNone(error)
+        self.assertEqual(table_interface.db_open_blob('file_1', 'data; DROP TABLE blob_table')[0], None)
+        data, error = table_interface.db_preallocate_blob('file_1', 'missing_column', 10)
+        self.assertIn('missing_column', error)
+
+        # A FILE SHORTER THAN size FAILS, STORES NOTHING AND REPORTS NO BYTES
+        byte_count, error = table_interface.db_write_blob_from_file('file_1', 'data', io.BytesIO(b'short'), size=100)
+        self.assertEqual(byte_count, 0)
+        self.assertIsNotNone(error)
+        self.assertEqual(table_interface.db_select_all_from_table(), ([('file_1', bytes(10))], None))
+
+    def test_select_columns_as_arrays(self):
+        self.table_interface.db_insert_many(get_test_rows(2500))
+
+        array_dict, error = self.table_interface.db_select_columns_as_arrays(use_numpy=False)
+        self.assertIsNone(error)
+        self.assertEqual(array_dict['second_column'], array.array('q', range(2500)))
+        self.assertEqual(array_dict['third_column'][:2], ['val_0', 'val_1'])
+
+        where_query = self.table_interface.query().where('second_column', QueryOperators.LT, 3)
+        array_dict, error = self.table_interface.db_select_columns_as_arrays(['second_column'], where_query, use_numpy=False)
+        self.assertEqual(list(array_dict), ['second_column'])
+        self.assertEqual(list(array_dict['second_column']), [0, 1, 2])
+
+        # SQLITE DOES NOT ENFORCE COLUMN TYPES, A NULL TURNS THE COLUMN INTO A LIST
+        self.table_interface.db_insert_into_table(('key_null', None, 'val_null'))
+        array_dict, error = self.table_interface.db_select_columns_as_arrays(['second_column'], use_numpy=False)
+        self.assertEqual(array_dict['second_column'], list(range(2500)) + [None])
+
+        if numpy is None:
+            array_dict, error = self.table_interface.db_select_columns_as_arrays(use_numpy=True)
+            self.assertIsNotNone(error)
+
+    def test_statement_instrumentation(self):
+        self.table_interface.db_insert_many(get_test_rows(10))
+        self.assertEqual(db_get_statement_stats(), {})
+
+        db_enable_instrumentation(slow_query_sec=0, explain_slow_queries=True)
+        try:
+            with self.assertLogs(level=logging.WARNING) as log_context:
+                for x in range(5):
+                    self.table_interface.db_select_all_where_first_column_equals('key_{}'.format(x))
+                self.table_interface.db_debug_test_statement('SELECT * FROM missing_table')
+            self.assertIn('SCAN test_table', log_context.output[0])
+
+            statement_stats = db_get_statement_stats()
+            select_stats = statement_stats['SELECT * FROM test_table WHERE first_column = ?']
+            self.assertEqual(select_stats[STATEMENT_COUNT_KEY], 5)
+            self.assertEqual(select_stats[STATEMENT_ROW_COUNT_KEY], 5)
+            self.assertLessEqual(select_stats[STATEMENT_P50_SEC_KEY], select_stats[STATEMENT_P99_SEC_KEY])
+            self.assertEqual(statement_stats['SELECT * FROM missing_table'][STATEMENT_ERROR_COUNT_KEY], 1)
+        finally:
+            db_disable_instrumentation()
+        self.assertEqual(db_get_statement_stats(), {})
+
+    def test_row_cache(self):
+        table_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=2)
+        table_interface.db_insert_many(get_test_rows(5))
+
+        for x in range(3):
+            rows, error = table_interface.db_select_all_where_first_column_equals('key_1')
+            self.assertEqual(rows, [('key_1', 1, 'val_1')])
+        stats = table_interface.row_cache.get_stats()
+        self.assertEqual((stats[CACHE_HITS_KEY], stats[CACHE_MISSES_KEY]), (2, 1))
+
+        # OWN WRITES INVALIDATE THEIR KEY
+        table_interface.db_update_where_first_column_equals(('key_1', 100, 'changed'), 'key_1')
+        rows, error = table_interface.db_select_all_where_first_column_equals('key_1')
+        self.assertEqual(rows, [('key_1', 100, 'changed')])
+
+        # LEAST RECENTLY USED KEY IS EVICTED
+        table_interface.db_select_all_where_first_column_equals('key_2')
+        table_interface.db_select_all_where_first_column_equals('key_3')
+        stats = table_interface.row_cache.get_stats()
+        self.assertEqual((stats[CACHE_EVICTIONS_KEY], stats[CACHE_SIZE_KEY]), (1, 2))
+
+        # READS INSIDE A TRANSACTION BYPASS THE CACHE
+        with table_interface.transaction():
+            table_interface.db_delete_where_first_column_equals('key_3')
+            self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_3'), ([], None))
+        self.assertEqual(table_interface.db_select_all_where_first_column_equals('key_3'), ([], None))
+
+        ttl_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=2, cache_ttl_sec=0)
+        ttl_interface.db_select_all_where_first_column_equals('key_2')
+        ttl_interface.db_select_all_where_first_column_equals('key_2')
+        self.assertEqual(ttl_interface.row_cache.get_stats()[CACHE_EXPIRATIONS_KEY], 1)
+
+    def test_row_cache_sees_same_connection_writes(self):
+        cached_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=10)
+        cached_interface.db_insert_into_table(('x', 1, 'val'))
+        self.assertEqual(cached_interface.db_select_all_where_first_column_equals('x'), ([('x', 1, 'val')], None))
+
+        # WRITES BYPASSING THE CACHING INTERFACE ON ITS OWN CONNECTION
+        db_update_where_first_column_equals(self.db_conn, TestTableInfo.table_info_dict(), ('x', 2, 'val'), 'x')
+        self.assertEqual(cached_interface.db_select_all_where_first_column_equals('x'), ([('x', 2, 'val')], None))
+        other_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        other_interface.db_update_where_first_column_equals(('x', 3, 'val'), 'x')
+        self.assertEqual(cached_interface.db_select_all_where_first_column_equals('x'), ([('x', 3, 'val')], None))
+        self.assertEqual(cached_interface.row_cache.get_stats()[CACHE_HITS_KEY], 0)
+
+    def test_row_cache_sees_other_connections_writes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'test.db')
+            reader_conn = sqlite3.connect(db_path)
+            writer_conn = sqlite3.connect(db_path)
+            cached_interface = DBTableInterface(reader_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=10)
+            writer_interface = DBTableInterface(writer_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            writer_interface.db_create_table()
+            writer_interface.db_insert_many(get_test_rows(3))
+
+            self.assertEqual(cached_interface.db_select_all_where_first_column_equals('key_1'), ([('key_1', 1, 'val_1')], None))
+            writer_interface.db_update_where_first_column_equals(('key_1', 100, 'changed'), 'key_1')
+            self.assertEqual(cached_interface.db_select_all_where_first_column_equals('key_1'), ([('key_1', 100, 'changed')], None))
+            self.assertEqual(cached_interface.row_cache.get_stats()[CACHE_HITS_KEY], 0)
+            reader_conn.close()
+            writer_conn.close()
+
+    def test_change_feed(self):
+        table_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_test_rows(5))
+        self.assertEqual(table_interface.db_create_change_feed(), ([], None))
+        seq, error = table_interface.db_get_last_change_seq()
+        self.assertEqual((seq, error), (0, None))
+
+        table_interface.db_insert_into_table(('key_5', 5, 'val_5'))
+        table_interface.db_update_where_first_column_equals(('key_1', 100, 'changed'), 'key_1')
+        table_interface.db_update_where_first_column_equals(('key_1', 101, 'changed'), 'key_1')
+        table_interface.db_update_where_first_column_equals(('key_x', 2, 'val_2'), 'key_2')
+        table_interface.db_delete_where_first_column_equals('key_3')
+        table_interface.db_upsert(('key_6', 6, 'val_6'))
+        table_interface.db_delete_where_first_column_equals('key_6')
+
+        # ONE DELTA PER KEY, IN THE ORDER OF ITS LATEST CHANGE, WITH THE CURRENT ROWS
+        changes, error = table_interface.db_get_changes_since(seq)
+        self.assertIsNone(error)
+        self.assertEqual([(change.op, change.key, change.rows) for change in changes[CHANGES_KEY]], [
+            (ChangeOps.INSERT, 'key_5', [('key_5', 5, 'val_5')]),
+            (ChangeOps.UPDATE, 'key_1', [('key_1', 101, 'changed')]),
+            (ChangeOps.DELETE, 'key_2', []),
+            (ChangeOps.UPDATE, 'key_x', [('key_x', 2, 'val_2')]),
+            (ChangeOps.DELETE, 'key_3', []),
+            (ChangeOps.DELETE, 'key_6', []),
+        ])
+        record_interface = DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict(), RowFormats.RECORD)
+        record_changes, error = record_interface.db_get_changes_since(seq)
+        self.assertIsNone(error)
+        self.assertEqual([(change.key, [tuple(row) for row in change.rows]) for change in record_changes[CHANGES_KEY]],
+                         [(change.key, change.rows) for change in changes[CHANGES_KEY]])
+        self.assertEqual(record_changes[CHANGES_KEY][1].rows[0].second_column, 101)
+        seq = changes[LAST_SEQ_KEY]
+
+        # A REPLACE CONFLICTING ON (second_column, third_column) LOGS THE DELETE OF THE OTHER KEY'S ROW
+        table_interface.db_replace_into_table(('key_r', 4, 'val_4'))
+        changes, error = table_interface.db_get_changes_since(seq)
+        self.assertEqual([(change.op, change.key) for change in changes[CHANGES_KEY]],
+                         [(ChangeOps.DELETE, 'key_4'), (ChangeOps.INSERT, 'key_r')])
+        self.assertEqual(self.db_conn.execute('PRAGMA recursive_triggers').fetchone()[0], 0)
+        seq = changes[LAST_SEQ_KEY]
+        self.assertEqual(table_interface.db_get_last_change_seq(), (seq, None))
+        self.assertEqual(table_interface.db_get_changes_since(seq)[0], {CHANGES_KEY: [], LAST_SEQ_KEY: seq})
+
+        # BATCHED READS PICK UP WHERE THE LAST ONE ENDED
+        table_interface.db_insert_many(('key_b{}'.format(x), 1000 + x, 'val') for x in range(25))
+        seen_keys = []
+        changes, error = table_interface.db_get_changes_since(seq, limit=10)
+        while changes[CHANGES_KEY]:
+            seen_keys.extend(change.key for change in changes[CHANGES_KEY])
+            changes, error = table_interface.db_get_changes_since(changes[LAST_SEQ_KEY], limit=10)
+        self.assertEqual(seen_keys, ['key_b{}'.format(x) for x in range(25)])
+
+        # COMPACTED ENTRIES CAN NOT BE READ ANYMORE
+        self.assertEqual(table_interface.db_compact_changes(keep_last=5), (seq + 20, None))
+        self.assertIsNotNone(table_interface.db_get_changes_since(seq)[1])
+        self.assertEqual(len(table_interface.db_get_changes_since(seq + 20)[0][CHANGES_KEY]), 5)
+        self.assertEqual(table_interface.db_compact_changes(), (5, None))
+        self.assertEqual(table_interface.db_get_changes_since(seq + 25)[0][CHANGES_KEY], [])
+        self.assertIsNotNone(table_interface.db_get_changes_since(seq)[1])
+
+        self.assertEqual(table_interface.db_drop_change_feed(), ([], None))
+        self.assertFalse(db_check_table_exists(self.db_conn, 'keyed_test_table__changes')[0])
+
+    def test_change_feed_survives_alter_table(self):
+        table_interface = DBTableInterface(self.db_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_insert_many(get_test_rows(3))
+        table_interface.db_create_change_feed()
+
+        class ReorderedTableInfo(TestTableInfo):
+            table_columns_dict = {
+                0: AbstractTableColumn('first_column', ColumnTypes.TEXT, 20),
+                1: AbstractTableColumn('third_column', ColumnTypes.TEXT, 20),
+                2: AbstractTableColumn('second_column', ColumnTypes.INTEGER, 20),
+            }
+
+        reordered_interface = DBTableInterface(self.db_conn, ReorderedTableInfo.table_info_dict(), RowFormats.TUPLE)
+        self.assertIsNone(reordered_interface.db_alter_table()[1])
+        reordered_interface.db_delete_where_first_column_equals('key_0')
+        # WITHOUT A PRIMARY KEY A DELETE OF ONE OF TWO ROWS OF A KEY IS AN UPDATE OF THAT KEY
+        reordered_interface.db_insert_many([('key_1', 'dup', 1), ('key_1', 'dup', 2)])
+        reordered_interface.db_update_where_first_column_equals(('key_1', 'only', 9), 'key_1')
+        self.db_conn.execute("DELETE FROM test_table WHERE rowid = (SELECT max(rowid) FROM test_table)")
+        self.db_conn.commit()
+        changes, error = reordered_interface.db_get_changes_since()
+        self.assertIsNone(error)
+        self.assertEqual([(change.op, change.key, change.rows) for change in changes[CHANGES_KEY]], [
+            (ChangeOps.DELETE, 'key_0', []),
+            (ChangeOps.UPDATE, 'key_1', [('key_1', 'only', 9), ('key_1', 'only', 9)]),
+        ])
+
+    def test_search(self):
+        class SearchTableInfo(KeyedTestTableInfo):
+            table_name = "SEARCH_TABLE"
+            table_searchable_columns = ['first_column', 'third_column']
+
+        table_interface = DBTableInterface(self.db_conn, SearchTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many([
+            ('apple', 1, 'red fruit with a core'),
+            ('pear', 2, 'green fruit, sweet'),
+            ('carrot', 3, 'orange root, crunchy'),
+            ('tomato', 4, 'red fruit or vegetable'),
+        ])
+
+        rows, error = table_interface.db_search('fruit')
+        self.assertIsNone(error)
+        self.assertEqual(sorted(row[0] for row in rows), ['apple', 'pear', 'tomato'])
+        rows, error = table_interface.db_search('red AND fruit', limit=1)
+        self.assertEqual(len(rows), 1)
+        self.assertIn(rows[0][0], ('apple', 'tomato'))
+        rows, error = table_interface.db_search('first_column: carr*')
+        self.assertEqual(rows, [('carrot', 3, 'orange root, crunchy')])
+        self.assertIsNotNone(table_interface.db_search('"unbalanced')[1])
+        rows, error = table_interface.db_search(db_get_search_phrase('fruit, "sweet'))
+        self.assertEqual(rows, [('pear', 2, 'green fruit, sweet')])
+
+        # TRIGGERS KEEP THE INDEX IN SYNC WITH UPDATES AND DELETES
+        table_interface.db_update_where_first_column_equals(('pear', 2, 'yellow'), 'pear')
+        table_interface.db_delete_where_first_column_equals('apple')
+        rows, error = table_interface.db_search('fruit')
+        self.assertEqual([row[0] for row in rows], ['tomato'])
+        self.assertEqual(table_interface.db_search('yellow')[0], [('pear', 2, 'yellow')])
+
+        # ROWS DELETED BY A REPLACE ON ANOTHER UNIQUE KEY LEAVE THE INDEX TOO
+        table_interface.db_replace_into_table(('grape', 4, 'red fruit or vegetable'))
+        table_interface.db_replace_many([('melon', 2, 'yellow')])
+        self.assertEqual(sorted(row[0] for row in table_interface.db_search('red OR yellow')[0]), ['grape', 'melon'])
+        self.db_conn.execute("INSERT INTO search_table__search (search_table__search, rank) VALUES ('integrity-check', 1)")
+        self.assertEqual(self.db_conn.execute("PRAGMA recursive_triggers").fetchone()[0], 0)
+
+        # A REBUILD REPAIRS WRITES THE TRIGGERS MISSED
+        self.db_conn.execute("DROP TRIGGER search_table__search_insert")
+        table_interface.db_insert_into_table(('plum', 5, 'purple fruit'))
+        self.assertEqual(table_interface.db_search('purple')[0], [])
+        self.assertEqual(table_interface.db_rebuild_search_index(optimize=True), ([], None))
+        self.assertEqual(table_interface.db_search('purple')[0], [('plum', 5, 'purple fruit')])
+
+        # TABLE INIT ADDS THE INDEX TO AN EXISTING TABLE, A REBUILDING MIGRATION KEEPS IT WORKING
+        table_interface.db_drop_table()
+        self.assertFalse(db_check_table_exists(self.db_conn, 'search_table__search')[0])
+        DBTableInterface(self.db_conn, KeyedTestTableInfo.table_info_dict()).db_create_table()
+        self.db_conn.execute("ALTER TABLE keyed_test_table RENAME TO search_table")
+        self.db_conn.execute("INSERT INTO search_table VALUES ('fig', 6, 'brown fruit')")
+        self.db_conn.commit()
+        table_interface.db_table_init()
+        self.assertEqual(table_interface.db_search('fruit')[0], [('fig', 6, 'brown fruit')])
+
+        class ReorderedSearchTableInfo(SearchTableInfo):
+            table_columns_dict = {
+                0: AbstractTableColumn('first_column', ColumnTypes.TEXT, 20),
+                1: AbstractTableColumn('third_column', ColumnTypes.TEXT, 20),
+                2: AbstractTableColumn('second_column', ColumnTypes.INTEGER, 20),
+            }
+            table_searchable_columns = ['third_column']
+
+        reordered_interface = DBTableInterface(self.db_conn, ReorderedSearchTableInfo.table_info_dict(), RowFormats.TUPLE)
+        reordered_interface.db_table_init()
+        self.assertEqual(reordered_interface.db_search('fruit')[0], [('fig', 'brown fruit', 6)])
+        self.assertEqual(reordered_interface.db_search('fig')[0], [])
+        reordered_interface.db_insert_into_table(('kiwi', 'hairy fruit', 7))
+        self.assertEqual(len(reordered_interface.db_search('fruit')[0]), 2)
+        self.assertIsNotNone(self.table_interface.db_search('fruit')[1])
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'test.db')
+            writer_conn = sqlite3.connect(db_path)
+            writer_interface = DBTableInterface(writer_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            writer_interface.db_create_table()
+            writer_interface.db_insert_many(get_test_rows(100))
+
+            progress_calls = []
+            snapshot = DBSnapshot(db_path, pages=1, progress=lambda status, remaining, total: progress_calls.append(remaining))
+            snapshot_interface = snapshot.get_table_interface(TestTableInfo.table_info_dict(), RowFormats.TUPLE, cache_size=10)
+            self.assertGreater(len(progress_calls), 1)
+            self.assertEqual(len(snapshot_interface.db_select_all_from_table()[0]), 100)
+            self.assertEqual(snapshot_interface.db_select_all_where_first_column_equals('key_1'), ([('key_1', 1, 'val_1')], None))
+
+            # THE SNAPSHOT IS READ ONLY AND ONLY CHANGES ON REFRESH
+            data, error = snapshot_interface.db_insert_into_table(('key_x', 0, 'val_x'))
+            self.assertIsNotNone(error)
+            self.assertEqual(snapshot.refresh(), (False, None))
+            writer_interface.db_update_where_first_column_equals(('key_1', 100, 'changed'), 'key_1')
+            writer_interface.db_insert_many(get_test_rows(1))
+            self.assertEqual(snapshot_interface.db_select_all_where_first_column_equals('key_1'), ([('key_1', 1, 'val_1')], None))
+            self.assertEqual(snapshot.refresh(), (True, None))
+            self.assertEqual(snapshot_interface.db_select_all_where_first_column_equals('key_1'), ([('key_1', 100, 'changed')], None))
+            self.assertEqual(len(snapshot_interface.db_select_all_from_table()[0]), 101)
+            snapshot.close()
+
+            # A SHARED CONNECTION SOURCE SEES ITS OWN WRITES TOO
+            snapshot = DBSnapshot(writer_conn)
+            snapshot_interface = snapshot.get_table_interface(TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            writer_interface.db_delete_where_first_column_equals('key_1')
+            self.assertEqual(snapshot.refresh(), (True, None))
+            self.assertEqual(snapshot_interface.db_select_all_where_first_column_equals('key_1'), ([], None))
+            snapshot.close()
+            writer_conn.close()
+
+    def test_query_keyset_pagination(self):
+        self.table_interface.db_insert_many((('key_{}'.format(x), x % 10, 'val_{}'.format(x)) for x in range(95)))
+
+        # AFTER DEFAULTS TO THE FIRST COLUMN ORDER, THE FIRST PAGE HAS TO USE THE SAME ORDER
+        page_query = self.table_interface.query().limit(40)
+        self.assertEqual(page_query.after('key_0').get_order_columns(), (('first_column', False),))
+        page_query = page_query.order_by('first_column')
+        seen_keys = []
+        rows, error = self.table_interface.db_select_query(page_query, RowFormats.TUPLE)
+        while rows:
+            seen_keys.extend(row[0] for row in rows)
+            rows, error = self.table_interface.db_select_query(page_query.after(rows[-1][0]), RowFormats.TUPLE)
+        self.assertIsNone(error)
+        self.assertEqual(seen_keys, sorted('key_{}'.format(x) for x in range(95)))
+
+        # MIXED DIRECTIONS
+        page_query = self.table_interface.query().order_by('second_column', descending=True).order_by('first_column').limit(7)
+        seen_rows = []
+        row_iter, error = self.table_interface.db_iter_query(page_query)
+        rows = list(row_iter)
+        while rows:
+            seen_rows.extend(rows)
+            row_iter, error = self.table_interface.db_iter_query(page_query.after(rows[-1][1], rows[-1][0]))
+            rows = list(row_iter)
+        self.assertEqual(seen_rows, sorted(seen_rows, key=lambda row: (-row[1], row[0])))
+        self.assertEqual(len(seen_rows), 95)
+
+        rows, error = self.table_interface.db_select_query(page_query.after('key_1'))
+        self.assertIsNotNone(error)
+
+
+if __name__ == '__main__':
+    unittest.main()
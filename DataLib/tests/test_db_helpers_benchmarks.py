@@ -0,0 +1,443 @@
+import array
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+from DataLib.db_async_helpers import *
+from DataLib.db_helpers import *
+from DataLib.tests.test_db_helpers import KeyedTestTableInfo, TestTableInfo, get_test_rows
+
+# ROW COUNT USED BY THE BENCHMARKS, SET DB_BENCH_ROW_COUNT=1000000 FOR THE FULL SIZE RUN
+BENCH_ROW_COUNT = int(os.environ.get('DB_BENCH_ROW_COUNT', 20000))
+# WALL CLOCK COMPARISONS ARE ONLY REPORTED, NOT ASSERTED, UNLESS DB_BENCH_ASSERT_TIMINGS=1 IS SET
+BENCH_ASSERT_TIMINGS = os.environ.get('DB_BENCH_ASSERT_TIMINGS', '0') == '1'
+
+
+def print_bench_results(title, results, unit):
+    print("\n{} ({} rows)".format(title, BENCH_ROW_COUNT))
+    for name, value in results.items():
+        print("    {:<24} {:>14.3f} {}".format(name, value, unit))
+
+
+def assert_faster(test_case, results, fast_name, slow_name):
+    if BENCH_ASSERT_TIMINGS:
+        test_case.assertLess(results[fast_name], results[slow_name])
+
+
+class TestDBHelpersBenchmarks(unittest.TestCase):
+    db_conn = None
+    table_interface = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.db_conn = sqlite3.connect(':memory:')
+        cls.table_interface = DBTableInterface(cls.db_conn, TestTableInfo.table_info_dict())
+        cls.table_interface.db_create_table()
+        cls.table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db_conn.close()
+
+    def test_row_format_memory(self):
+        size_mb_dict = {}
+        for row_format in ROW_FORMATS:
+            tracemalloc.start()
+            rows, error = self.table_interface.db_select_all_from_table(row_format)
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.assertIsNone(error)
+            self.assertEqual(len(rows) if row_format != RowFormats.COLUMNS else len(rows[0]), BENCH_ROW_COUNT)
+            size_mb_dict[row_format] = current / (1024 * 1024)
+            del rows
+
+        print_bench_results("select_all result size by row format", size_mb_dict, "MB")
+        for row_format in (RowFormats.TUPLE, RowFormats.RECORD, RowFormats.COLUMNS):
+            self.assertLess(size_mb_dict[row_format], size_mb_dict[RowFormats.DICT])
+
+
+class TestAggregateBenchmarks(unittest.TestCase):
+    group_count = 100
+
+    def test_aggregates_against_full_load(self):
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict())
+        table_interface.db_create_table()
+        table_interface.db_insert_many(('key_{}'.format(x), x, 'group_{}'.format(x % self.group_count)) for x in range(BENCH_ROW_COUNT))
+
+        def full_load():
+            # THE OLD WAY, LOAD THE DICT OF DICTS AND AGGREGATE IN PYTHON
+            row_dict, error = table_interface.db_select_all_from_table()
+            group_sums = {}
+            for col_dict in row_dict.values():
+                group_sums[col_dict[2]] = group_sums.get(col_dict[2], 0) + col_dict[1]
+            return len(row_dict), sum(col_dict[1] for col_dict in row_dict.values()), max(col_dict[1] for col_dict in row_dict.values()), group_sums
+
+        def pushdown():
+            rows, error = table_interface.db_group_by(['third_column'], [(AggregateFunctions.SUM, 'second_column')], row_format=RowFormats.TUPLE)
+            return table_interface.db_count()[0], table_interface.db_sum('second_column')[0], table_interface.db_max('second_column')[0], dict(rows)
+
+        results = {}
+        outputs = {}
+        for name, func in (('full load', full_load), ('pushdown', pushdown)):
+            start_time = time.perf_counter()
+            outputs[name] = func()
+            results[name] = time.perf_counter() - start_time
+        conn.close()
+
+        print_bench_results("count + sum + max + group_by({} groups)".format(self.group_count), results, "s")
+        self.assertEqual(outputs['full load'], outputs['pushdown'])
+        assert_faster(self, results, 'pushdown', 'full load')
+
+
+class TestChangeFeedBenchmarks(unittest.TestCase):
+    write_count = 100
+
+    def test_resync_after_writes(self):
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        start_time = time.perf_counter()
+        table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+        results = {'bulk insert': time.perf_counter() - start_time}
+
+        table_interface.db_delete_all_from_table()
+        table_interface.db_create_change_feed()
+        start_time = time.perf_counter()
+        table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+        results['bulk insert with feed'] = time.perf_counter() - start_time
+        table_interface.db_compact_changes()
+
+        mirror = {row[0]: row for row in table_interface.db_select_all_from_table()[0]}
+        seq, error = table_interface.db_get_last_change_seq()
+        for x in range(self.write_count):
+            table_interface.db_update_where_first_column_equals(('key_{}'.format(x), -x, 'changed'), 'key_{}'.format(x))
+
+        start_time = time.perf_counter()
+        reloaded = {row[0]: row for row in table_interface.db_select_all_from_table()[0]}
+        results['full reload'] = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        changes, error = table_interface.db_get_changes_since(seq)
+        for change in changes[CHANGES_KEY]:
+            if change.op == ChangeOps.DELETE:
+                mirror.pop(change.key, None)
+            else:
+                mirror[change.key] = change.rows[0]
+        results['changes since'] = time.perf_counter() - start_time
+        conn.close()
+
+        print_bench_results("resync a mirror after {} updates".format(self.write_count), results, "s")
+        self.assertEqual(mirror, reloaded)
+        assert_faster(self, results, 'changes since', 'full reload')
+
+
+class TestSearchBenchmarks(unittest.TestCase):
+    search_count = 20
+
+    def test_search_against_python_scan(self):
+        from DataLib.db_benchmarks import BenchSearchTableInfo, get_search_bench_rows
+
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, BenchSearchTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_search_bench_rows(BENCH_ROW_COUNT))
+        words = ['row{}'.format(x * (BENCH_ROW_COUNT // self.search_count)) for x in range(self.search_count)]
+
+        def python_scan():
+            # THE OLD WAY, LOAD EVERY ROW AND MATCH IN PYTHON
+            return [[row for row in table_interface.db_select_all_from_table()[0] if word in row[2].split()] for word in words]
+
+        def fts_search():
+            return [table_interface.db_search(word)[0] for word in words]
+
+        results = {}
+        outputs = {}
+        for name, func in (('python scan', python_scan), ('fts5 search', fts_search)):
+            start_time = time.perf_counter()
+            outputs[name] = func()
+            results[name] = (time.perf_counter() - start_time) / self.search_count * 1000
+        conn.close()
+
+        print_bench_results("word search ({} searches)".format(self.search_count), results, "ms/search")
+        self.assertEqual(outputs['python scan'], outputs['fts5 search'])
+        assert_faster(self, results, 'fts5 search', 'python scan')
+
+
+class TestWhereFirstColumnInBenchmarks(unittest.TestCase):
+    key_count = 10000
+
+    def test_in_list_against_per_key_loop(self):
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+        key_count = min(self.key_count, BENCH_ROW_COUNT)
+        keys = ['key_{}'.format(x) for x in range(0, BENCH_ROW_COUNT, BENCH_ROW_COUNT // key_count)][:key_count]
+
+        results = {}
+        start_time = time.perf_counter()
+        loop_rows = [row for key in keys for row in table_interface.db_select_all_where_first_column_equals(key)[0]]
+        results['select per key loop'] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        in_rows, error = table_interface.db_select_where_first_column_in(keys)
+        results['select IN chunks'] = time.perf_counter() - start_time
+        self.assertEqual(sorted(loop_rows), sorted(in_rows))
+
+        start_time = time.perf_counter()
+        for key in keys[:key_count // 2]:
+            table_interface.db_delete_where_first_column_equals(key)
+        results['delete per key loop'] = (time.perf_counter() - start_time) * 2
+        start_time = time.perf_counter()
+        stats, error = table_interface.db_delete_where_first_column_in(keys[key_count // 2:])
+        results['delete IN chunks'] = (time.perf_counter() - start_time) * 2
+        self.assertEqual(table_interface.db_count(), (BENCH_ROW_COUNT - key_count, None))
+        conn.close()
+
+        print_bench_results("{} keys by first column".format(key_count), results, "s")
+        assert_faster(self, results, 'select IN chunks', 'select per key loop')
+
+
+class TestColumnArrayBenchmarks(unittest.TestCase):
+
+    def test_arrays_against_dict_path(self):
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, TestTableInfo.table_info_dict())
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+
+        results = {}
+        start_time = time.perf_counter()
+        # THE OLD WAY, DICT OF DICTS THEN A PYTHON LOOP PER COLUMN
+        row_dict, error = table_interface.db_select_all_from_table()
+        dict_arrays = {
+            'second_column': array.array('q', (col_dict[1] for col_dict in row_dict.values())),
+            'third_column': [col_dict[2] for col_dict in row_dict.values()],
+        }
+        results['dict path'] = time.perf_counter() - start_time
+        del row_dict
+
+        start_time = time.perf_counter()
+        array_dict, error = table_interface.db_select_columns_as_arrays(['second_column', 'third_column'], use_numpy=False)
+        results['array.array'] = time.perf_counter() - start_time
+        self.assertEqual(array_dict, dict_arrays)
+
+        if numpy is not None:
+            start_time = time.perf_counter()
+            array_dict, error = table_interface.db_select_columns_as_arrays(['second_column', 'third_column'], use_numpy=True)
+            results['numpy'] = time.perf_counter() - start_time
+        conn.close()
+
+        print_bench_results("export an INTEGER and a TEXT column", results, "s")
+        assert_faster(self, results, 'array.array', 'dict path')
+
+
+class TestSnapshotBenchmarks(unittest.TestCase):
+    scan_count = 5
+
+    def test_scans_against_snapshot(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_path = os.path.join(temp_dir, 'bench.db')
+            writer_conn = sqlite3.connect(db_path)
+            writer_interface = DBTableInterface(writer_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            writer_interface.db_create_table()
+            writer_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+
+            file_conn = sqlite3.connect(db_path)
+            file_interface = DBTableInterface(file_conn, TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            snapshot = DBSnapshot(db_path)
+            start_time = time.perf_counter()
+            snapshot_interface = snapshot.get_table_interface(TestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            results = {'snapshot copy': (time.perf_counter() - start_time) * 1000}
+
+            for name, table_interface in (('file scan', file_interface), ('snapshot scan', snapshot_interface)):
+                start_time = time.perf_counter()
+                for x in range(self.scan_count):
+                    # A WRITE BETWEEN SCANS DROPS THE FILE CONNECTION'S PAGE CACHE, THE SNAPSHOT KEEPS ITS PAGES
+                    writer_interface.db_update_where_first_column_equals(('key_0', x, 'val_0'), 'key_0')
+                    rows, error = table_interface.db_select_all_from_table()
+                    self.assertEqual(len(rows), BENCH_ROW_COUNT)
+                results[name] = (time.perf_counter() - start_time) / self.scan_count * 1000
+
+            start_time = time.perf_counter()
+            snapshot.refresh()
+            results['snapshot refresh'] = (time.perf_counter() - start_time) * 1000
+            snapshot.close()
+            file_conn.close()
+            writer_conn.close()
+
+        print_bench_results("full scans of a file db with a concurrent writer", results, "ms")
+
+
+class TestInstrumentationBenchmarks(unittest.TestCase):
+    read_count = 20000
+
+    def test_instrumentation_overhead(self):
+        conn = sqlite3.connect(':memory:')
+        table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+        table_interface.db_create_table()
+        table_interface.db_insert_many(get_test_rows(1000))
+
+        def keyed_reads():
+            start_time = time.perf_counter()
+            for x in range(self.read_count):
+                table_interface.db_select_all_where_first_column_equals('key_{}'.format(x % 1000))
+            return (time.perf_counter() - start_time) / self.read_count * 1000000
+
+        results = {'disabled': keyed_reads()}
+        db_enable_instrumentation()
+        try:
+            results['enabled'] = keyed_reads()
+        finally:
+            db_disable_instrumentation()
+        results['disabled again'] = keyed_reads()
+        conn.close()
+
+        print_bench_results("keyed read with statement instrumentation ({} reads)".format(self.read_count), results, "us/read")
+
+
+class TestDBConnectionManagerBenchmarks(unittest.TestCase):
+    reader_count = 4
+    run_seconds = 1.0
+
+    def test_multi_threaded_read_write_throughput(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db_manager = DBConnectionManager(os.path.join(temp_dir, 'bench.db'))
+            table_interface = DBTableInterface(db_manager, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            table_interface.db_table_init()
+            table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+
+            stop_event = threading.Event()
+            op_counts = {}
+            errors = []
+
+            def reader(reader_index):
+                read_count = 0
+                while not stop_event.is_set():
+                    rows, error = table_interface.db_select_all_where_first_column_equals('key_{}'.format(read_count % BENCH_ROW_COUNT))
+                    if error is not None:
+                        errors.append(error)
+                    read_count += 1
+                op_counts['reader_{}'.format(reader_index)] = read_count
+                db_manager.release_connection()
+
+            def writer():
+                write_count = 0
+                while not stop_event.is_set():
+                    key = 'new_key_{}'.format(write_count)
+                    data, error = table_interface.db_insert_into_table((key, BENCH_ROW_COUNT + write_count, key))
+                    if error is not None:
+                        errors.append(error)
+                    write_count += 1
+                op_counts['writer'] = write_count
+                db_manager.release_connection()
+
+            threads = [threading.Thread(target=reader, args=(x,)) for x in range(self.reader_count)]
+            threads.append(threading.Thread(target=writer))
+            for thread in threads:
+                thread.start()
+            time.sleep(self.run_seconds)
+            stop_event.set()
+            for thread in threads:
+                thread.join()
+            db_manager.close_all()
+
+        print_bench_results("WAL per thread connections, {} readers + 1 writer".format(self.reader_count),
+                            {name: count / self.run_seconds for name, count in op_counts.items()}, "ops/s")
+        self.assertEqual(errors, [])
+        for name, count in op_counts.items():
+            self.assertGreater(count, 0, name)
+
+
+class TestDBProfileBenchmarks(unittest.TestCase):
+    small_transaction_count = 200
+    small_transaction_rows = 10
+
+    def test_profile_write_and_read_speed(self):
+        results = {}
+        for profile in (DBProfiles.DURABLE, DBProfiles.BULK_LOAD, DBProfiles.READ_MOSTLY):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                conn, error = db_connect(os.path.join(temp_dir, 'bench.db'), profile)
+                self.assertIsNone(error)
+                table_interface = DBTableInterface(conn, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+                table_interface.db_table_init()
+
+                # ONE BIG TRANSACTION
+                stats, error = table_interface.db_insert_many(get_test_rows(BENCH_ROW_COUNT))
+                self.assertIsNone(error)
+                results['{} bulk'.format(profile)] = stats[ROWS_PER_SEC_KEY]
+
+                # MANY SMALL TRANSACTIONS, EACH ONE A COMMIT THE SYNCHRONOUS SETTING HAS TO PAY FOR
+                start_time = time.perf_counter()
+                for transaction_index in range(self.small_transaction_count):
+                    first_row = BENCH_ROW_COUNT + transaction_index * self.small_transaction_rows
+                    rows = (('key_{}'.format(x), x, 'val_{}'.format(x)) for x in range(first_row, first_row + self.small_transaction_rows))
+                    stats, error = table_interface.db_insert_many(rows)
+                    self.assertIsNone(error)
+                results['{} commits'.format(profile)] = self.small_transaction_count / (time.perf_counter() - start_time)
+
+                # KEYED READS
+                start_time = time.perf_counter()
+                for x in range(BENCH_ROW_COUNT):
+                    table_interface.db_select_all_where_first_column_equals('key_{}'.format(x))
+                results['{} reads'.format(profile)] = BENCH_ROW_COUNT / (time.perf_counter() - start_time)
+                conn.close()
+
+        print_bench_results("db_connect profiles, rows/s, commits/s and keyed reads/s", results, "per s")
+
+
+class TestAsyncDBTableInterfaceBenchmarks(unittest.TestCase):
+    task_count = 50
+    ops_per_task = 20
+
+    def test_async_latency_against_to_thread(self):
+        results = {}
+
+        async def run_tasks(name, insert, select):
+            latencies = []
+
+            async def task(task_index):
+                for op_index in range(self.ops_per_task):
+                    key = 'task_{}_{}'.format(task_index, op_index)
+                    start_time = time.perf_counter()
+                    data, error = await insert((key, op_index, key))
+                    self.assertIsNone(error)
+                    rows, error = await select(key)
+                    self.assertEqual(len(rows), 1)
+                    latencies.append(time.perf_counter() - start_time)
+
+            await asyncio.gather(*[task(x) for x in range(self.task_count)])
+            latencies.sort()
+            results['{} p50'.format(name)] = statistics.median(latencies) * 1000
+            results['{} p99'.format(name)] = latencies[int(len(latencies) * 0.99)] * 1000
+
+        async def run_async_interface(db_path):
+            table = AsyncDBTableInterface(db_path, KeyedTestTableInfo.table_info_dict(), row_format=RowFormats.TUPLE)
+            await table.db_table_init()
+            await run_tasks('async interface', table.db_insert_into_table, table.db_select_all_where_first_column_equals)
+            await table.close()
+
+        async def run_to_thread(db_path):
+            # EVERY CALL COMMITS BY ITSELF AND THE WRITERS' CONNECTIONS CONTEND FOR THE WRITE LOCK
+            db_manager = DBConnectionManager(db_path, profile=DBProfiles.DURABLE)
+            table = DBTableInterface(db_manager, KeyedTestTableInfo.table_info_dict(), RowFormats.TUPLE)
+            table.db_table_init()
+            await run_tasks('asyncio.to_thread',
+                            lambda val_tuple: asyncio.to_thread(table.db_insert_into_table, val_tuple),
+                            lambda key: asyncio.to_thread(table.db_select_all_where_first_column_equals, key))
+            db_manager.close_all()
+
+        for run_func in (run_async_interface, run_to_thread):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                asyncio.run(run_func(os.path.join(temp_dir, 'bench.db')))
+
+        print_bench_results("insert + keyed select latency, {} concurrent tasks".format(self.task_count), results, "ms")
+
+
+if __name__ == '__main__':
+    unittest.main()